@@ -35,6 +35,7 @@
 
 import numpy as np
 from masp import shoebox_room_sim as srs
+import librosa
 
 # %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
 # SETUP
@@ -53,13 +54,13 @@ for nb in range(1, nBands):
     band_centerfreqs[nb] = 2 * band_centerfreqs[nb-1]
 
 # Absorption for approximately achieving the RT60 above - row per band
-abs_wall = srs.findAbsCoeffsFromRT(room, rt60)[0]
+abs_wall = srs.find_abs_coeffs_from_rt(room, rt60)[0]
 
 # Critical distance for the room
 _, d_critical, _ = srs.room_stats(room, abs_wall)
 
 # Receiver position
-rec = np.array([3.4, 2.1, 1.7])
+rec = np.array([[3.4, 2.1, 1.7]])
 nRec = rec.shape[0]
 
 # Surce start
@@ -95,5 +96,36 @@ print('Loading measured HRTF responses')
 # array_irs{1} = array_irs{1}(250+(1:256),:,:);
 # clear hrtf_mtx hrtf_dirs
 
-# TODO: TBC...
+
+# Until the HRTFs are available, the moving source is captured by an omnidirectional microphone
+mic_specs = np.array([[1, 0, 0, 1]])
+
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# RUN SIMULATOR
+
+maxlim = 0.5 # shorter than in the static examples, since an echogram is kept for each block position
+limits = np.minimum(rt60, maxlim)
+
+# Compute echograms, one "source" per block position.
+# The image sources are only updated between consecutive positions
+abs_echograms = srs.compute_echograms_trajectory(room, src, rec, abs_wall, limits, mic_specs)
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# RENDERING
+
+# Block RIRs, dimension = (L_rir, nRec, nSrc)
+mic_rirs = srs.render_rirs_mic(abs_echograms, band_centerfreqs, fs)
+
+
+# %%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%%
+# GENERATE SOUND SCENE
+# The source signal is convolved with the block RIRs in a single streaming pass,
+# crossfading between consecutive source positions along each block
+
+sourcepath = '../../data/milk_cow_blues_4src.wav'
+src_sig = librosa.core.load(sourcepath, sr=fs, mono=False)[0][0, :int(tSig*fs)]
+
+L_block = int(tBlock * fs)
+mic_sigs = srs.apply_source_signals_moving(mic_rirs, src_sig, L_block)
 
@@ -4,22 +4,44 @@ from .acoustics import room_stats
 from .compute_echograms import compute_echograms_array
 from .compute_echograms import compute_echograms_mic
 from .compute_echograms import compute_echograms_sh
+from .compute_echograms import compute_echograms_trajectory
 from .render_rirs import render_rirs_array
 from .render_rirs import render_rirs_mic
 from .render_rirs import render_rirs_sh
 from .render_rirs import render_quantised
 from .render_rirs import render_rirs # private
+from .render_rirs import render_rirs_bands
+from .render_rtfs import render_rtfs_mic
+from .render_rtfs import render_rtfs_sh
 from .render_rirs import filter_rirs # private
+from .render_rirs import filter_rirs_batch
+from .render_rirs import get_filterbank
 from .apply_source_signals import apply_source_signals_array
 from .apply_source_signals import apply_source_signals_mic
 from .apply_source_signals import apply_source_signals_sh
+from .apply_source_signals import apply_source_signals_moving
+from .convolution import StreamingConvolver
 from .echogram import Echogram
 from .echogram import QuantisedEchogram
+from .echogram import QuantisedEchogramSet
+from .echogram import ImageSourceCloud
+from .echogram import EchogramSet
+from .echogram import EchogramView
 from .absorption_module import apply_absorption
+from .absorption_module import apply_absorption_set
+from .absorption_module import apply_absorption_sweep
+from .absorption_module import get_wall_hits
 from .image_source_method import ims_coreMtx
+from .image_source_method import ims_coreMtx_batch
+from .image_source_method import ims_cloud
+from .image_source_method import ims_cloud_echograms
+from .image_source_method import ims_trajectory
+from .parallel import get_executor
+from .parallel import shutdown_executors
 from .image_source_method import ims_coreT # private
 from .image_source_method import ims_coreN # private
 from .rec_module import rec_module_mic
 from .rec_module import rec_module_sh
 from .quantise import get_echo2gridMap # private
 from .quantise import quantise_echogram # private
+from .quantise import quantise_echogram_set
@@ -35,9 +35,11 @@
 import copy
 
 import numpy as np
-from .echogram import Echogram
+from .echogram import Echogram, EchogramSet
+from .render_rirs import render_rirs_mic, render_rirs_sh
 
-from masp.validate_data_types import _validate_echogram, _validate_ndarray_2D, _validate_ndarray_1D
+from masp.validate_data_types import _validate_echogram, _validate_ndarray_2D, _validate_ndarray_1D, \
+    _validate_ndarray_3D, _validate_echogram_set, _validate_string
 from masp.utils import C
 
 def apply_absorption(echogram, alpha, limits=None):
@@ -79,6 +81,147 @@ def apply_absorption(echogram, alpha, limits=None):
     if limits is not None:
         _validate_ndarray_1D('limits', limits, size=nBands, positive=True)
 
+    # Total absorption per reflection and band, computed once on the longest echogram
+    return _apply_absorption_gains(echogram, _absorption_gains(echogram.order, alpha), limits)
+
+
+def apply_absorption_set(echogram_set, alpha, limits=None):
+    """
+    Applies per-band wall absorption to a given echogram set.
+
+    Parameters
+    ----------
+    echogram_set : EchogramSet
+        Target echogram set, without absorption (single band).
+    alpha : ndarray
+        Wall absorption coefficients per band. Dimension = (nBands, 6)
+    limits : ndarray, optional
+        Maximum reflection time per band (RT60). Dimension = (nBands)
+
+    Returns
+    -------
+    abs_echogram_set : EchogramSet
+        Echogram set subject to absorption, with `nBands` bands.
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `nBands` will be determined by the length of `alpha` first dimension.
+
+    `alpha` must have all values in the range [0,1].
+
+    If 'limits' is not specified, echograms are not truncated.
+
+    The resulting set shares the reflection data (`value`, `time`, `order`, `coords`)
+    with `echogram_set`; only the band gains and lengths are computed.
+
+    """
+
+    # Validate arguments
+    _validate_echogram_set(echogram_set)
+    if echogram_set.shape[2] != 1:
+        raise ValueError('echogram_set must have a single band')
+    _validate_ndarray_2D('abs_wall', alpha, shape1=2*C, norm=True)
+    nBands = alpha.shape[0]
+    if limits is not None:
+        _validate_ndarray_1D('limits', limits, size=nBands, positive=True)
+
+    gains = echogram_set.gains[:, 0, np.newaxis] * _absorption_gains(echogram_set.order, alpha)
+    return _absorbed_set(echogram_set, gains, limits)
+
+
+def apply_absorption_sweep(echograms, alphas, limits=None, render=None, band_centerfreqs=None, fs=None):
+    """
+    Applies several sets of per-band wall absorption to the same geometric echograms.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms, without absorption. Dimension = (nSrc, nRec)
+    alphas : ndarray
+        Wall absorption coefficients per band, for each absorption set. Dimension = (K, nBands, 6)
+    limits : ndarray, optional
+        Maximum reflection time per band (RT60). Dimension = (nBands) or (K, nBands)
+    render : str, optional
+        Also render the resulting echograms: 'mic' or 'sh'. Default to None.
+    band_centerfreqs : ndarray, optional
+        Center frequencies of the filterbank, required for rendering. Dimension = (nBands)
+    fs : int, optional
+        Target sampling rate, required for rendering.
+
+    Returns
+    -------
+    abs_echogram_sets : List
+        Echogram sets subject to absorption, one for each absorption set. Length = (K)
+    rirs : List
+        Only if `render` is given. Rendered impulse responses, one for each absorption set. Length = (K)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The image source stage is computed only once for the whole sweep:
+    `echograms` are typically the output of `ims_coreMtx_batch`, after
+    applying the receiver directivities with `rec_module_mic` or `rec_module_sh`.
+    An EchogramSet with a single band is also accepted.
+
+    All the resulting echogram sets share the reflection data of `echograms`,
+    and the wall hit counts are computed only once.
+    The gains of all absorption sets are obtained with a single matrix product.
+
+    Rendering uses `render_rirs_mic` or `render_rirs_sh`, according to `render`.
+
+    """
+
+    # Validate arguments
+    if not isinstance(echograms, EchogramSet):
+        echograms = EchogramSet.from_echograms(echograms)
+    _validate_echogram_set(echograms)
+    if echograms.shape[2] != 1:
+        raise ValueError('echograms must have a single band')
+    _validate_ndarray_3D('alphas', alphas, shape2=2*C, norm=True)
+    K, nBands, _ = alphas.shape
+    if limits is not None:
+        if limits.ndim == 1:
+            _validate_ndarray_1D('limits', limits, size=nBands, positive=True)
+            limits = np.tile(limits, (K, 1))
+        else:
+            _validate_ndarray_2D('limits', limits, shape0=K, shape1=nBands, positive=True)
+    if render is not None:
+        _validate_string('render', render, choices=['mic', 'sh'])
+
+    # Gains for all absorption sets at once. Dimension = (nRefl, K*nBands)
+    hits = get_wall_hits(echograms.order)
+    gains = echograms.gains[:, 0, np.newaxis] * _hits_gains(hits, alphas.reshape((K*nBands, 2*C)))
+
+    abs_echogram_sets = []
+    for k in range(K):
+        abs_echogram_sets.append(_absorbed_set(echograms,
+                                               gains[:, k*nBands:(k+1)*nBands],
+                                               None if limits is None else limits[k]))
+
+    if render is None:
+        return abs_echogram_sets
+
+    render_fn = render_rirs_mic if render == 'mic' else render_rirs_sh
+    rirs = []
+    for k in range(K):
+        print('Rendering absorption set ' + str(k))
+        rirs.append(render_fn(abs_echogram_sets[k], band_centerfreqs, fs))
+    return abs_echogram_sets, rirs
+
+
+def _apply_absorption_gains(echogram, s_abs_tot, limits=None):
+    """
+    Band echograms of `echogram`, truncated at `limits` and weighted by the absorption gains `s_abs_tot`.
+    Dimension = (1, nBands)
+    """
+    nBands = s_abs_tot.shape[1]
     abs_echograms = np.empty(nBands, dtype=Echogram)
 
     if limits is None:
@@ -95,55 +238,98 @@ def apply_absorption(echogram, alpha, limits=None):
                                          coords=echogram.coords[:idx_limit+1])
 
     for nb in range(nBands):
-
-        # Absorption coefficients for x, y, z walls per frequency
-        a_x = alpha[nb, 0:2]
-        a_y = alpha[nb, 2:4]
-        a_z = alpha[nb, 4:6]
-        # Reflection coefficients
-        r_x = np.sqrt(1 - a_x)
-        r_y = np.sqrt(1 - a_y)
-        r_z = np.sqrt(1 - a_z)
-
-        # Split
-        i = abs_echograms[nb].order[:, 0]
-        j = abs_echograms[nb].order[:, 1]
-        k = abs_echograms[nb].order[:, 2]
-
-        i_even = i[np.remainder(i, 2) == 0]
-        i_odd = i[np.remainder(i, 2) != 0]
-        i_odd_pos = i_odd[i_odd > 0]
-        i_odd_neg = i_odd[i_odd < 0]
-
-        j_even = j[np.remainder(j, 2) == 0]
-        j_odd = j[np.remainder(j, 2) != 0]
-        j_odd_pos = j_odd[j_odd > 0]
-        j_odd_neg = j_odd[j_odd < 0]
-
-        k_even = k[np.remainder(k, 2) == 0]
-        k_odd = k[np.remainder(k, 2) != 0]
-        k_odd_pos = k_odd[k_odd > 0]
-        k_odd_neg = k_odd[k_odd < 0]
-
-        # Find total absorption coefficients by calculating the
-        # number of hits on every surface, based on the order per dimension
-        abs_x = np.zeros(np.size(abs_echograms[nb].time))
-        abs_x[np.remainder(i, 2) == 0] = np.power(r_x[0], (np.abs(i_even) / 2.)) * np.power(r_x[1], (np.abs(i_even) / 2.))
-        abs_x[(np.remainder(i, 2) != 0) & (i > 0)] = np.power(r_x[0], np.ceil(i_odd_pos / 2.)) * np.power(r_x[1], np.floor(i_odd_pos / 2.))
-        abs_x[(np.remainder(i, 2) != 0) & (i < 0)] = np.power(r_x[0], np.floor(np.abs(i_odd_neg) / 2.)) * np.power(r_x[1], np.ceil(np.abs(i_odd_neg) / 2.))
-
-        abs_y = np.zeros(np.size(abs_echograms[nb].time))
-        abs_y[np.remainder(j, 2) == 0] = np.power(r_y[0], (np.abs(j_even) / 2.)) * np.power(r_y[1], (np.abs(j_even) / 2.))
-        abs_y[(np.remainder(j, 2) != 0) & (j > 0)] = np.power(r_y[0], np.ceil(j_odd_pos / 2.)) * np.power(r_y[1], np.floor(j_odd_pos / 2.))
-        abs_y[(np.remainder(j, 2) != 0) & (j < 0)] = np.power(r_y[0], np.floor(np.abs(j_odd_neg) / 2.)) * np.power(r_y[1], np.ceil(np.abs(j_odd_neg) / 2.))
-
-        abs_z = np.zeros(np.size(abs_echograms[nb].time))
-        abs_z[np.remainder(k, 2) == 0] = np.power(r_z[0], (np.abs(k_even) / 2.)) * np.power(r_z[1], (np.abs(k_even) / 2.))
-        abs_z[(np.remainder(k, 2) != 0) & (k > 0)] = np.power(r_z[0], np.ceil(k_odd_pos / 2.)) * np.power(r_z[1], np.floor(k_odd_pos / 2,))
-        abs_z[(np.remainder(k, 2) != 0) & (k < 0)] = np.power(r_z[0], np.floor(np.abs(k_odd_neg) / 2.)) * np.power(r_z[1], np.ceil(np.abs(k_odd_neg) / 2.))
-
-        s_abs_tot = abs_x * abs_y * abs_z
+        nRefl = np.size(abs_echograms[nb].time)
         # Final amplitude of reflection
-        abs_echograms[nb].value = (s_abs_tot * abs_echograms[nb].value.transpose()).transpose()
+        abs_echograms[nb].value = (s_abs_tot[:nRefl, nb] * abs_echograms[nb].value.transpose()).transpose()
 
     return abs_echograms[np.newaxis,:]
+
+
+def _absorbed_set(echogram_set, gains, limits):
+    """
+    Echogram set sharing the reflections of `echogram_set`, with given band gains and time limits.
+    """
+    nSrc, nRec, _ = echogram_set.shape
+    nBands = gains.shape[1]
+    offsets = echogram_set.offsets
+
+    if limits is None:
+        lengths = np.repeat(echogram_set.lengths, nBands, axis=2)
+    else:
+        # Number of reflections of each pair below the band limits
+        lengths = np.empty((nSrc, nRec, nBands), dtype=int)
+        for nb in range(nBands):
+            below = np.concatenate(([0], np.cumsum(echogram_set.time < limits[nb])))
+            lengths[:, :, nb] = (below[offsets[1:]] - below[offsets[:-1]]).reshape((nSrc, nRec))
+        lengths = np.minimum(lengths, echogram_set.lengths)
+
+    return EchogramSet(value=echogram_set.value,
+                       time=echogram_set.time,
+                       order=echogram_set.order,
+                       coords=echogram_set.coords,
+                       offsets=offsets,
+                       channels=echogram_set.channels,
+                       gains=gains,
+                       lengths=lengths)
+
+
+def get_wall_hits(order):
+    """
+    Compute the number of hits on each wall for a set of reflections.
+
+    Parameters
+    ----------
+    order : ndarray, dtype = int
+        Reflection order per dimension, as given by `Echogram.order`. Dimension = (nRefl, 3)
+
+    Returns
+    -------
+    hits : ndarray, dtype = int
+        Number of hits per wall. Dimension = (nRefl, 6)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Walls are sorted as the columns of the absorption coefficients: [x0, x1, y0, y1, z0, z1].
+    For an order `i` along a given dimension, even orders hit both walls |i|/2 times,
+    while odd orders hit the first wall once more than the second one if `i` is positive,
+    and once less if `i` is negative.
+
+    """
+
+    _validate_ndarray_2D('order', order, shape1=C, dtype=int)
+
+    odd = np.remainder(order, 2) * np.sign(order)
+    hits = np.empty((order.shape[0], 2*C), dtype=int)
+    hits[:, 0::2] = (np.abs(order) + odd) // 2
+    hits[:, 1::2] = (np.abs(order) - odd) // 2
+    return hits
+
+
+def _absorption_gains(order, alpha):
+    """
+    Total absorption gain of each reflection per band. Dimension = (nRefl, nBands)
+    """
+    return _hits_gains(get_wall_hits(order), alpha)
+
+
+def _hits_gains(hits, alpha):
+    """
+    Total absorption gain of each reflection per band, from the wall hit counts. Dimension = (nRefl, nBands)
+
+    All bands are computed at once in the log domain, as exp(hits @ log(r).T),
+    `r` being the wall reflection coefficients.
+    """
+    # Reflection coefficients
+    r = np.sqrt(1 - alpha)
+    # Fully absorbing walls (r = 0) are handled apart, as log(0) = -inf
+    absorbing = r == 0
+    log_r = np.log(np.where(absorbing, 1., r))
+
+    s_abs_tot = np.exp(np.dot(hits, log_r.T))
+    if np.any(absorbing):
+        s_abs_tot[np.dot(hits, absorbing.T) > 0] = 0.
+    return s_abs_tot
@@ -34,12 +34,14 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 import numpy as np
-import scipy.signal
+import scipy.fft
 
-from masp.validate_data_types import _validate_ndarray_3D, _validate_ndarray_2D, _validate_ndarray_4D, _validate_list
+from masp.shoebox_room_sim.convolution import _convolve_mix, _partition_fft_size, StreamingConvolver
+from masp.validate_data_types import _validate_ndarray_3D, _validate_ndarray_2D, _validate_ndarray_4D, _validate_list, \
+    _validate_boolean, _validate_ndarray_1D, _validate_int
 
 
-def apply_source_signals_array(array_rirs, src_sigs):
+def apply_source_signals_array(array_rirs, src_sigs, return_stems=False):
     """
     Apply room impulse responses from an array of receivers (microphone arrays) to a set of source signals.
 
@@ -49,11 +51,15 @@ def apply_source_signals_array(array_rirs, src_sigs):
       RIR for each receiver element. Length = (nRec)
     src_sigs: ndarray
        Matrix containing the source signals. Dimension = (L_sig, nSrc)
+    return_stems: bool, optional
+       Also return the contribution of each source. Default to False.
 
     Returns
     -------
     array_sigs : List
         Source signals subjected to the RIRs. Length = (nRec)
+    src_array_sigs : List
+        Contribution of each source, only if `return_stems`. Length = (nRec)
 
     Raises
     -----
@@ -66,8 +72,10 @@ def apply_source_signals_array(array_rirs, src_sigs):
 
     Each element of the algorithm output `array_sigs` contains the rendering of the sources from a different receiver,
     featuring a ndarray with dimension = (L_rir+L_sig-1, nMic).
+    Each element of `src_array_sigs` features a ndarray with dimension = (L_rir+L_sig-1, nMic, nSrc).
 
-    TODO: check return values
+    Source contributions are summed in place, so that only the output signals are held in memory,
+    unless `return_stems` is set.
     """
 
     _validate_list('array_rirs', array_rirs)
@@ -76,23 +84,24 @@ def apply_source_signals_array(array_rirs, src_sigs):
     assert nSrcs[1:] == nSrcs[:-1]  # Same number of sources for each receiver
     nSrc = nSrcs[0]
     _validate_ndarray_2D('src_sigs', src_sigs, shape1=nSrc)
+    _validate_boolean('return_stems', return_stems)
 
-    array_sigs = [None] * nRec      # Empty list
-    src_array_sigs = [None] * nRec  # Empty list
-    L_sig = src_sigs.shape[0]
-
+    # Mix all receivers at once, with their RIRs zero-padded to the longest one
+    L_rirs = [array_rirs[nr].shape[0] for nr in range(nRec)]
+    nMics = [array_rirs[nr].shape[1] for nr in range(nRec)]
+    offsets = np.concatenate(([0], np.cumsum(nMics)))
+    rirs = np.zeros((max(L_rirs), offsets[-1], nSrc))
     for nr in range(nRec):
-        temprirs = array_rirs[nr]
-        L_rir = temprirs.shape[0]
-        nMics = temprirs.shape[1]
-        tempsigs = np.zeros((L_sig + L_rir - 1, nMics, nSrc))
-        for ns in range(nSrc):
-            print('Convolving with source signal: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            tempsigs[:, :, ns] = scipy.signal.fftconvolve(temprirs[:, :, ns], src_sigs[:, ns, np.newaxis], axes=0)
-        src_array_sigs[nr] = tempsigs
-        array_sigs[nr] = np.sum(tempsigs, axis=2)
+        rirs[:L_rirs[nr], offsets[nr]:offsets[nr+1], :] = array_rirs[nr]
 
-    # return array_sigs, src_array_sigs
+    print('Convolving with source signals')
+    sigs, stems = _mix_sources(rirs, src_sigs, return_stems)
+    L_sig = src_sigs.shape[0]
+    array_sigs = [sigs[:L_sig+L_rirs[nr]-1, offsets[nr]:offsets[nr+1]] for nr in range(nRec)]
+
+    if return_stems:
+        src_array_sigs = [stems[:L_sig+L_rirs[nr]-1, offsets[nr]:offsets[nr+1], :] for nr in range(nRec)]
+        return array_sigs, src_array_sigs
     return array_sigs
 
 
@@ -128,16 +137,13 @@ def apply_source_signals_mic(mic_rirs, src_sigs):
     _validate_ndarray_3D('mic_rirs', mic_rirs)
     _validate_ndarray_2D('src_sigs', src_sigs, shape1=nSrc)
 
-    mic_sigs = np.zeros((L_sig + L_rir - 1, nRec))
-    for nr in range(nRec):
-        for ns in range(nSrc):
-            print('Convolving with source signal: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            mic_sigs[:, nr] = mic_sigs[:, nr] + scipy.signal.fftconvolve(mic_rirs[:, nr, ns], src_sigs[:, ns])
+    print('Convolving with source signals')
+    mic_sigs, _ = _mix_sources(mic_rirs, src_sigs)
 
     return mic_sigs
 
 
-def apply_source_signals_sh(sh_rirs, src_sigs):
+def apply_source_signals_sh(sh_rirs, src_sigs, return_stems=False):
     """
     Apply spherical harmonic room impulse responses to a set of source signals.
 
@@ -147,11 +153,15 @@ def apply_source_signals_sh(sh_rirs, src_sigs):
        Matrix containing the room impulse responses. Dimension = (L_rir, nSH, nRec, nSrc)
     src_sigs: ndarray
        Matrix containing the source signals. Dimension = (L_sig, nSrc)
+    return_stems: bool, optional
+       Also return the contribution of each source. Default to False.
 
     Returns
     -------
     sh_sigs : ndarray
         Source signals subjected to the RIRs. Dimension = = (L_rir+L_sig-1, nSH, nRec)
+    src_sh_sigs : ndarray
+        Contribution of each source, only if `return_stems`. Dimension = (L_rir+L_sig-1, nSH, nRec, nSrc)
 
     Raises
     -----
@@ -161,7 +171,8 @@ def apply_source_signals_sh(sh_rirs, src_sigs):
     -----
     The number of source positions (shape[3]) in `sh_rirs` should match the number of sources (shape[1]) in `src_sigs`.
 
-    TODO: check return values
+    Source contributions are summed in place, so that only the output signals are held in memory,
+    unless `return_stems` is set.
     """
 
     L_rir = sh_rirs.shape[0]
@@ -171,17 +182,135 @@ def apply_source_signals_sh(sh_rirs, src_sigs):
     L_sig = src_sigs.shape[0]
     _validate_ndarray_4D('mic_rirs', sh_rirs)
     _validate_ndarray_2D('src_sigs', src_sigs, shape1=nSrc)
+    _validate_boolean('return_stems', return_stems)
 
-    sh_sigs = np.zeros((L_sig + L_rir - 1, nSH, nRec))
-    src_sh_sigs = np.zeros((L_sig + L_rir - 1, nSH, nRec, nSrc))
-    for nr in range(nRec):
-        for ns in range(nSrc):
-            print('Convolving with source signal: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Just apply convolution to non-zero channels (skip empty channels due to different sh orders)
-            idx_nonzero = np.sum(sh_rirs[:,:, nr, ns],axis=0) != 0
-            src_sh_sigs[:, idx_nonzero, nr, ns] = scipy.signal.fftconvolve(sh_rirs[:, idx_nonzero, nr, ns], src_sigs[:, ns, np.newaxis], axes=0)
-    sh_sigs = np.sum(src_sh_sigs, axis=3)
+    print('Convolving with source signals')
+    sh_sigs, src_sh_sigs = _mix_sources(sh_rirs.reshape((L_rir, nSH * nRec, nSrc)), src_sigs, return_stems)
+    sh_sigs = sh_sigs.reshape((L_sig + L_rir - 1, nSH, nRec))
 
-    # return sh_sigs, src_sh_sigs
+    if return_stems:
+        return sh_sigs, src_sh_sigs.reshape((L_sig + L_rir - 1, nSH, nRec, nSrc))
     return sh_sigs
 
+
+def apply_source_signals_moving(rirs, src_sig, block_size):
+    """
+    Apply the room impulse responses of a moving source to its signal.
+
+    Parameters
+    ----------
+    rirs : ndarray or List
+        RIRs at consecutive source positions, given as the sources of `render_rirs_mic` (L_rir, nRec, nPos),
+        `render_rirs_sh` (L_rir, nSH, nRec, nPos) or `render_rirs_array` (List of (L_rir, nMic, nPos)).
+    src_sig: ndarray
+        Source signal. Dimension = (L_sig)
+    block_size: int
+        Number of samples between consecutive source positions.
+
+    Returns
+    -------
+    sigs : ndarray or List
+        Source signal subjected to the time-varying RIRs. Dimension = (L_rir+L_sig-1, nRec) for mic RIRs,
+        (L_rir+L_sig-1, nSH, nRec) for sh RIRs, or List of (L_rir+L_sig-1, nMic) for array RIRs.
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Position `k` corresponds to the sample `k*block_size` of the signal. Along each block, the output is linearly
+    crossfaded from the RIRs of one position to the next one, and the last position is kept afterwards.
+    Therefore, ceil(L_sig/block_size)+1 positions cover the whole signal.
+
+    The signal is rendered in a single pass through a `StreamingConvolver` with partitions of `block_size`,
+    where each block is mixed with the RIRs of its two positions, instead of a full convolution per position.
+    """
+
+    _validate_ndarray_1D('src_sig', src_sig)
+    _validate_int('block_size', block_size, positive=True)
+    if isinstance(rirs, list):
+        _validate_list('rirs', rirs)
+        for nr in range(len(rirs)):
+            _validate_ndarray_3D('rirs_' + str(nr), rirs[nr])
+        nPos = rirs[0].shape[-1]
+        if any(r.shape[-1] != nPos for r in rirs):
+            raise ValueError('rirs must have the same number of positions for all receivers')
+    else:
+        if not isinstance(rirs, np.ndarray):
+            raise TypeError('rirs must be an instance of ndarray or list')
+        if rirs.ndim not in (3, 4):
+            raise ValueError('rirs must be a 3D or 4D ndarray')
+        nPos = rirs.shape[-1]
+
+    def position(k):
+        k = min(k, nPos - 1)
+        return [r[..., k:k+1] for r in rirs] if isinstance(rirs, list) else rirs[..., k:k+1]
+
+    convolver = StreamingConvolver(position(0), block_size)
+    L_sig = src_sig.size
+    nBlocks = -(-(L_sig + convolver.L_rir - 1) // block_size)
+    x = np.zeros((nBlocks * block_size, 1))
+    x[:L_sig, 0] = src_sig
+
+    print('Convolving with moving source signal')
+    blocks = []
+    for nb in range(nBlocks):
+        if nb + 1 < nPos:
+            convolver.update(position(nb + 1))
+        blocks.append(convolver.process(x[nb*block_size:(nb+1)*block_size]))
+
+    if isinstance(rirs, list):
+        return [np.concatenate([b[nr] for b in blocks])[:L_sig+rirs[nr].shape[0]-1] for nr in range(len(rirs))]
+    return np.concatenate(blocks)[:L_sig+convolver.L_rir-1]
+
+
+def _mix_sources(rirs, src_sigs, return_stems=False):
+    """
+    Convolve each source signal with its RIRs, and sum all sources, in the frequency domain.
+
+    Parameters
+    ----------
+    rirs : ndarray
+        Room impulse responses of each output channel and source. Dimension = (L_rir, nChannels, nSrc)
+    src_sigs: ndarray
+        Matrix containing the source signals. Dimension = (L_sig, nSrc)
+    return_stems: bool, optional
+        Also return the contribution of each source. Default to False.
+
+    Returns
+    -------
+    sigs : ndarray
+        Sum of the convolved source signals. Dimension = (L_rir+L_sig-1, nChannels)
+    stems : ndarray or None
+        Convolved signal of each source, only if `return_stems`. Dimension = (L_rir+L_sig-1, nChannels, nSrc)
+
+    Notes
+    -----
+    Each source signal block and each RIR are transformed once, the sources are summed
+    by a matrix product per frequency, and one inverse transform is run per channel and block.
+    The output blocks are accumulated in place into `sigs`.
+    Channels with no energy in any RIR (e.g. unused spherical harmonics) are not processed.
+    """
+
+    L_rir, nChannels, nSrc = rirs.shape
+    L_sig = src_sigs.shape[0]
+
+    sigs = np.zeros((L_sig + L_rir - 1, nChannels))
+    stems = np.zeros((L_sig + L_rir - 1, nChannels, nSrc)) if return_stems else None
+    active = np.flatnonzero(np.any(rirs != 0, axis=(0, 2)))
+    if active.size == 0:
+        return sigs, stems
+
+    # Blocks as long as the RIRs, which keeps the RIR spectra at twice the RIR size
+    nfft = _partition_fft_size(L_sig, L_rir, ratio=1)
+    columns = None if active.size == nChannels else active
+    rirs_f = scipy.fft.rfft(rirs if columns is None else rirs[:, active, :], nfft, axis=0).transpose((0, 2, 1))
+    if return_stems:
+        for ns in range(nSrc):
+            _convolve_mix(src_sigs[:, ns:ns+1], rirs_f[:, ns:ns+1, :], nfft, L_rir, out=stems[:, :, ns], columns=columns)
+        np.sum(stems, axis=2, out=sigs)
+    else:
+        _convolve_mix(src_sigs, rirs_f, nfft, L_rir, out=sigs, columns=columns)
+
+    return sigs, stems
@@ -36,13 +36,15 @@
 import numpy as np
 
 from masp.utils import C
-from masp.validate_data_types import _validate_ndarray_2D, _validate_ndarray_1D, _validate_int
-from .echogram import Echogram
-from .image_source_method import ims_coreMtx
+from masp.validate_data_types import _validate_ndarray_2D, _validate_ndarray_1D, _validate_int, _validate_boolean, \
+    _validate_n_jobs
+from .echogram import Echogram, EchogramSet
+from .image_source_method import ims_coreMtx_batch, _ims_lattice, _ims_trajectory, _trajectory_positions
 from .rec_module import rec_module_mic, rec_module_sh
-from .absorption_module import apply_absorption
+from .absorption_module import apply_absorption, apply_absorption_set, _apply_absorption_gains, _absorption_gains
+from .parallel import parallel_map, get_num_workers
 
-def compute_echograms_array(room, src, rec, abs_wall, limits):
+def compute_echograms_array(room, src, rec, abs_wall, limits, as_set=False, n_jobs=None):
     """
     Compute the echogram response of a microphone array for a given acoustic scenario.
 
@@ -58,10 +60,14 @@ def compute_echograms_array(room, src, rec, abs_wall, limits):
         Wall absorption coefficients per band. Dimension = (nBands, 6)
     limits : ndarray
         Maximum echogram computation time per band.  Dimension = (nBands)
+    as_set : bool, optional
+        Return the echograms as an EchogramSet. Default to False.
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
 
     Returns
     -------
-    abs_echograms : ndarray, dtype = Echogram
+    abs_echograms : ndarray, dtype = Echogram, or EchogramSet
         Array with rendered echograms. Dimension = (nSrc, nRec, nBands)
 
     Raises
@@ -89,6 +95,9 @@ def compute_echograms_array(room, src, rec, abs_wall, limits):
     `abs_wall` must have all values in the range [0,1].
     `nBands` will be determined by the length of `abs_wall` first dimension.
 
+    With `n_jobs`, the (source, receiver) pairs are split in blocks which are
+    computed in a process pool. The result is bitwise identical to the serial computation.
+
     TODO: expose type as parameter?, validate return
     """
 
@@ -101,32 +110,15 @@ def compute_echograms_array(room, src, rec, abs_wall, limits):
     _validate_ndarray_2D('rec', rec, shape1=C, positive=True)
     _validate_ndarray_2D('abs_wall', abs_wall, shape1=2*C, positive=True)
     _validate_ndarray_1D('limits', limits, positive=True, size=nBands)
+    _validate_boolean('as_set', as_set)
+    _validate_n_jobs('n_jobs', n_jobs)
 
-    # Limit the RIR by reflection order or by time-limit
-    type = 'maxTime'
-
-    echograms = np.empty((nSrc, nRec), dtype=Echogram)
     # Compute echogram due to pure propagation (frequency-independent)
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print('Compute echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Compute echogram
-            echograms[ns, nr] = ims_coreMtx(room, src[ns,:], rec[nr,:], type, np.max(limits))
-
-    abs_echograms = np.empty((nSrc, nRec, nBands), dtype=Echogram)
-    # Apply boundary absorption
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print('Apply absorption: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Compute echogram
-            abs_echograms[ns, nr] = apply_absorption(echograms[ns, nr], abs_wall, limits)
-
-    # return abs_echograms, echograms
-    return abs_echograms
-
+    print('Compute echograms: ' + str(nSrc) + ' Sources - ' + str(nRec) + ' Receivers')
+    return _compute_echograms(room, src, rec, abs_wall, limits, as_set, n_jobs)
 
 
-def compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs):
+def compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs, as_set=False, n_jobs=None):
     """
     Compute the echogram response of individual microphones for a given acoustic scenario.
 
@@ -144,10 +136,14 @@ def compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs):
         Maximum echogram computation time per band.  Dimension = (nBands)
     mic_specs : ndarray
         Microphone directions and directivity factor. Dimension = (nRec, 4)
+    as_set : bool, optional
+        Return the echograms as an EchogramSet. Default to False.
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
 
     Returns
     -------
-    abs_echograms : ndarray, dtype = Echogram
+    abs_echograms : ndarray, dtype = Echogram, or EchogramSet
         Array with rendered echograms. Dimension = (nSrc, nRec, nBands)
 
     Raises
@@ -175,6 +171,9 @@ def compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs):
     `abs_wall` must have all values in the range [0,1].
     `nBands` will be determined by the length of `abs_wall` first dimension.
 
+    With `n_jobs`, the (source, receiver) pairs are split in blocks which are
+    computed in a process pool. The result is bitwise identical to the serial computation.
+
     Each row of `mic_specs` is expected to be described as [x, y, z, alpha],
     with (x, y, z) begin the unit vector of the mic orientation.
     `alpha` must be contained in the range [0(dipole), 1(omni)],
@@ -194,34 +193,16 @@ def compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs):
     _validate_ndarray_2D('abs_wall', abs_wall, shape1=2*C, positive=True)
     _validate_ndarray_1D('limits', limits, positive=True, size=nBands)
     _validate_ndarray_2D('mic_specs', mic_specs, shape0=nRec, shape1=C+1)
-
-    # Limit the RIR by reflection order or by time-limit
-    type = 'maxTime'
+    _validate_boolean('as_set', as_set)
+    _validate_n_jobs('n_jobs', n_jobs)
 
     # Compute echogram due to pure propagation (frequency-independent)
-    echograms = np.empty((nSrc, nRec), dtype=Echogram)
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print('Compute echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Compute echogram
-            echograms[ns, nr] = ims_coreMtx(room, src[ns,:], rec[nr,:], type, np.max(limits))
-
+    print('Compute echograms: ' + str(nSrc) + ' Sources - ' + str(nRec) + ' Receivers')
     print('Apply receiver direcitivites')
-    rec_echograms = rec_module_mic(echograms, mic_specs)
-
-    abs_echograms = np.empty((nSrc, nRec, nBands), dtype=Echogram)
-    # Apply boundary absorption
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print('Apply absorption: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Compute echogram
-            abs_echograms[ns, nr] = apply_absorption(rec_echograms[ns, nr], abs_wall, limits)
-
-    # return abs_echograms, rec_echograms, echograms
-    return abs_echograms
+    return _compute_echograms(room, src, rec, abs_wall, limits, as_set, n_jobs, rec_module_mic, mic_specs)
 
 
-def compute_echograms_sh(room, src, rec, abs_wall, limits, sh_orders):
+def compute_echograms_sh(room, src, rec, abs_wall, limits, sh_orders, as_set=False, n_jobs=None):
     """
     Compute the echogram response of individual microphones for a given acoustic scenario,
     in the spherical harmonic domain.
@@ -240,10 +221,14 @@ def compute_echograms_sh(room, src, rec, abs_wall, limits, sh_orders):
         Maximum echogram computation time per band.  Dimension = (nBands)
     sh_orders : int or ndarray, dtype = int
         Spherical harmonic expansion order. Dimension = 1 or (nRec)
+    as_set : bool, optional
+        Return the echograms as an EchogramSet. Default to False.
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
 
     Returns
     -------
-    abs_echograms : ndarray, dtype = Echogram
+    abs_echograms : ndarray, dtype = Echogram, or EchogramSet
         Array with rendered echograms. Dimension = (nSrc, nRec, nBands)
 
     Raises
@@ -271,6 +256,12 @@ def compute_echograms_sh(room, src, rec, abs_wall, limits, sh_orders):
     `abs_wall` must have all values in the range [0,1].
     `nBands` will be determined by the length of `abs_wall` first dimension.
 
+    With `n_jobs`, the (source, receiver) pairs are split in blocks which are
+    computed in a process pool. The result is bitwise identical to the serial computation,
+    except for the SH directivity gains from `get_sh`, which may differ in their last bit:
+    the vectorised trigonometric kernels behind `sph_harm` round depending on the memory alignment
+    of the directions, so they are not reproducible bitwise even between two serial runs.
+
     If `sh_orders` is an integer, the given order will be applied to all receivers.
     'nRec' will be determined by the length of `rec` first dimension.
 
@@ -291,28 +282,173 @@ def compute_echograms_sh(room, src, rec, abs_wall, limits, sh_orders):
         sh_orders = sh_orders * np.ones(nRec, dtype=int)
     else:
         _validate_ndarray_1D('sh_orders', sh_orders, size=nRec, positive=True, dtype=int)
+    _validate_boolean('as_set', as_set)
+    _validate_n_jobs('n_jobs', n_jobs)
 
-    # Limit the RIR by reflection order or by time-limit
-    type = 'maxTime'
     # Compute echogram due to pure propagation (frequency-independent)
-    echograms = np.empty((nSrc, nRec), dtype=Echogram)
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print('Compute echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            # Compute echogram
-            echograms[ns, nr] = ims_coreMtx(room, src[ns,:], rec[nr,:], type, np.max(limits))
-
+    print('Compute echograms: ' + str(nSrc) + ' Sources - ' + str(nRec) + ' Receivers')
     print('Apply SH directivites')
-    rec_echograms = rec_module_sh(echograms, sh_orders)
+    return _compute_echograms(room, src, rec, abs_wall, limits, as_set, n_jobs, rec_module_sh, sh_orders)
+
+
+def compute_echograms_trajectory(room, src, rec, abs_wall, limits, mic_specs=None):
+    """
+    Compute the echogram response of a moving source and/or receiver for a given acoustic scenario.
+
+    Parameters
+    ----------
+    room : ndarray
+        Room dimensions in cartesian coordinates. Dimension = (3) [x, y, z].
+    src : ndarray
+        Source positions along the trajectory in cartesian coordinates. Dimension = (nPos, 3) or (1, 3) [[x, y, z]].
+    rec : ndarray
+        Receiver positions along the trajectory in cartesian coordinates. Dimension = (nPos, 3) or (1, 3) [[x, y, z]].
+    abs_wall : ndarray
+        Wall absorption coefficients per band. Dimension = (nBands, 6)
+    limits : ndarray
+        Maximum echogram computation time per band.  Dimension = (nBands)
+    mic_specs : ndarray, optional
+        Microphone direction and directivity factor. Dimension = (1, 4). Default to None (omni).
 
-    abs_echograms = np.empty((nSrc, nRec, nBands), dtype=Echogram)
+    Returns
+    -------
+    abs_echograms : ndarray, dtype = Echogram
+        Array with rendered echograms. Dimension = (nPos, 1, nBands)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `src` and `rec` positions are specified from the left ground corner
+    of the room, using a left-handed coordinate system, as in `compute_echograms_mic`.
+    A single source or receiver position is kept static along the trajectory.
+
+    The trajectory positions are placed along the first (source) dimension,
+    so that the rendered responses can be directly used by `apply_source_signals_moving`.
+
+    The result is the same as calling `compute_echograms_mic` at every position,
+    but the image source lattice and the absorption gains are computed only once.
+    For each position, only the distances are updated, and the reflections are
+    re-sorted starting from the order of the previous position (see `ims_trajectory`).
+
+    The `mic_specs` row is described as [x, y, z, alpha], as in `compute_echograms_mic`.
+
+    """
+
+    _validate_ndarray_1D('room', room, size=C, positive=True)
+    _validate_ndarray_2D('src', src, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_ndarray_2D('rec', rec, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_ndarray_2D('abs_wall', abs_wall, shape1=2*C, positive=True)
+    nBands = abs_wall.shape[0]
+    _validate_ndarray_1D('limits', limits, positive=True, size=nBands)
+    if mic_specs is not None:
+        _validate_ndarray_2D('mic_specs', mic_specs, shape0=1, shape1=C+1)
+    src, rec = _trajectory_positions(room, src, rec)
+    nPos = src.shape[0]
+
+    print('Compute echograms: ' + str(nPos) + ' Trajectory positions')
+    # Limit the RIR by time-limit
+    i, j, k, d_max = _ims_lattice(room, 'maxTime', np.max(limits))
+    # Absorption gains of the whole lattice, shared by all positions
+    lattice_gains = _absorption_gains(np.asarray(np.stack([i, j, k], axis=1), dtype=int), abs_wall)
+
+    abs_echograms = np.empty((nPos, 1, nBands), dtype=Echogram)
+    for n, (sel, echogram) in enumerate(_ims_trajectory(room, src, rec, i, j, k, d_max)):
+        if mic_specs is not None:
+            echogram = rec_module_mic(np.asarray([[echogram]]), mic_specs)[0, 0]
+        abs_echograms[n] = _apply_absorption_gains(echogram, lattice_gains[sel], limits)
+    return abs_echograms
+
+
+def _compute_echograms(room, src, rec, abs_wall, limits, as_set, n_jobs, rec_module=None, rec_params=None):
+    """
+    Compute the absorbed echograms of all source/receiver pairs, split in blocks.
+
+    Each block holds one source and a contiguous range of receivers (or all pairs, in serial mode),
+    and is computed by `_compute_echograms_block`, possibly in a process pool.
+    """
+
+    nSrc = src.shape[0]
+    nRec = rec.shape[0]
+    nBands = abs_wall.shape[0]
+
+    n_workers = get_num_workers(n_jobs)
+    if n_workers == 1:
+        blocks = [(range(nSrc), range(nRec))]
+    else:
+        # Split receivers so that there are at least as many blocks as workers
+        nChunks = min(nRec, -(-n_workers // nSrc))
+        blocks = [(range(ns, ns+1), range(chunk[0], chunk[-1]+1))
+                  for ns in range(nSrc) for chunk in np.array_split(np.arange(nRec), nChunks)]
+
+    # Absorption is applied to the EchogramSet as a whole
+    block_abs_wall = None if as_set else abs_wall
+    results = parallel_map(_compute_echograms_block,
+                           [(room, src, rec, block_abs_wall, limits, ns_range, nr_range, rec_module, rec_params)
+                            for ns_range, nr_range in blocks],
+                           n_jobs)
+
+    shape = (nSrc, nRec) if as_set else (nSrc, nRec, nBands)
+    echograms = np.empty(shape, dtype=Echogram)
+    for (ns_range, nr_range), result in zip(blocks, results):
+        echograms[ns_range.start:ns_range.stop, nr_range.start:nr_range.stop] = result
+
+    if as_set:
+        print('Apply absorption')
+        return apply_absorption_set(EchogramSet.from_echograms(echograms), abs_wall, limits)
+    return echograms
+
+
+def _compute_echograms_block(room, src, rec, abs_wall, limits, ns_range, nr_range, rec_module=None, rec_params=None):
+    """
+    Compute the echograms of a block of source/receiver pairs.
+
+    Parameters
+    ----------
+    room : ndarray
+        Room dimensions in cartesian coordinates. Dimension = (3) [x, y, z].
+    src : ndarray
+        Source position in cartesian coordinates. Dimension = (nSrc, 3) [[x, y, z]].
+    rec : ndarray
+        Receiver position in cartesian coordinates. Dimension = (nRec, 3) [[x, y, z]].
+    abs_wall : ndarray or None
+        Wall absorption coefficients per band. Dimension = (nBands, 6)
+    limits : ndarray
+        Maximum echogram computation time per band.  Dimension = (nBands)
+    ns_range : range
+        Indices of the block sources.
+    nr_range : range
+        Indices of the block receivers.
+    rec_module : callable, optional
+        Receiver module (`rec_module_mic` or `rec_module_sh`) to apply. Default to None.
+    rec_params : ndarray, optional
+        Receiver module parameters for all receivers. First dimension = (nRec)
+
+    Returns
+    -------
+    echograms : ndarray, dtype = Echogram
+        Block echograms. Dimension = (len(ns_range), len(nr_range), nBands),
+        or (len(ns_range), len(nr_range)) if `abs_wall` is None.
+    """
+
+    # Limit the RIR by reflection order or by time-limit
+    type = 'maxTime'
+    echograms = ims_coreMtx_batch(room, src[ns_range.start:ns_range.stop], rec[nr_range.start:nr_range.stop],
+                                  type, np.max(limits))
+    if rec_module is not None:
+        echograms = rec_module(echograms, rec_params[nr_range.start:nr_range.stop])
+    if abs_wall is None:
+        return echograms
+
+    nBands = abs_wall.shape[0]
+    abs_echograms = np.empty(echograms.shape + (nBands,), dtype=Echogram)
     # Apply boundary absorption
-    for ns in range(nSrc):
-        for nr in range(nRec):
-            print ('Apply absorption: Source ' + str(ns) + ' - Receiver ' + str(nr))
+    for i, ns in enumerate(ns_range):
+        for j, nr in enumerate(nr_range):
+            print('Apply absorption: Source ' + str(ns) + ' - Receiver ' + str(nr))
             # Compute echogram
-            abs_echograms[ns, nr] = apply_absorption(rec_echograms[ns, nr], abs_wall, limits)
+            abs_echograms[i, j] = apply_absorption(echograms[i, j], abs_wall, limits)
 
-    # return abs_echograms, rec_echograms, echograms
     return abs_echograms
-
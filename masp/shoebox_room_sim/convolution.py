@@ -0,0 +1,390 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Copyright (c) 2019, Eurecat / UPF
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#   @file   convolution.py
+#   @author Andrés Pérez-López
+#   @date   09/09/2019
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import numpy as np
+import scipy.fft
+
+from masp.validate_data_types import _validate_int, _validate_list, _validate_ndarray_2D
+
+# Maximum number of frequency bins mixed at once
+_MIX_SIZE = 2**23
+
+
+def _partition_fft_size(L_in, L_resp, ratio=3):
+    """
+    FFT size of the partitioned convolution of signals of length L_in with responses of length L_resp.
+    Blocks are at least `ratio` times longer than the responses, or cover the whole signal.
+    Longer blocks reduce the mixing cost per sample, at the expense of larger response spectra.
+    """
+    return scipy.fft.next_fast_len(min(L_in, ratio * L_resp) + L_resp - 1, real=True)
+
+
+def _convolve_mix(x, H, nfft, L_resp, out=None, columns=None):
+    """
+    Convolve a set of signals with a matrix of responses, and mix them, by uniformly partitioned overlap-add.
+
+    Parameters
+    ----------
+    x : ndarray
+        Input signals. Dimension = (L_in, nIn)
+    H : ndarray
+        Spectra of the responses from each input to each output, at `nfft` points. Dimension = (nfft//2+1, nIn, nOut)
+    nfft : int
+        FFT size, at least L_resp.
+    L_resp : int
+        Length of the responses.
+    out : ndarray, optional
+        Array where the output signals are accumulated in place, instead of a new one.
+        Dimension = (L_in+L_resp-1, nChannels)
+    columns : ndarray, optional
+        Columns of `out` receiving each output signal. Dimension = (nOut)
+
+    Returns
+    -------
+    y : ndarray
+        Output signals, y[:, o] = sum_i conv(x[:, i], h[:, i, o]). Dimension = (L_in+L_resp-1, nOut)
+    """
+
+    L_in, nIn = x.shape
+    nOut = H.shape[2]
+    L_out = L_in + L_resp - 1
+    hop = nfft - L_resp + 1
+    nBlocks = -(-L_in // hop)
+    if out is None:
+        out = np.zeros((L_out, nOut))
+    if columns is None:
+        columns = slice(None)
+    if nIn == 0:
+        return out
+
+    # Process by chunks of blocks, to bound memory usage
+    chunk_size = max(1, _MIX_SIZE // (H.shape[0] * max(nIn, nOut)))
+    for b0 in range(0, nBlocks, chunk_size):
+        b1 = min(b0 + chunk_size, nBlocks)
+        blocks = np.zeros(((b1 - b0) * hop, nIn))
+        n = min(b1 * hop, L_in) - b0 * hop
+        blocks[:n] = x[b0*hop:b0*hop+n]
+        # Input spectra are transformed once, and mixed into all outputs with a matrix product per frequency
+        X = scipy.fft.rfft(blocks.reshape((b1 - b0, hop, nIn)), nfft, axis=1)
+        Y = np.matmul(X.transpose((1, 0, 2)), H)
+        y_blocks = scipy.fft.irfft(Y, nfft, axis=0)
+        # Overlap-add into the output
+        for nb in range(b0, b1):
+            n0 = nb * hop
+            n1 = min(n0 + nfft, L_out)
+            out[n0:n1, columns] += y_blocks[:n1-n0, nb-b0]
+
+    return out
+
+
+class StreamingConvolver:
+    """
+    Block-streaming convolution of source signals with room impulse responses.
+
+    Parameters
+    ----------
+    rirs : ndarray or List
+        Room impulse responses, as given by `render_rirs_mic` (L_rir, nRec, nSrc), `render_rirs_sh`
+        (L_rir, nSH, nRec, nSrc) or `render_rirs_array` (List of (L_rir, nMic, nSrc), Length = (nRec)).
+    block_size : int, optional
+        Number of samples of each processed block. Default to 1024.
+    tail_block_size : int, optional
+        Partition size of the RIR tail, multiple of `block_size`. Default to None (uniform partitions).
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The RIRs are split into partitions of `block_size` samples, which are transformed once.
+    Each input block is transformed once, stored in a frequency-domain delay line,
+    and mixed with all partitions and sources by uniformly partitioned overlap-save.
+    Memory usage only depends on the RIRs and the block size, and not on the length of the signals.
+
+    `process()` takes one block of all source signals, and returns the output block at the same time instants.
+    Therefore, the latency of a real-time system built on it is `latency` = `block_size` samples.
+    The output equals the first samples of `apply_source_signals_*`.
+    Array RIRs of different lengths are zero-padded to the longest one, and so are their outputs.
+
+    By default, partitions are uniform: all blocks have the same size and cost, but each block is mixed
+    with L_rir / block_size partitions, which is expensive for long RIRs and small blocks.
+    With `tail_block_size`, partitions are non-uniform: the first `tail_block_size` samples of the RIRs
+    are split into partitions of `block_size`, and the rest into partitions of `tail_block_size`,
+    handled by a nested convolver. The tail of each input block is needed one tail block later,
+    so the latency is unchanged. The total cost drops roughly by `tail_block_size / block_size` for long RIRs,
+    but the tail is processed at once every `tail_block_size / block_size` blocks, so that the processing
+    time of the blocks is no longer fixed.
+    With `update()`, the tail is crossfaded along a tail block instead of a block.
+
+    """
+
+    def __init__(self, rirs, block_size=1024, tail_block_size=None):
+        _validate_int('block_size', block_size, positive=True)
+        if tail_block_size is not None:
+            _validate_int('tail_block_size', tail_block_size, positive=True)
+            if tail_block_size % block_size != 0:
+                raise ValueError('tail_block_size must be a multiple of block_size')
+        h, self._L_rirs, self._offsets, self._channel_shape = _stack_rirs(rirs)
+
+        self.L_rir, self.nChannels, self.nSrc = h.shape
+        self.block_size = block_size
+        self.tail_block_size = tail_block_size
+        self.latency = block_size
+        # Samples of the RIRs covered by the block_size partitions
+        self._L_head = self.L_rir if tail_block_size is None else min(self.L_rir, tail_block_size)
+        self._H = self._transform(h[:self._L_head])
+        self._tail = None
+        if self._L_head < self.L_rir:
+            self._tail = StreamingConvolver(h[self._L_head:], tail_block_size)
+        self.reset()
+
+    def reset(self):
+        """
+        Clear the input history, to start processing a new signal.
+        """
+        nParts = self._H.shape[1]
+        # Frequency-domain delay line, newest block first from `_head`. Dimension = (B+1, nParts, nSrc)
+        self._fdl = np.zeros((self.block_size + 1, nParts, self.nSrc), dtype=complex)
+        self._head = 0
+        self._last = np.zeros((self.block_size, self.nSrc))
+        self._H_old = None
+        if self._tail is not None:
+            self._tail.reset()
+            # Input of the current tail block, and tail output of the previous one
+            self._tail_in = np.zeros((self.tail_block_size, self.nSrc))
+            self._tail_out = np.zeros((self.tail_block_size, self.nChannels))
+            self._tail_pos = 0
+
+    def update(self, rirs):
+        """
+        Replace the room impulse responses, e.g. for a moving source or receiver.
+
+        Parameters
+        ----------
+        rirs : ndarray or List
+            New room impulse responses, with the same dimensions as the initial ones.
+
+        Raises
+        -----
+        TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+        Notes
+        -----
+        The input history is kept. The next processed block is rendered with both the previous and the new RIRs,
+        and linearly crossfaded from the former to the latter along the block.
+        """
+        h = _stack_rirs(rirs)[0]
+        if h.shape != (self.L_rir, self.nChannels, self.nSrc):
+            raise ValueError('rirs must have the same dimensions as the initial ones')
+        if self._H_old is None:
+            self._H_old = self._H
+        self._H = self._transform(h[:self._L_head])
+        if self._tail is not None:
+            self._tail.update(h[self._L_head:])
+
+    def process(self, block):
+        """
+        Convolve the next block of the source signals.
+
+        Parameters
+        ----------
+        block : ndarray
+            Next samples of the source signals. Dimension = (block_size, nSrc)
+
+        Returns
+        -------
+        out : ndarray or List
+            Next samples of the output signals, in the shape of the RIR channels:
+            (block_size, nRec) for mic, (block_size, nSH, nRec) for sh, or a List of (block_size, nMic) for array RIRs.
+
+        Raises
+        -----
+        TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+        """
+        if isinstance(block, np.ndarray) and block.ndim == 1 and self.nSrc == 1:
+            block = block[:, np.newaxis]
+        _validate_ndarray_2D('block', block, shape0=self.block_size, shape1=self.nSrc)
+
+        # Overlap-save: transform the last two blocks, and store the spectrum in the delay line
+        nParts = self._H.shape[1]
+        self._head = (self._head - 1) % nParts
+        self._fdl[:, self._head, :] = scipy.fft.rfft(np.concatenate((self._last, block)), axis=0)
+        self._last = np.array(block, dtype=float)
+
+        y = self._mix(self._H)
+        if self._H_old is not None:
+            # Crossfade from the previous RIRs
+            y_old = self._mix(self._H_old)
+            fade = (np.arange(self.block_size) / self.block_size)[:, np.newaxis]
+            y = y_old + fade * (y - y_old)
+            self._H_old = None
+
+        if self._tail is not None:
+            # The tail partitions start one tail block after the head ones,
+            # so the previous tail block output is added along the current one
+            B = self.block_size
+            p = self._tail_pos
+            y += self._tail_out[p:p+B]
+            self._tail_in[p:p+B] = block
+            self._tail_pos = (p + B) % self.tail_block_size
+            if self._tail_pos == 0:
+                self._tail_out = self._tail.process(self._tail_in)
+        return self._format(y)
+
+    def stream(self, src_sigs):
+        """
+        Convolve a whole signal, or a sequence of signal chunks, block by block.
+
+        Parameters
+        ----------
+        src_sigs : ndarray or iterable
+            Source signals (L_sig, nSrc), or iterable of consecutive chunks of any length (n, nSrc),
+            such as the blocks read from a file.
+
+        Yields
+        ------
+        out : ndarray or List
+            Consecutive blocks of the output signals, see `process()`.
+            After the input is exhausted, the tail of the convolution is also yielded,
+            so that the total output length is L_sig + L_rir - 1.
+
+        Notes
+        -----
+        The convolver is reset before processing.
+        """
+        self.reset()
+        B = self.block_size
+        if isinstance(src_sigs, np.ndarray):
+            chunks = (src_sigs[i:i+B] for i in range(0, src_sigs.shape[0], B))
+        else:
+            chunks = src_sigs
+
+        buffer = np.zeros((B, self.nSrc))
+        n_buffer = 0
+        L_sig = 0
+        for chunk in chunks:
+            chunk = np.asarray(chunk, dtype=float).reshape((-1, self.nSrc))
+            L_sig += chunk.shape[0]
+            i = 0
+            while i < chunk.shape[0]:
+                n = min(B - n_buffer, chunk.shape[0] - i)
+                buffer[n_buffer:n_buffer+n] = chunk[i:i+n]
+                n_buffer += n
+                i += n
+                if n_buffer == B:
+                    yield self.process(buffer)
+                    n_buffer = 0
+
+        # Last partial block, and tail of the convolution
+        L_left = L_sig + self.L_rir - 1 - (L_sig - n_buffer)
+        buffer[n_buffer:] = 0
+        while L_left > 0:
+            out = self.process(buffer)
+            if L_left < B:
+                out = self._trim(out, L_left)
+            yield out
+            L_left -= B
+            buffer[:] = 0
+
+    def _transform(self, h):
+        """
+        Spectra of the RIR partitions. Dimension = (B+1, nParts, nSrc, nChannels)
+        """
+        B = self.block_size
+        L = h.shape[0]
+        nParts = -(-L // B)
+        h_parts = np.zeros((nParts * B, self.nSrc, self.nChannels))
+        h_parts[:L] = h.transpose((0, 2, 1))
+        return np.ascontiguousarray(
+            scipy.fft.rfft(h_parts.reshape((nParts, B, self.nSrc, self.nChannels)), 2 * B, axis=1).transpose((1, 0, 2, 3)))
+
+    def _mix(self, H):
+        """
+        Output block of the current delay line with the given RIR spectra, mixing all partitions and sources.
+        The delay line slots are matched to contiguous ranges of partitions.
+        """
+        B = self.block_size
+        nParts = H.shape[1]
+        n = nParts - self._head
+        Y = np.matmul(self._fdl[:, np.newaxis, self._head:, :].reshape((B + 1, 1, n * self.nSrc)),
+                      H[:, :n].reshape((B + 1, n * self.nSrc, self.nChannels)))
+        if self._head > 0:
+            Y += np.matmul(self._fdl[:, np.newaxis, :self._head, :].reshape((B + 1, 1, self._head * self.nSrc)),
+                           H[:, n:].reshape((B + 1, self._head * self.nSrc, self.nChannels)))
+        return scipy.fft.irfft(Y[:, 0, :], 2 * B, axis=0)[B:]
+
+    def _format(self, y):
+        """
+        Reshape the output channels into the shape of the RIRs.
+        """
+        if self._channel_shape is None:
+            return [y[:, self._offsets[nr]:self._offsets[nr+1]] for nr in range(len(self._L_rirs))]
+        return y.reshape((y.shape[0],) + self._channel_shape)
+
+    @staticmethod
+    def _trim(out, n):
+        """
+        Keep the first n samples of an output block.
+        """
+        if isinstance(out, list):
+            return [o[:n] for o in out]
+        return out[:n]
+
+
+def _stack_rirs(rirs):
+    """
+    Gather the RIRs given by `render_rirs_mic`, `render_rirs_sh` or `render_rirs_array` into a single
+    (L_rir, nChannels, nSrc) ndarray, together with the information to split the channels back.
+    Array receivers are zero-padded to the longest RIR.
+    """
+    if isinstance(rirs, list):
+        _validate_list('rirs', rirs)
+        nSrc = rirs[0].shape[-1]
+        L_rirs = [r.shape[0] for r in rirs]
+        offsets = np.concatenate(([0], np.cumsum([r.shape[1] for r in rirs])))
+        h = np.zeros((max(L_rirs), offsets[-1], nSrc))
+        for nr in range(len(rirs)):
+            if rirs[nr].ndim != 3 or rirs[nr].shape[2] != nSrc:
+                raise ValueError('rirs_' + str(nr) + ' must be 3D, with the same number of sources')
+            h[:L_rirs[nr], offsets[nr]:offsets[nr+1], :] = rirs[nr]
+        return h, L_rirs, offsets, None
+
+    if not isinstance(rirs, np.ndarray):
+        raise TypeError('rirs must be an instance of ndarray or list')
+    if rirs.ndim not in (3, 4):
+        raise ValueError('rirs must be 3D or 4D')
+    nSrc = rirs.shape[-1]
+    return rirs.reshape((rirs.shape[0], -1, nSrc)), [rirs.shape[0]], None, rirs.shape[1:-1]
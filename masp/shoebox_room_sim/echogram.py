@@ -33,6 +33,8 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import numpy as np
+
 
 class Echogram:
     """
@@ -46,6 +48,8 @@ class Echogram:
     coords : 2D ndarray, dimension = (n, C)
 
     """
+    __slots__ = ('value', 'time', 'order', 'coords')
+
     def __init__(self, value, time, order, coords):
         self.value = value
         self.time = time
@@ -67,3 +71,285 @@ class QuantisedEchogram:
         self.value = value
         self.time = time
         self.isActive = isActive
+
+class QuantisedEchogramSet:
+    """
+    Class holding the quantised echograms of all rendering directions in contiguous arrays.
+
+    Parameters
+    ----------
+    value : 2D ndarray, dimension = (n, nSH)
+    time : 1D ndarray, dimension = (n), values must be positive
+    offsets : 1D ndarray, dimension = (nGrid+1), dtype=int
+
+    Notes
+    -----
+    The reflections quantised to the grid direction `n` are stored in the range
+    `offsets[n]:offsets[n+1]`, keeping their original (time) order.
+    Direction `n` is active if the range is not empty.
+
+    """
+    __slots__ = ('value', 'time', 'offsets')
+
+    def __init__(self, value, time, offsets):
+        self.value = value
+        self.time = time
+        self.offsets = offsets
+
+    @property
+    def isActive(self):
+        """
+        Active directions. Dimension = (nGrid)
+        """
+        return np.diff(self.offsets) > 0
+
+    def to_quantised_echograms(self):
+        """
+        Convert the quantised echogram set into a QuantisedEchogram ndarray.
+
+        Returns
+        -------
+        q_echogram : ndarray, dtype = QuantisedEchogram
+            Quantised echograms. Dimension = (nGrid)
+
+        """
+        nGrid = self.offsets.size - 1
+        q_echogram = np.empty(nGrid, dtype=QuantisedEchogram)
+        for n in range(nGrid):
+            refl = slice(self.offsets[n], self.offsets[n+1])
+            q_echogram[n] = QuantisedEchogram(self.value[refl], self.time[refl], bool(self.offsets[n+1] > self.offsets[n]))
+        return q_echogram
+
+class ImageSourceCloud:
+    """
+    Class holding the image sources of a single source in a shoebox room.
+
+    Parameters
+    ----------
+    room : 1D ndarray, dimension = (C)
+    order : 2D ndarray, dimension = (n, C), dtype=int
+    coords : 2D ndarray, dimension = (n, C)
+    d_max : float or None, maximum propagation distance ('maxTime' restriction)
+
+    Notes
+    -----
+    `coords` are the image source positions in the room-centred coordinate system
+    used by `ims_coreN` and `ims_coreT`, and therefore independent of the receiver.
+
+    """
+    def __init__(self, room, order, coords, d_max):
+        self.room = room
+        self.order = order
+        self.coords = coords
+        self.d_max = d_max
+
+class EchogramSet:
+    """
+    Class holding the echograms of a whole acoustic scene in contiguous arrays.
+
+    Parameters
+    ----------
+    value : 2D ndarray, dimension = (n, nSH)
+    time : 1D ndarray, dimension = (n), values must be positive
+    order : 2D ndarray, dimension = (n, C), dtype=int
+    coords : 2D ndarray, dimension = (n, C)
+    offsets : 1D ndarray, dimension = (nSrc*nRec+1), dtype=int
+    channels : 1D ndarray, dimension = (nRec), dtype=int
+    gains : 2D ndarray, dimension = (n, nBands)
+    lengths : 3D ndarray, dimension = (nSrc, nRec, nBands), dtype=int
+
+    Notes
+    -----
+    The reflections of the source/receiver pair (ns, nr) are stored in the range
+    `offsets[p]:offsets[p+1]`, with `p = ns*nRec + nr`, sorted by time.
+    `value` holds the band-independent amplitude of each reflection, and `gains`
+    the per-band absorption gain. The echogram of band `nb` is formed by the first
+    `lengths[ns, nr, nb]` reflections of the pair, with amplitude `value * gains[:, nb]`.
+    Receivers with less than `nSH` channels use only the first `channels[nr]` columns of `value`.
+
+    Individual echograms can be accessed as read-only `EchogramView` instances by
+    `echogram_set[ns, nr, nb]`, or converted into an Echogram ndarray by `to_echograms()`.
+    The echograms of a source/receiver pair are obtained as a smaller set by `pair()`.
+
+    """
+    __slots__ = ('value', 'time', 'order', 'coords', 'offsets', 'channels', 'gains', 'lengths')
+
+    def __init__(self, value, time, order, coords, offsets, channels, gains, lengths):
+        self.value = value
+        self.time = time
+        self.order = order
+        self.coords = coords
+        self.offsets = offsets
+        self.channels = channels
+        self.gains = gains
+        self.lengths = lengths
+
+    @property
+    def shape(self):
+        """
+        Echogram set dimensions: (nSrc, nRec, nBands)
+        """
+        return self.lengths.shape
+
+    @classmethod
+    def from_echograms(cls, echograms):
+        """
+        Build an echogram set from an Echogram ndarray, without absorption.
+
+        Parameters
+        ----------
+        echograms : ndarray, dtype = Echogram
+            Target echograms. Dimension = (nSrc, nRec)
+
+        Returns
+        -------
+        echogram_set : EchogramSet
+            Echogram set with a single band and unit gains.
+
+        """
+        from masp.validate_data_types import _validate_echogram_array
+        _validate_echogram_array(echograms)
+        if echograms.ndim != 2:
+            raise ValueError('Echogram array must be 2D')
+
+        nSrc, nRec = echograms.shape
+        sizes = np.asarray([echograms[idx].time.size for idx in np.ndindex(nSrc, nRec)], dtype=int)
+        offsets = np.concatenate(([0], np.cumsum(sizes)))
+        channels = np.asarray([echograms[0, nr].value.shape[1] for nr in range(nRec)], dtype=int)
+
+        value = np.zeros((offsets[-1], np.max(channels)))
+        for p, idx in enumerate(np.ndindex(nSrc, nRec)):
+            value[offsets[p]:offsets[p+1], :channels[idx[1]]] = echograms[idx].value
+        time = np.concatenate([echograms[idx].time for idx in np.ndindex(nSrc, nRec)])
+        order = np.concatenate([echograms[idx].order for idx in np.ndindex(nSrc, nRec)])
+        coords = np.concatenate([echograms[idx].coords for idx in np.ndindex(nSrc, nRec)])
+
+        return cls(value=value, time=time, order=order, coords=coords,
+                   offsets=offsets,
+                   channels=channels,
+                   gains=np.ones((offsets[-1], 1)),
+                   lengths=sizes.reshape((nSrc, nRec, 1)))
+
+    def to_echograms(self):
+        """
+        Convert the echogram set into an Echogram ndarray.
+
+        Returns
+        -------
+        echograms : ndarray, dtype = Echogram
+            Echograms for each source, receiver and band. Dimension = (nSrc, nRec, nBands)
+
+        Notes
+        -----
+        `time`, `order` and `coords` of the resulting echograms are views
+        into the arrays of the set, and therefore not copied.
+
+        """
+        echograms = np.empty(self.shape, dtype=Echogram)
+        for idx in np.ndindex(self.shape):
+            ns, nr, nb = idx
+            refl = self._slice(ns, nr, nb)
+            echograms[idx] = Echogram(value=self.value[refl, :self.channels[nr]] * self.gains[refl, nb, np.newaxis],
+                                      time=self.time[refl],
+                                      order=self.order[refl],
+                                      coords=self.coords[refl])
+        return echograms
+
+    def pair(self, ns, nr):
+        """
+        Echogram set of a single source/receiver pair.
+
+        Parameters
+        ----------
+        ns : int
+            Source index.
+        nr : int
+            Receiver index.
+
+        Returns
+        -------
+        pair_set : EchogramSet
+            Echogram set of the pair. Dimension = (1, 1, nBands)
+
+        Notes
+        -----
+        The reflection data of the resulting set are views into the arrays of this set,
+        restricted to the range and channels of the pair.
+
+        """
+        if not (0 <= ns < self.shape[0] and 0 <= nr < self.shape[1]):
+            raise IndexError('echogram set index out of range')
+        p = ns * self.shape[1] + nr
+        refl = slice(self.offsets[p], self.offsets[p+1])
+        return EchogramSet(value=self.value[refl, :self.channels[nr]],
+                           time=self.time[refl],
+                           order=self.order[refl],
+                           coords=self.coords[refl],
+                           offsets=np.asarray([0, self.offsets[p+1] - self.offsets[p]]),
+                           channels=self.channels[nr:nr+1],
+                           gains=self.gains[refl],
+                           lengths=self.lengths[ns:ns+1, nr:nr+1])
+
+    def _slice(self, ns, nr, nb):
+        """
+        Reflection range of a given source, receiver and band.
+        """
+        start = self.offsets[ns * self.shape[1] + nr]
+        return slice(start, start + self.lengths[ns, nr, nb])
+
+    def __getitem__(self, idx):
+        ns, nr, nb = idx
+        if not (0 <= ns < self.shape[0] and 0 <= nr < self.shape[1] and 0 <= nb < self.shape[2]):
+            raise IndexError('echogram set index out of range')
+        return EchogramView(self, ns, nr, nb)
+
+
+class EchogramView(Echogram):
+    """
+    Read-only view of a single echogram inside an EchogramSet.
+
+    Parameters
+    ----------
+    echogram_set : EchogramSet
+    ns : int, source index
+    nr : int, receiver index
+    nb : int, band index
+
+    Notes
+    -----
+    Attributes are computed on access from the underlying set:
+    `time`, `order` and `coords` are array views, and `value` is scaled by the band gains.
+
+    """
+    __slots__ = ('_set', '_ns', '_nr', '_nb')
+
+    def __init__(self, echogram_set, ns, nr, nb):
+        self._set = echogram_set
+        self._ns = ns
+        self._nr = nr
+        self._nb = nb
+
+    def _read_only(self, value):
+        raise AttributeError('EchogramView is read-only')
+
+    @property
+    def value(self):
+        refl = self._set._slice(self._ns, self._nr, self._nb)
+        return self._set.value[refl, :self._set.channels[self._nr]] * self._set.gains[refl, self._nb, np.newaxis]
+
+    @property
+    def time(self):
+        return self._set.time[self._set._slice(self._ns, self._nr, self._nb)]
+
+    @property
+    def order(self):
+        return self._set.order[self._set._slice(self._ns, self._nr, self._nb)]
+
+    @property
+    def coords(self):
+        return self._set.coords[self._set._slice(self._ns, self._nr, self._nb)]
+
+    value = value.setter(_read_only)
+    time = time.setter(_read_only)
+    order = order.setter(_read_only)
+    coords = coords.setter(_read_only)
@@ -33,13 +33,18 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import functools
+
 import numpy as np
 
-from masp.validate_data_types import _validate_ndarray_1D, _validate_int, _validate_number, \
-    _validate_echogram, _validate_string
-from .echogram import Echogram
+from masp.validate_data_types import _validate_ndarray_1D, _validate_ndarray_2D, _validate_int, _validate_number, \
+    _validate_echogram, _validate_string, _validate_image_source_cloud
+from .echogram import Echogram, ImageSourceCloud
 from masp.utils import C, c
 
+# Maximum number of image source distances evaluated at once
+_BATCH_SIZE = 2**22
+
 
 def ims_coreMtx(room, source, receiver, type, typeValue):
     """
@@ -115,7 +120,7 @@ def ims_coreMtx(room, source, receiver, type, typeValue):
         echogram = ims_coreT(room, src, rec, maxDelay)
 
     # Sort reflections according to propagation time
-    idx = np.argsort(echogram.time)
+    idx = np.argsort(echogram.time, kind='stable')
     echogram.time = echogram.time[idx]
     echogram.value = echogram.value[idx]
     echogram.order = echogram.order[idx, :]
@@ -124,6 +129,205 @@ def ims_coreMtx(room, source, receiver, type, typeValue):
     return echogram
 
 
+def ims_coreMtx_batch(room, sources, receivers, type, typeValue):
+    """
+    Compute the echograms of all source/receiver pairs by image source method.
+
+    Parameters
+    ----------
+    room : ndarray
+        Room dimensions in cartesian coordinates. Dimension = (3) [x, y, z].
+    sources : ndarray
+        Source positions in cartesian coordinates. Dimension = (nSrc, 3) [[x, y, z]].
+    receivers : ndarray
+        Receiver positions in cartesian coordinates. Dimension = (nRec, 3) [[x, y, z]].
+    type : str
+        Restriction type: 'maxTime' or 'maxOrder'
+    typeValue: int or float
+        Value of the chosen restriction.
+
+    Returns
+    -------
+    echograms : ndarray, dtype = Echogram
+        Echograms for each source/receiver pair. Dimension = (nSrc, nRec)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The result is the same as calling `ims_coreMtx` for every source/receiver pair,
+    but the image source lattice is built only once per room,
+    and all receivers of a given source are evaluated in a single vectorized pass.
+
+    `sources` and `receivers` positions are specified from the left ground corner
+    of the room, using a left-handed coordinate system, as in `ims_coreMtx`.
+
+    """
+
+    _validate_ndarray_1D('room', room, size=C, positive=True)
+    _validate_ndarray_2D('sources', sources, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_ndarray_2D('receivers', receivers, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_string('type', type, choices=['maxTime', 'maxOrder'])
+
+    nSrc = sources.shape[0]
+    nRec = receivers.shape[0]
+
+    # i, j, k indices are shared by all source/receiver pairs
+    i, j, k, d_max = _ims_lattice(room, type, typeValue)
+
+    # Move receiver origin to the centre of the room
+    rec = _centre_positions(room, receivers)
+
+    echograms = np.empty((nSrc, nRec), dtype=Echogram)
+    for ns in range(nSrc):
+        # Receiver-independent image sources, evaluated at all receivers
+        cloud = _ims_cloud(room, _centre_positions(room, sources[ns]), i, j, k, d_max)
+        echograms[ns, :] = _ims_cloud_eval(cloud, rec)
+
+    return echograms
+
+
+def ims_cloud(room, source, type, typeValue):
+    """
+    Compute the receiver-independent image sources of a given source.
+
+    Parameters
+    ----------
+    room : ndarray
+        Room dimensions in cartesian coordinates. Dimension = (3) [x, y, z].
+    source : ndarray
+        Source position in cartesian coordinates. Dimension = (3) [x, y, z].
+    type : str
+        Restriction type: 'maxTime' or 'maxOrder'
+    typeValue: int or float
+        Value of the chosen restriction.
+
+    Returns
+    -------
+    cloud : ImageSourceCloud
+        Image source orders and positions.
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `source` position is specified from the left ground corner
+    of the room, using a left-handed coordinate system, as in `ims_coreMtx`.
+    The resulting image source positions are expressed in the room-centred
+    coordinate system used by `ims_coreN` and `ims_coreT`.
+
+    Under 'maxTime' restriction, image sources which cannot be closer than
+    the maximum distance to any point inside the room are already discarded.
+
+    The cloud can be evaluated at any number of receivers with `ims_cloud_echograms`.
+
+    """
+
+    _validate_ndarray_1D('room', room, size=C, positive=True)
+    _validate_ndarray_1D('source', source, size=C, positive=True, limit=[np.zeros(C),room])
+    _validate_string('type', type, choices=['maxTime', 'maxOrder'])
+
+    i, j, k, d_max = _ims_lattice(room, type, typeValue)
+    return _ims_cloud(room, _centre_positions(room, source), i, j, k, d_max)
+
+
+def ims_cloud_echograms(cloud, receivers):
+    """
+    Compute the echograms of an image source cloud at a set of receivers.
+
+    Parameters
+    ----------
+    cloud : ImageSourceCloud
+        Image sources, as generated by `ims_cloud()`.
+    receivers : ndarray
+        Receiver positions in cartesian coordinates. Dimension = (nRec, 3) [[x, y, z]].
+
+    Returns
+    -------
+    echograms : ndarray, dtype = Echogram
+        Echograms for each receiver. Dimension = (nRec)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `receivers` positions are specified from the left ground corner
+    of the room, using a left-handed coordinate system, as in `ims_coreMtx`.
+
+    The result is the same as calling `ims_coreMtx` for each receiver.
+
+    """
+
+    _validate_image_source_cloud(cloud)
+    _validate_ndarray_2D('receivers', receivers, shape1=C, positive=True, limit=[np.zeros(C), cloud.room])
+
+    echograms = np.empty(receivers.shape[0], dtype=Echogram)
+    echograms[:] = _ims_cloud_eval(cloud, _centre_positions(cloud.room, receivers))
+    return echograms
+
+
+def ims_trajectory(room, sources, receivers, type, typeValue):
+    """
+    Compute the echograms of a moving source and/or receiver by image source method.
+
+    Parameters
+    ----------
+    room : ndarray
+        Room dimensions in cartesian coordinates. Dimension = (3) [x, y, z].
+    sources : ndarray
+        Source positions along the trajectory in cartesian coordinates. Dimension = (nPos, 3) or (1, 3) [[x, y, z]].
+    receivers : ndarray
+        Receiver positions along the trajectory in cartesian coordinates. Dimension = (nPos, 3) or (1, 3) [[x, y, z]].
+    type : str
+        Restriction type: 'maxTime' or 'maxOrder'
+    typeValue: int or float
+        Value of the chosen restriction.
+
+    Returns
+    -------
+    echograms : ndarray, dtype = Echogram
+        Echograms for each trajectory position. Dimension = (nPos)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `sources` and `receivers` positions are specified from the left ground corner
+    of the room, using a left-handed coordinate system, as in `ims_coreMtx`.
+    A single source or receiver position is kept static along the trajectory.
+
+    The result is the same as calling `ims_coreMtx` at every position,
+    but the image source lattice is built only once for the whole trajectory.
+    For each position, only the distances are updated, and the reflections are
+    re-sorted starting from the order of the previous position.
+    The stable sort is adaptive, so that close positions are sorted at a fraction
+    of the cost of a full sort.
+
+    """
+
+    _validate_ndarray_1D('room', room, size=C, positive=True)
+    _validate_ndarray_2D('sources', sources, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_ndarray_2D('receivers', receivers, shape1=C, positive=True, limit=[np.zeros(C), room])
+    _validate_string('type', type, choices=['maxTime', 'maxOrder'])
+    src, rec = _trajectory_positions(room, sources, receivers)
+
+    i, j, k, d_max = _ims_lattice(room, type, typeValue)
+
+    echograms = np.empty(src.shape[0], dtype=Echogram)
+    for n, (_, echogram) in enumerate(_ims_trajectory(room, src, rec, i, j, k, d_max)):
+        echograms[n] = echogram
+    return echograms
+
+
+
 def ims_coreN(room, src, rec, N):
     """
     Compute echogram by image source method, under reflection order restriction
@@ -176,17 +380,7 @@ def ims_coreN(room, src, rec, N):
     _validate_int('N', N, positive=True)
 
     # i,j,k indices for calculation in x,y,z respectively
-    r = np.arange(-N, N+1)
-    xx, yy, zz = np.meshgrid(r, r, r)
-    # Vectorize (kind of empirical...)
-    i = zz.reshape(zz.size)
-    j = xx.reshape(xx.size)
-    k = yy.reshape(yy.size)
-    # Compute total order and select only valid incides up to order N
-    s_ord = np.abs(i) + np.abs(j) + np.abs(k)
-    i = i[s_ord <= N]
-    j = j[s_ord <= N]
-    k = k[s_ord <= N]
+    i, j, k = _ims_lattice_N(N)
 
     # Image source coordinates with respect to receiver
     s_x = i*room[0] + np.power(-1.,i)*src[0] - rec[0]
@@ -263,36 +457,31 @@ def ims_coreT(room, src, rec, maxTime):
     _validate_ndarray_1D('receiver', rec, size=C, limit=[-room/2,room/2])
     _validate_number('maxTime', maxTime, positive=True)
 
-    # Find order N that corresponds to maximum distance
     d_max = maxTime * c
-    Nx = np.ceil(d_max / room[0])
-    Ny = np.ceil(d_max / room[1])
-    Nz = np.ceil(d_max / room[2])
 
-    # i, j, k indices for calculation in x, y, z respectively
-    rx = np.arange(-Nx, Nx + 1)
-    ry = np.arange(-Ny, Ny + 1)
-    rz = np.arange(-Nz, Nz + 1)
-    xx, yy, zz = np.meshgrid(rx, ry, rz)
-    # Vectorize (transpose idx due to matlab/python variations on matrix handling)
-    i = xx.transpose(2,0,1).flatten()
-    j = yy.transpose(2,0,1).flatten()
-    k = zz.transpose(2,0,1).flatten()
-    # Image source coordinates with respect to receiver
-    s_x = i*room[0] + np.power(-1.,i)*src[0] - rec[0]
-    s_y = j*room[1] + np.power(-1.,j)*src[1] - rec[1]
-    s_z = k*room[2] + np.power(-1.,k)*src[2] - rec[2]
-    # Distance
-    s_d = np.sqrt(np.power(s_x,2) + np.power(s_y,2) + np.power(s_z,2))
-
-    # Bypass image sources with d > dmax
-    i = i[s_d < d_max]
-    j = j[s_d < d_max]
-    k = k[s_d < d_max]
-    s_x = s_x[s_d < d_max]
-    s_y = s_y[s_d < d_max]
-    s_z = s_z[s_d < d_max]
-    s_d = s_d[s_d < d_max]
+    # Image sources are evaluated in bounded-size chunks of the lattice
+    i, j, k, s_x, s_y, s_z, s_d = [], [], [], [], [], [], []
+    for i_c, j_c, k_c in _ims_lattice_T_chunks(room, d_max, _BATCH_SIZE):
+        # Image source coordinates with respect to receiver
+        s_x_c = i_c*room[0] + np.power(-1.,i_c)*src[0] - rec[0]
+        s_y_c = j_c*room[1] + np.power(-1.,j_c)*src[1] - rec[1]
+        s_z_c = k_c*room[2] + np.power(-1.,k_c)*src[2] - rec[2]
+        # Distance
+        s_d_c = np.sqrt(np.power(s_x_c,2) + np.power(s_y_c,2) + np.power(s_z_c,2))
+
+        # Bypass image sources with d > dmax
+        valid = s_d_c < d_max
+        i.append(i_c[valid])
+        j.append(j_c[valid])
+        k.append(k_c[valid])
+        s_x.append(s_x_c[valid])
+        s_y.append(s_y_c[valid])
+        s_z.append(s_z_c[valid])
+        s_d.append(s_d_c[valid])
+
+    i, j, k = np.concatenate(i), np.concatenate(j), np.concatenate(k)
+    s_x, s_y, s_z = np.concatenate(s_x), np.concatenate(s_y), np.concatenate(s_z)
+    s_d = np.concatenate(s_d)
 
     # Reflection propagation time
     s_t = s_d/c
@@ -309,3 +498,249 @@ def ims_coreT(room, src, rec, maxTime):
                            coords=np.stack([s_x, s_y, s_z], axis=1))
 
     return reflections
+
+
+@functools.lru_cache(maxsize=8)
+def _ims_lattice_N(N):
+    """
+    i, j, k image source indices for reflection orders up to N.
+
+    The octahedron |i|+|j|+|k| <= N is enumerated row by row along x, with z as the
+    slowest varying index, which is the order of the masked (2N+1)^3 lattice.
+    Results are cached, and returned as read-only arrays.
+    """
+    r = np.arange(-N, N+1)
+    k_row = np.repeat(r, r.size)
+    j_row = np.tile(r, r.size)
+    h_row = N - np.abs(k_row) - np.abs(j_row)
+    valid = h_row >= 0
+    i, j, k = next(_lattice_rows_chunks(k_row[valid], j_row[valid], h_row[valid], np.inf))
+    for n in (i, j, k):
+        n.setflags(write=False)
+    return i, j, k
+
+
+def _ims_lattice_T(room, d_max):
+    """
+    i, j, k image source indices which might fall inside the d_max sphere.
+    """
+    chunks = list(_ims_lattice_T_chunks(room, d_max, np.inf))
+    return tuple(np.concatenate([chunk[n] for chunk in chunks]) for n in range(C))
+
+
+def _ims_lattice_T_chunks(room, d_max, chunk_size):
+    """
+    Generator of i, j, k image source indices which might fall inside the d_max sphere,
+    in chunks of at most `chunk_size` indices (or a single lattice row, if larger).
+
+    Since source and receiver lie inside the room, the image source distance along x
+    is at least (|i|-1)*room[0], and similarly along y and z. Only the lattice points whose
+    lower bound falls inside the sphere are enumerated, row by row along x.
+    The order of the indices is the same as the full (2Nx+1)(2Ny+1)(2Nz+1) lattice.
+    """
+    # Find order N that corresponds to maximum distance
+    Nx = np.ceil(d_max / room[0])
+    Ny = np.ceil(d_max / room[1])
+    Nz = np.ceil(d_max / room[2])
+    # Small margin to never discard a boundary image source due to rounding
+    d2_max = np.power(d_max * (1 + 1e-9), 2)
+
+    def lower_bound(n, length):
+        return np.power(np.maximum(np.abs(n) - 1, 0) * length, 2)
+
+    # Lattice rows along x, with z as the slowest varying index
+    ry = np.arange(-Ny, Ny + 1)
+    rz = np.arange(-Nz, Nz + 1)
+    k_row = np.repeat(rz, ry.size)
+    j_row = np.tile(ry, rz.size)
+    d2_row = d2_max - lower_bound(k_row, room[2]) - lower_bound(j_row, room[1])
+    valid = d2_row > 0
+    k_row, j_row, d2_row = k_row[valid], j_row[valid], d2_row[valid]
+    # Largest |i| whose lower bound falls inside the sphere
+    h_row = np.minimum(Nx, np.ceil(np.sqrt(d2_row) / room[0] + 1) - 1)
+
+    yield from _lattice_rows_chunks(k_row, j_row, h_row, chunk_size)
+
+
+def _lattice_rows_chunks(k_row, j_row, h_row, chunk_size):
+    """
+    Generator of i, j, k indices for the lattice rows (k, j, -h...h),
+    in chunks of at most `chunk_size` indices (or a single row, if larger).
+    """
+    counts = (2 * h_row + 1).astype(int)
+    ends = np.cumsum(counts)
+    r0 = 0
+    while r0 < counts.size:
+        # Last row fitting in the chunk, at least one
+        start = ends[r0] - counts[r0]
+        r1 = max(r0 + 1, int(np.searchsorted(ends, start + chunk_size, side='right')))
+        rows = slice(r0, r1)
+        c = counts[rows]
+        offsets = np.repeat(np.cumsum(c) - c, c)
+        h = np.repeat(h_row[rows], c)
+        i = (np.arange(np.sum(c)) - offsets - h).astype(h_row.dtype)
+        j = np.repeat(j_row[rows], c)
+        k = np.repeat(k_row[rows], c)
+        yield i, j, k
+        r0 = r1
+
+
+def _ims_lattice(room, type, typeValue):
+    """
+    i, j, k image source indices and maximum distance (None for 'maxOrder') for a given restriction.
+    """
+    if type == 'maxOrder':
+        _validate_int('N', typeValue, positive=True)
+        i, j, k = _ims_lattice_N(typeValue)
+        return i, j, k, None
+    elif type == 'maxTime':
+        _validate_number('maxTime', typeValue, positive=True)
+        d_max = typeValue * c
+        i, j, k = _ims_lattice_T(room, d_max)
+        return i, j, k, d_max
+
+
+def _centre_positions(room, positions):
+    """
+    Move positions from the left ground corner to the centre of the room.
+    """
+    l, w, h = room
+    centred = np.empty(np.shape(positions))
+    centred[..., 0] = positions[..., 0] - l / 2
+    centred[..., 1] = w / 2 - positions[..., 1]
+    centred[..., 2] = positions[..., 2] - h / 2
+    return centred
+
+
+def _ims_cloud(room, src, i, j, k, d_max):
+    """
+    Image source cloud of a source given in room-centred coordinates.
+    """
+    # Image source coordinates, without the receiver displacement
+    img_x = i*room[0] + np.power(-1.,i)*src[0]
+    img_y = j*room[1] + np.power(-1.,j)*src[1]
+    img_z = k*room[2] + np.power(-1.,k)*src[2]
+
+    if d_max is not None:
+        # Bypass image sources farther than d_max from any point inside the room
+        r_max = (d_max + np.sqrt(np.sum(np.power(room / 2., 2)))) * (1 + 1e-9)
+        keep = np.power(img_x,2) + np.power(img_y,2) + np.power(img_z,2) < np.power(r_max,2)
+        i, j, k = i[keep], j[keep], k[keep]
+        img_x, img_y, img_z = img_x[keep], img_y[keep], img_z[keep]
+
+    return ImageSourceCloud(room=room,
+                            order=np.asarray(np.stack([i, j, k], axis=1), dtype=int),
+                            coords=np.stack([img_x, img_y, img_z], axis=1),
+                            d_max=d_max)
+
+
+def _ims_cloud_eval(cloud, rec):
+    """
+    List of sorted echograms of an image source cloud, for receivers given in room-centred coordinates.
+    """
+    nRec = rec.shape[0]
+    nImg = cloud.order.shape[0]
+    img_x, img_y, img_z = cloud.coords.T
+
+    # Number of receivers evaluated at once, bounded by the cloud size
+    nChunk = max(1, min(nRec, _BATCH_SIZE // max(1, nImg)))
+
+    echograms = []
+    for nr0 in range(0, nRec, nChunk):
+        recs = rec[nr0:nr0+nChunk]
+        # Image source coordinates with respect to each receiver. Dimension = (nChunk, nImg)
+        s_x = img_x - recs[:, 0, np.newaxis]
+        s_y = img_y - recs[:, 1, np.newaxis]
+        s_z = img_z - recs[:, 2, np.newaxis]
+        # Distance
+        s_d = np.sqrt(np.power(s_x,2) + np.power(s_y,2) + np.power(s_z,2))
+        # Reflection propagation time
+        s_t = s_d/c
+
+        # Sort reflections according to propagation time,
+        # moving image sources with d >= dmax to the end of each row
+        if cloud.d_max is None:
+            nValid = np.full(recs.shape[0], nImg)
+            idx = np.argsort(s_t, axis=1, kind='stable')
+        else:
+            valid = s_d < cloud.d_max
+            nValid = np.sum(valid, axis=1)
+            idx = np.argsort(np.where(valid, s_t, np.inf), axis=1, kind='stable')
+
+        for n in range(recs.shape[0]):
+            sel = idx[n, :nValid[n]]
+            d = s_d[n, sel]
+            # Reflection propagation attenuation - if distance is <1m
+            # set at attenuation at 1 to avoid amplification
+            s_att = np.ones(d.size)
+            s_att[d > 1] = 1./d[d > 1]
+            echograms.append(Echogram(value=s_att[:, np.newaxis],
+                                      time=s_t[n, sel],
+                                      order=cloud.order[sel],
+                                      coords=np.stack([s_x[n, sel], s_y[n, sel], s_z[n, sel]], axis=1)))
+
+    return echograms
+
+
+def _trajectory_positions(room, sources, receivers):
+    """
+    Source and receiver trajectories in room-centred coordinates, with static positions repeated.
+    """
+    nPos = max(sources.shape[0], receivers.shape[0])
+    for name, positions in (('sources', sources), ('receivers', receivers)):
+        if positions.shape[0] not in (1, nPos):
+            raise ValueError(name + ' must have a single position or the same number of positions as the trajectory')
+    src = np.broadcast_to(_centre_positions(room, sources), (nPos, C))
+    rec = np.broadcast_to(_centre_positions(room, receivers), (nPos, C))
+    return src, rec
+
+
+def _ims_trajectory(room, src, rec, i, j, k, d_max):
+    """
+    Generator of the lattice indices and the sorted echogram of each position of a trajectory,
+    for sources and receivers given in room-centred coordinates.
+
+    Each image source coordinate depends on a single lattice index, so coordinates are evaluated
+    along the lattice axes and gathered. Reflections with equal time keep the lattice order,
+    so that each echogram is the same as the one given by `ims_coreMtx`.
+    """
+    nImg = np.size(i)
+    order = np.asarray(np.stack([i, j, k], axis=1), dtype=int)
+    # Lattice axes and the position of each image source along them
+    axes = [np.arange(np.min(n), np.max(n) + 1) for n in (i, j, k)]
+    axes_idx = [(n - axis[0]).astype(int) for n, axis in zip((i, j, k), axes)]
+
+    perm = np.arange(nImg)
+    for pos in range(src.shape[0]):
+        # Image source coordinates with respect to receiver, along each lattice axis
+        s_axes = [axes[n]*room[n] + np.power(-1.,axes[n])*src[pos, n] - rec[pos, n] for n in range(C)]
+        # Distance
+        s_d = np.sqrt(np.power(s_axes[0],2)[axes_idx[0]] +
+                      np.power(s_axes[1],2)[axes_idx[1]] +
+                      np.power(s_axes[2],2)[axes_idx[2]])
+        # Reflection propagation time
+        s_t = s_d/c
+
+        # Sort reflections according to propagation time, from the previous order
+        s_t_perm = s_t[perm]
+        idx = np.argsort(s_t_perm, kind='stable')
+        perm = perm[idx]
+        s_t_perm = s_t_perm[idx]
+        ties = np.flatnonzero(s_t_perm[1:] == s_t_perm[:-1])
+        if ties.size > 0:
+            # Sort the runs of equal time by lattice index, with a single integer key
+            tied = np.unique(np.concatenate((ties, ties + 1)))
+            run = np.cumsum(np.concatenate(([0], s_t_perm[tied[1:]] != s_t_perm[tied[:-1]])))
+            perm[tied] = np.sort(run * nImg + perm[tied]) % nImg
+
+        # Bypass image sources with d > dmax
+        sel = perm if d_max is None else perm[s_d[perm] < d_max]
+        d = s_d[sel]
+        # Reflection propagation attenuation - if distance is <1m
+        # set at attenuation at 1 to avoid amplification
+        s_att = np.ones(d.size)
+        s_att[d > 1] = 1./d[d > 1]
+        yield sel, Echogram(value=s_att[:, np.newaxis],
+                            time=s_t[sel],
+                            order=order[sel],
+                            coords=np.stack([s_axes[n][axes_idx[n][sel]] for n in range(C)], axis=1))
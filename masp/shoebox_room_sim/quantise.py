@@ -33,9 +33,11 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import functools
 import numpy as np
+import scipy.spatial
 
-from masp.shoebox_room_sim.echogram import QuantisedEchogram
+from masp.shoebox_room_sim.echogram import QuantisedEchogramSet
 from masp.utils import sph2cart, C
 from masp.validate_data_types import _validate_echogram, _validate_ndarray_2D, _validate_int, _validate_ndarray_1D
 
@@ -66,25 +68,30 @@ def get_echo2gridMap(echogram, grid_dirs_rad):
     _validate_echogram(echogram)
     _validate_ndarray_2D('grid_dirs_rad', grid_dirs_rad, shape1=C-1)
 
-    # Number of reflections
-    nRefl = np.shape(echogram.value)[0]
-    # Number of rendering directions
-    nGrid = np.shape(grid_dirs_rad)[0]
-
-    # Unit vectors pointing to the rendering directions
-    grid_xyz = sph2cart(np.column_stack((grid_dirs_rad, np.ones(np.shape(grid_dirs_rad)[0]))))
     # Unit vectors pointing to the image sources
     refl_coords = echogram.coords
     refl_coords = refl_coords/(np.sqrt(np.sum(np.power(refl_coords, 2), axis=1)))[:,np.newaxis]
 
-    echo2gridMap = np.empty(nRefl, dtype='int')
-    for i in range(nRefl):
-        nearest = np.argmin(np.sum(np.power(refl_coords[i,:] - grid_xyz, 2), axis=1))
-        echo2gridMap[i] = nearest
+    # Nearest rendering direction of all reflections at once
+    grid_tree = _get_grid_tree(np.asarray(grid_dirs_rad, dtype=float).tobytes(), np.shape(grid_dirs_rad)[0])
+    valid = np.all(np.isfinite(refl_coords), axis=1)
+    echo2gridMap = np.zeros(np.shape(refl_coords)[0], dtype='int')
+    echo2gridMap[valid] = grid_tree.query(refl_coords[valid])[1]
 
     return echo2gridMap
 
 
+@functools.lru_cache(maxsize=16)
+def _get_grid_tree(grid_bytes, nGrid):
+    """
+    KD-tree of the unit vectors pointing to the rendering directions.
+    The grid is given as the bytes of its float [azimuth, elevation] array, so that it can be cached.
+    """
+    grid_dirs_rad = np.frombuffer(grid_bytes, dtype=float).reshape((nGrid, C-1))
+    grid_xyz = sph2cart(np.column_stack((grid_dirs_rad, np.ones(nGrid))))
+    return scipy.spatial.cKDTree(grid_xyz)
+
+
 def quantise_echogram(echogram, nGrid, echo2gridMap):
     """
     Quantise the echogram reflections to specific rendering directions.
@@ -121,11 +128,55 @@ def quantise_echogram(echogram, nGrid, echo2gridMap):
         echogram.value = echogram.value[:np.size(echo2gridMap)]
         echogram.time = echogram.time[:np.size(echo2gridMap)]
 
-    q_echogram = np.empty(nGrid, dtype=QuantisedEchogram)
-    for n in range(nGrid):
-        value = echogram.value[echo2gridMap == n]
-        # print(len(echogram.value[echo2gridMap == n]))
-        time = echogram.time[echo2gridMap == n]
-        isActive = False if np.size(time) == 0 else True
-        q_echogram[n] = QuantisedEchogram(value, time, isActive)
-    return q_echogram
+    return _group_reflections(echogram.value, echogram.time, nGrid, echo2gridMap).to_quantised_echograms()
+
+
+def quantise_echogram_set(echogram, nGrid, echo2gridMap):
+    """
+    Quantise the echogram reflections to specific rendering directions, into a contiguous structure.
+
+    Parameters
+    ----------
+    echogram : Echogram
+        Target Echogram
+    nGrid: int
+        Number of grid points where to render reflections.
+    echo2gridMap: ndarray, dtype: int
+        Mapping between echgram and grid points, as generated by `get_echo2gridMap()`
+
+    Returns
+    -------
+    q_echogram_set : QuantisedEchogramSet
+        Quantised echograms of all grid points.
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Equivalent to `quantise_echogram()`, but the reflections of all grid points are grouped
+    with a single sort, and no per-direction object is created.
+    Unlike `quantise_echogram()`, the target echogram is not modified.
+
+    """
+
+    _validate_echogram(echogram)
+    _validate_int('nGrid', nGrid)
+    _validate_ndarray_1D('echo2gridMap', echo2gridMap, positive=True, dtype=int)
+
+    nRefl = min(np.size(echo2gridMap), np.size(echogram.time))
+    return _group_reflections(echogram.value[:nRefl], echogram.time[:nRefl], nGrid, echo2gridMap[:nRefl])
+
+
+def _group_reflections(value, time, nGrid, echo2gridMap):
+    """
+    Group reflections by grid point, keeping their order inside each group.
+    Reflections mapped outside of the grid are discarded.
+    """
+    valid = np.flatnonzero(echo2gridMap < nGrid)
+    # Stable sort preserves the time order of the reflections of each direction
+    refl = valid[np.argsort(echo2gridMap[valid], kind='stable')]
+    offsets = np.zeros(nGrid + 1, dtype=int)
+    offsets[1:] = np.cumsum(np.bincount(echo2gridMap[valid], minlength=nGrid))
+    return QuantisedEchogramSet(value[refl], time[refl], offsets)
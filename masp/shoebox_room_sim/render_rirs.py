@@ -33,25 +33,38 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+import functools
+
 import numpy as np
+import scipy.fft
 import scipy.signal
+import scipy.sparse
 import copy
 
-from masp.shoebox_room_sim.echogram import Echogram
-from masp.shoebox_room_sim.quantise import get_echo2gridMap, quantise_echogram
-from masp.utils import lagrange, C
+from masp.shoebox_room_sim.echogram import Echogram, EchogramSet, QuantisedEchogramSet
+from masp.shoebox_room_sim.quantise import get_echo2gridMap, quantise_echogram_set
+from masp.utils import lagrange_table, sinc_table, C
 from masp.validate_data_types import _validate_echogram, _validate_float, _validate_int, _validate_boolean, \
     _validate_ndarray_2D, _validate_ndarray_1D, _validate_echogram_array, _validate_list, \
-    _validate_quantised_echogram_array, _validate_ndarray_3D
+    _validate_quantised_echogram_array, _validate_quantised_echogram_set, _validate_ndarray_3D, _validate_n_jobs, \
+    _validate_string, _validate_number, _validate_echogram_set
+from masp.shoebox_room_sim.parallel import parallel_map
+from masp.shoebox_room_sim.convolution import _convolve_mix, _partition_fft_size
+
+# Maximum number of filter taps accumulated at once
+_SCATTER_SIZE = 2**22
+# Maximum number of frequency bins transformed at once in the filterbank
+_FFT_SIZE = 2**23
 
 
-def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
+def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs, n_jobs=None, kernel='lagrange', kernel_order=100,
+                      transition_time=None, tail_kernel='nearest', tail_kernel_order=8):
     """
     Render the echogram IRs of an array of mic arrays with arbitrary geometries and transfer functions.
 
     Parameters
     ----------
-    echograms : ndarray, dtype = Echogram
+    echograms : ndarray, dtype = Echogram, or EchogramSet
         Target echograms. Dimension = (nSrc, nRec, nBands)
     band_centerfreqs : ndarray
         Center frequencies of the filterbank. Dimension = (nBands)
@@ -61,6 +74,18 @@ def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
         DoA grid for each receiver. Length = (nRec)
     array_irs : List
         IR of each element of the eceivers. Length = (nRec)
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
 
     Returns
     -------
@@ -87,6 +112,18 @@ def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
     The lowest center frequency must be at least equal to 30 Hz.
     Center frequencies must increase monotonically.
 
+    With `n_jobs`, each source/receiver pair is rendered in a process pool.
+    The result is bitwise identical to the serial rendering.
+    An EchogramSet is rendered pair by pair from its reflection arrays, without converting it into echograms.
+
+    See `render_rirs` for the available fractional delay kernels and the time-tiered rendering.
+
+    The array IRs are transformed once per receiver, and the grid direction RIRs once per source/receiver pair.
+    The array IR spectra are cached by (array IR, FFT size), so repeated renderings with the same arrays
+    and RIR length do not transform them again.
+    All directions are then mixed into the array elements in the frequency domain,
+    by uniformly partitioned overlap-add convolution.
+
     TODO: expose fractional, L_filterbank as parameter?
     """
 
@@ -94,7 +131,7 @@ def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
     nRec = echograms.shape[1]
     nBands = echograms.shape[2]
 
-    _validate_echogram_array(echograms)
+    _validate_echograms(echograms)
     _validate_int('fs', fs, positive=True)
     _validate_ndarray_1D('f_center', band_centerfreqs, positive=True, size=nBands, limit=[30,fs/2])
     _validate_list('grids', grids, size=nRec)
@@ -103,9 +140,13 @@ def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
     _validate_list('array_irs', array_irs, size=nRec)
     for i in range(nRec):
         _validate_ndarray_3D('array_irs_'+str(i), array_irs[i], shape2=grids[i].shape[0])
+    _validate_n_jobs('n_jobs', n_jobs)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
 
     # Sample echogram to a specific sampling rate with fractional interpolation
     fractional = True
+    render_kwargs = dict(fractional=fractional, kernel=kernel, kernel_order=kernel_order, transition_time=transition_time,
+                         tail_kernel=tail_kernel, tail_kernel_order=tail_kernel_order)
 
     # Decide on number of samples for all RIRs
     endtime = 0
@@ -118,56 +159,57 @@ def render_rirs_array(echograms, band_centerfreqs, fs, grids, array_irs):
     L_rir = int(np.ceil(endtime * fs))
     L_fbank = 1000 if nBands > 1 else 0
 
+    # Transform the array IRs once per receiver, for all sources, and cache their spectra across calls
+    nffts = [_partition_fft_size(L_rir + L_fbank, np.shape(array_irs[nr])[0]) for nr in range(nRec)]
+    array_irs_f = [_get_array_irs_f(np.asarray(array_irs[nr], dtype=float).tobytes(), np.shape(array_irs[nr]), nffts[nr])
+                   for nr in range(nRec)]
+
+    pairs = [(nr, ns) for nr in range(nRec) for ns in range(nSrc)]
+    results = parallel_map(_render_rirs_array_pair,
+                           [(_pair_echograms(echograms, ns, nr), band_centerfreqs, fs, endtime, grids[nr],
+                             array_irs_f[nr], nffts[nr],
+                             np.shape(array_irs[nr])[0], render_kwargs, ns, nr)
+                            for nr, ns in pairs],
+                           n_jobs)
+
     array_rirs = [None] * nRec
     for nr in range(nRec):
-        grid_dirs_rad = grids[nr]
-        nGrid = np.shape(grid_dirs_rad)[0]
-        mic_irs = array_irs[nr]
-        L_resp = np.shape(mic_irs)[0]
-        nMics = np.shape(mic_irs)[1]
+        L_resp = np.shape(array_irs[nr])[0]
+        nMics = np.shape(array_irs[nr])[1]
         array_rirs[nr] = np.zeros((L_rir + L_fbank + L_resp - 1, nMics, nSrc))
-
-        for ns in range(nSrc):
-            print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr) )
-            print('      Quantize echograms to receiver grid')
-            echo2gridMap = get_echo2gridMap(echograms[ns, nr, 0], grid_dirs_rad)
-
-            tempRIR = np.zeros((L_rir, nGrid, nBands))
-            for nb in range(nBands):
-
-                # First step: reflections are quantized to the grid directions
-                q_echograms = quantise_echogram(echograms[ns, nr, nb], nGrid, echo2gridMap)
-                # Second step: render quantized echograms
-                print('      Rendering quantized echograms: Band ' + str(nb))
-                tempRIR[:, :, nb], _ = render_quantised(q_echograms, endtime, fs, fractional)
-
-            tempRIR2 = np.zeros((L_rir + L_fbank, nGrid))
-            print('      Filtering and combining bands')
-            for ng in range(nGrid):
-                tempRIR2[:, ng] = filter_rirs(tempRIR[:, ng, :], band_centerfreqs, fs).squeeze()
-
-            # Third step: convolve with directional IRs at grid directions
-            idx_nonzero = [i for i in range(tempRIR2.shape[1]) if np.sum(np.power(tempRIR2[:,i], 2)) > 10e-12]   # neglect grid directions with almost no energy
-            tempRIR2 = np.row_stack((tempRIR2[:, idx_nonzero], np.zeros((L_resp - 1, len(idx_nonzero)) )))
-            for nm in range(nMics):
-                tempResp = mic_irs[:, nm, idx_nonzero]
-                array_rirs[nr][:, nm, ns] = np.sum(scipy.signal.fftconvolve(tempResp, tempRIR2, axes=0)[:tempRIR2.shape[0], :], axis=1)
+    for (nr, ns), result in zip(pairs, results):
+        array_rirs[nr][:, :, ns] = result
 
     return array_rirs
 
 
-def render_rirs_mic(echograms, band_centerfreqs, fs):
+def render_rirs_mic(echograms, band_centerfreqs, fs, n_jobs=None, kernel='lagrange', kernel_order=100,
+                    transition_time=None, tail_kernel='nearest', tail_kernel_order=8, multirate=False):
     """
     Render a mic echogram array into an impulse response matrix.
 
     Parameters
     ----------
-    echograms : ndarray, dtype = Echogram
+    echograms : ndarray, dtype = Echogram, or EchogramSet
         Target echograms. Dimension = (nSrc, nRec, nBands)
     band_centerfreqs : ndarray
         Center frequencies of the filterbank. Dimension = (nBands)
     fs : int
         Target sampling rate
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
+    multirate : bool, optional
+        Render and filter the lower bands at decimated sampling rates. Default to False.
 
     Returns
     -------
@@ -184,18 +226,33 @@ def render_rirs_mic(echograms, band_centerfreqs, fs):
     The lowest center frequency must be at least equal to 30 Hz.
     Center frequencies must increase monotonically.
 
+    With `n_jobs`, each source/receiver pair is rendered in a process pool.
+    The result is bitwise identical to the serial rendering.
+    An EchogramSet is rendered pair by pair from its reflection arrays, without converting it into echograms.
+
+    See `render_rirs` for the available fractional delay kernels and the time-tiered rendering.
+
+    With `multirate`, each band is rendered and filtered at the lowest power-of-two decimated rate
+    that keeps its upper crossover frequency below a quarter of the rate, and then upsampled to `fs`.
+    The result approximates the full rate rendering, with a much lower cost for the lower bands.
+
     TODO: expose fractional, L_filterbank as parameter?
     """
 
     nSrc = echograms.shape[0]
     nRec = echograms.shape[1]
     nBands = echograms.shape[2]
-    _validate_echogram_array(echograms)
+    _validate_echograms(echograms)
     _validate_int('fs', fs, positive=True)
     _validate_ndarray_1D('f_center', band_centerfreqs, positive=True, size=nBands, limit=[30,fs/2])
+    _validate_n_jobs('n_jobs', n_jobs)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
+    _validate_boolean('multirate', multirate)
 
     # Sample echogram to a specific sampling rate with fractional interpolation
     fractional = True
+    render_kwargs = dict(fractional=fractional, kernel=kernel, kernel_order=kernel_order, transition_time=transition_time,
+                         tail_kernel=tail_kernel, tail_kernel_order=tail_kernel_order)
 
     # Decide on number of samples for all RIRs
     endtime = 0
@@ -210,33 +267,47 @@ def render_rirs_mic(echograms, band_centerfreqs, fs):
     L_tot = L_rir + L_fbank
 
     # Render responses and apply filterbank to combine different decays at different bands
-    rirs = np.empty((L_tot, nRec, nSrc))
-    for ns in range(nSrc):
-        for nr in range(nRec):
-
-            print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            tempIR = np.zeros((L_rir, nBands))
-            for nb in range(nBands):
-                tempIR[:, nb] = np.squeeze(render_rirs(echograms[ns, nr, nb], endtime, fs, fractional))
+    pairs = [(ns, nr) for ns in range(nSrc) for nr in range(nRec)]
+    results = parallel_map(_render_rirs_mic_pair,
+                           [(_pair_echograms(echograms, ns, nr), band_centerfreqs, fs, endtime, render_kwargs, multirate,
+                             ns, nr)
+                            for ns, nr in pairs],
+                           n_jobs)
 
-            print('     Filtering and combining bands')
-            rirs[:, nr, ns] = filter_rirs(tempIR, band_centerfreqs, fs).squeeze()
+    rirs = np.empty((L_tot, nRec, nSrc))
+    for (ns, nr), result in zip(pairs, results):
+        rirs[:, nr, ns] = result
 
     return rirs
 
 
-def render_rirs_sh(echograms, band_centerfreqs, fs):
+def render_rirs_sh(echograms, band_centerfreqs, fs, n_jobs=None, kernel='lagrange', kernel_order=100,
+                   transition_time=None, tail_kernel='nearest', tail_kernel_order=8, multirate=False):
     """
     Render a spherical harmonic echogram array into an impulse response matrix.
 
     Parameters
     ----------
-    echograms : ndarray, dtype = Echogram
+    echograms : ndarray, dtype = Echogram, or EchogramSet
         Target echograms. Dimension = (nSrc, nRec, nBands)
     band_centerfreqs : ndarray
         Center frequencies of the filterbank. Dimension = (nBands)
     fs : int
         Target sampling rate
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
+    multirate : bool, optional
+        Render and filter the lower bands at decimated sampling rates. Default to False.
 
     Returns
     -------
@@ -256,6 +327,16 @@ def render_rirs_sh(echograms, band_centerfreqs, fs):
     The lowest center frequency must be at least equal to 30 Hz.
     Center frequencies must increase monotonically.
 
+    With `n_jobs`, each source/receiver pair is rendered in a process pool.
+    The result is bitwise identical to the serial rendering.
+    An EchogramSet is rendered pair by pair from its reflection arrays, without converting it into echograms.
+
+    See `render_rirs` for the available fractional delay kernels and the time-tiered rendering.
+
+    With `multirate`, each band is rendered and filtered at the lowest power-of-two decimated rate
+    that keeps its upper crossover frequency below a quarter of the rate, and then upsampled to `fs`.
+    The result approximates the full rate rendering, with a much lower cost for the lower bands.
+
     TODO: expose fractional, L_filterbank as parameter?
     """
 
@@ -263,12 +344,17 @@ def render_rirs_sh(echograms, band_centerfreqs, fs):
     nSrc = echograms.shape[0]
     nRec = echograms.shape[1]
     nBands = echograms.shape[2]
-    _validate_echogram_array(echograms)
+    _validate_echograms(echograms)
     _validate_int('fs', fs, positive=True)
     _validate_ndarray_1D('f_center', band_centerfreqs, positive=True, size=nBands, limit=[30,fs/2])
+    _validate_n_jobs('n_jobs', n_jobs)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
+    _validate_boolean('multirate', multirate)
 
     # Sample echogram to a specific sampling rate with fractional interpolation
     fractional = True
+    render_kwargs = dict(fractional=fractional, kernel=kernel, kernel_order=kernel_order, transition_time=transition_time,
+                         tail_kernel=tail_kernel, tail_kernel_order=tail_kernel_order)
 
     # Decide on number of samples for all RIRs
     endtime = 0
@@ -285,31 +371,362 @@ def render_rirs_sh(echograms, band_centerfreqs, fs):
     # Find maximum number of SH channels in all echograms
     maxSH = 0
     for nr in range(nRec):
-        tempSH = np.shape(echograms[0, nr, 0].value)[1]
+        tempSH = echograms.channels[nr] if isinstance(echograms, EchogramSet) else np.shape(echograms[0, nr, 0].value)[1]
         if tempSH > maxSH:
             maxSH = tempSH
 
     # Render responses and apply filterbank to combine different decays at different bands
+    pairs = [(ns, nr) for ns in range(nSrc) for nr in range(nRec)]
+    results = parallel_map(_render_rirs_sh_pair,
+                           [(_pair_echograms(echograms, ns, nr), band_centerfreqs, fs, endtime, render_kwargs, multirate,
+                             ns, nr)
+                            for ns, nr in pairs],
+                           n_jobs)
+
     rirs = np.empty((L_tot, maxSH, nRec, nSrc))
-    for ns in range(nSrc):
-        for nr in range(nRec):
+    for (ns, nr), result in zip(pairs, results):
+        rirs[:, :result.shape[1], nr, ns] = result
 
-            print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
-            nSH = np.shape(echograms[ns, nr, 0].value)[1]
+    return rirs
 
-            tempIR = np.zeros((L_rir, nSH, nBands))
-            for nb in range(nBands):
-                tempIR[:, :, nb] = render_rirs(echograms[ns, nr, nb], endtime, fs, fractional)
 
-            print('     Filtering and combining bands')
-            for nh in range(nSH):
-                rirs[:, nh, nr, ns] = filter_rirs(tempIR[:, nh, :], band_centerfreqs, fs).squeeze()
-    return rirs
 
 
+def _render_rirs_array_pair(echograms, band_centerfreqs, fs, endtime, grid_dirs_rad, mic_irs_f, nfft, L_resp, render_kwargs,
+                            ns, nr):
+    """
+    Render the echograms of a single source/receiver pair into mic array IRs.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    band_centerfreqs : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    endtime : float
+        Maximum time of rendered reflections, in seconds.
+    grid_dirs_rad : ndarray
+        DoA grid of the receiver. Dimension = (nDoa, C-1)
+    mic_irs_f : ndarray
+        Spectra of the IR of each element of the receiver, at `nfft` points. Dimension = (nfft//2+1, nDoa, nMic)
+    nfft : int
+        FFT size of the array IR spectra.
+    L_resp : int
+        Length of the array IRs.
+    render_kwargs : dict
+        Keyword arguments of `render_rirs` (fractional delay options).
+    ns, nr : int
+        Source and receiver indices, for progress messages.
+
+    Returns
+    -------
+    rir : ndarray
+        Rendered IRs. Dimension = (L2, nMic)
+    """
+
+    # Reflections are quantised band by band, from read-only views for echogram sets
+    echograms = _band_echograms(echograms)
+    nBands = echograms.shape[0]
+    nGrid = np.shape(grid_dirs_rad)[0]
+    L_rir = int(np.ceil(endtime * fs))
+
+    print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr) )
+    print('      Quantize echograms to receiver grid')
+    echo2gridMap = get_echo2gridMap(echograms[0], grid_dirs_rad)
+
+    tempRIR = np.zeros((L_rir, nGrid, nBands))
+    for nb in range(nBands):
+
+        # First step: reflections are quantized to the grid directions
+        q_echograms = quantise_echogram_set(echograms[nb], nGrid, echo2gridMap)
+        # Second step: render quantized echograms
+        print('      Rendering quantized echograms: Band ' + str(nb))
+        tempRIR[:, :, nb], _ = render_quantised(q_echograms, endtime, fs, **render_kwargs)
+
+    print('      Filtering and combining bands')
+    tempRIR2 = filter_rirs_batch(tempRIR, band_centerfreqs, fs)
+
+    # Third step: convolve with directional IRs at grid directions, and mix them in the frequency domain
+    idx_nonzero = [i for i in range(tempRIR2.shape[1]) if np.sum(np.power(tempRIR2[:,i], 2)) > 10e-12]   # neglect grid directions with almost no energy
+    rir = _convolve_mix(tempRIR2[:, idx_nonzero], mic_irs_f[:, idx_nonzero, :], nfft, L_resp)
+
+    return rir
+
+
+def _render_rirs_mic_pair(echograms, band_centerfreqs, fs, endtime, render_kwargs, multirate, ns, nr):
+    """
+    Render the echograms of a single source/receiver pair into a filtered IR.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    band_centerfreqs : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    endtime : float
+        Maximum time of rendered reflections, in seconds.
+    render_kwargs : dict
+        Keyword arguments of `render_rirs` (fractional delay options).
+    multirate : bool
+        Render the lower bands at decimated sampling rates.
+    ns, nr : int
+        Source and receiver indices, for progress messages.
+
+    Returns
+    -------
+    rir : ndarray
+        Rendered IR. Dimension = (L_rir + L_fbank)
+    """
+
+    print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
+    return _render_bands(echograms, band_centerfreqs, fs, endtime, render_kwargs, multirate)[:, 0]
+
+
+def _render_rirs_sh_pair(echograms, band_centerfreqs, fs, endtime, render_kwargs, multirate, ns, nr):
+    """
+    Render the spherical harmonic echograms of a single source/receiver pair into filtered IRs.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    band_centerfreqs : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    endtime : float
+        Maximum time of rendered reflections, in seconds.
+    render_kwargs : dict
+        Keyword arguments of `render_rirs` (fractional delay options).
+    multirate : bool
+        Render the lower bands at decimated sampling rates.
+    ns, nr : int
+        Source and receiver indices, for progress messages.
+
+    Returns
+    -------
+    rir : ndarray
+        Rendered IRs. Dimension = (L_rir + L_fbank, nSH)
+    """
+
+    print('Rendering echogram: Source ' + str(ns) + ' - Receiver ' + str(nr))
+    return _render_bands(echograms, band_centerfreqs, fs, endtime, render_kwargs, multirate)
+
+
+def _render_bands(echograms, band_centerfreqs, fs, endtime, render_kwargs, multirate):
+    """
+    Render the band echograms of a source/receiver pair, and combine them with the filterbank.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    band_centerfreqs : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    endtime : float
+        Maximum time of rendered reflections, in seconds.
+    render_kwargs : dict
+        Keyword arguments of `render_rirs` (fractional delay options).
+    multirate : bool
+        Render the lower bands at decimated sampling rates.
+
+    Returns
+    -------
+    rir : ndarray
+        Rendered IRs. Dimension = (L_rir + L_fbank, nChannels)
+
+    Notes
+    -----
+    In multirate mode, each band is rendered and filtered at fs/D (see `_multirate_factors`),
+    with fractional delay kernels and a filter of order 1/D of the full rate ones,
+    and then upsampled to fs with a polyphase filter.
+    Since the kernel and filter lengths in seconds are the same as at full rate,
+    the result approximates the full rate rendering, at a fraction of the cost for the lower bands.
+    """
+
+    nBands, nChannels = _pair_shape(echograms)
+    L_rir = int(np.ceil(endtime * fs))
+
+    if not multirate or nBands == 1:
+        tempIR = render_rirs_bands(echograms, endtime, fs, **render_kwargs)
+
+        print('     Filtering and combining bands')
+        return filter_rirs_batch(tempIR, band_centerfreqs, fs)
+
+    order = 1000
+    f_center = tuple(float(f) for f in band_centerfreqs)
+    factors = _multirate_factors(band_centerfreqs, fs, order)
+    rir = np.zeros((L_rir + order, nChannels))
+    for D in np.unique(factors):
+        # Render and filter all the bands sharing the same decimation factor
+        bands = np.flatnonzero(factors == D)
+        fs_D = int(fs // D)
+        order_D = int(order // D)
+        # Kernels keep their length in seconds, so their cost also decreases with D
+        render_kwargs_D = dict(render_kwargs)
+        for key in ['kernel_order', 'tail_kernel_order']:
+            if key in render_kwargs_D:
+                render_kwargs_D[key] = max(1, int(render_kwargs_D[key] // D))
+        tempIR = render_rirs_bands(_select_bands(echograms, bands), endtime, fs_D, **render_kwargs_D)
+
+        print('     Filtering and combining bands at ' + str(fs_D) + ' Hz')
+        filters = np.stack([_get_band_filter(f_center, nb, fs_D, order_D, 30.) for nb in bands], axis=1)
+        band_rir = _filter_and_sum(tempIR, filters)
+        if D > 1:
+            # Impulses at fs/D carry D times the energy of impulses at fs
+            band_rir = scipy.signal.resample_poly(band_rir, D, 1, axis=0) / D
+        L = min(band_rir.shape[0], rir.shape[0])
+        rir[:L] += band_rir[:L]
+
+    return rir
+
+
+def _band_reflections(echograms):
+    """
+    Common reflection list of the band echograms of a source/receiver pair.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Band echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+
+    Returns
+    -------
+    time : ndarray
+        Reflection times of the longest band echogram. Dimension = (nRefl)
+    value : ndarray
+        Reflection values per band, zero beyond the length of each band. Dimension = (nRefl, nChannels, nBands)
+
+    Notes
+    -----
+    Band echograms given by `apply_absorption` share their reflections and only differ in gains and length,
+    so that each of them is a prefix of the longest one. If that is not the case, None is returned instead.
+    Echogram sets are stored that way, so their band values are directly built from the set arrays.
+    """
+
+    if isinstance(echograms, EchogramSet):
+        lengths = echograms.lengths[0, 0]
+        nRefl = np.max(lengths)
+        value = echograms.value[:nRefl, :echograms.channels[0], np.newaxis] * echograms.gains[:nRefl, np.newaxis, :]
+        in_band = np.arange(nRefl)[:, np.newaxis] < lengths
+        return echograms.time[:nRefl], np.where(in_band[:, np.newaxis, :], value, 0.)
+
+    nBands = echograms.shape[0]
+    lengths = [echograms[nb].time.size for nb in range(nBands)]
+    longest = echograms[int(np.argmax(lengths))]
+    nChannels = np.shape(longest.value)[1]
+    for nb in range(nBands):
+        if np.shape(echograms[nb].value)[1] != nChannels or \
+                not np.array_equal(echograms[nb].time, longest.time[:lengths[nb]]):
+            return None
+
+    value = np.zeros((longest.time.size, nChannels, nBands))
+    for nb in range(nBands):
+        value[:lengths[nb], :, nb] = echograms[nb].value
+    return longest.time, value
+
+
+def _validate_echograms(echograms):
+    """
+    Validate the echograms of a scene, given as an Echogram ndarray or as an EchogramSet.
+    """
+    if isinstance(echograms, EchogramSet):
+        _validate_echogram_set(echograms)
+    else:
+        _validate_echogram_array(echograms)
+
+
+def _pair_echograms(echograms, ns, nr):
+    """
+    Band echograms of a source/receiver pair: an Echogram ndarray (nBands), or an EchogramSet of the pair.
+    """
+    if isinstance(echograms, EchogramSet):
+        return echograms.pair(ns, nr)
+    return echograms[ns, nr]
+
+
+def _pair_shape(echograms):
+    """
+    Number of bands and channels of the band echograms of a source/receiver pair.
+    """
+    if isinstance(echograms, EchogramSet):
+        return echograms.shape[2], int(echograms.channels[0])
+    return echograms.shape[0], np.shape(echograms[0].value)[1]
 
 
-def render_rirs(echogram, endtime, fs, fractional=True):
+def _band_echograms(echograms):
+    """
+    Band echograms of a source/receiver pair as an Echogram ndarray, with read-only views for echogram sets.
+    """
+    if not isinstance(echograms, EchogramSet):
+        return echograms
+    nBands = echograms.shape[2]
+    band_echograms = np.empty(nBands, dtype=Echogram)
+    for nb in range(nBands):
+        band_echograms[nb] = echograms[0, 0, nb]
+    return band_echograms
+
+
+def _select_bands(echograms, bands):
+    """
+    Subset of the band echograms of a source/receiver pair.
+    """
+    if not isinstance(echograms, EchogramSet):
+        return echograms[bands]
+    return EchogramSet(value=echograms.value,
+                       time=echograms.time,
+                       order=echograms.order,
+                       coords=echograms.coords,
+                       offsets=echograms.offsets,
+                       channels=echograms.channels,
+                       gains=echograms.gains[:, bands],
+                       lengths=echograms.lengths[:, :, bands])
+
+
+def _multirate_factors(f_center, fs, order=1000):
+    """
+    Decimation factor of each band for multirate rendering.
+
+    Parameters
+    ----------
+    f_center : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    order : int, optional
+        Order of the full rate filters. Default to 1000.
+
+    Returns
+    -------
+    factors : ndarray, dtype = int
+        Decimation factors. Dimension = (nBands)
+
+    Notes
+    -----
+    Each band is assigned the largest power of two D such that its upper crossover frequency
+    is at most fs/(4D), and D divides both `fs` and `order`.
+    The last (highpass) band is always rendered at full rate.
+    """
+
+    nBands = f_center.size
+    factors = np.ones(nBands, dtype=int)
+    for i in range(nBands - 1):
+        fh = np.sqrt(f_center[i] * f_center[i + 1])
+        D = 1
+        while fs % (2*D) == 0 and order % (2*D) == 0 and fh <= fs / (4. * 2*D):
+            D *= 2
+        factors[i] = D
+    return factors
+
+
+def render_rirs(echogram, endtime, fs, fractional=True, kernel='lagrange', kernel_order=100,
+                transition_time=None, tail_kernel='nearest', tail_kernel_order=8):
     """
     Render an echogram into an impulse response.
 
@@ -323,6 +740,16 @@ def render_rirs(echogram, endtime, fs, fractional=True):
         Target sampling rate
     fractional : bool, optional
         Use fractional or integer (round) delay. Default to True.
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
 
     Returns
     -------
@@ -335,13 +762,28 @@ def render_rirs(echogram, endtime, fs, fractional=True):
 
     Notes
     -----
-    TODO: expose filter order as parameter?
+    With `fractional`, each reflection is rendered with a fractional delay filter
+    taken from a table with 1/100 sample resolution:
+    - 'lagrange': lagrange interpolator of order `kernel_order`.
+    - 'sinc': Hann-windowed sinc of order `kernel_order`.
+    - 'nearest': single tap at the closest sample (`kernel_order` is ignored).
+    The cost of the accumulation is proportional to the filter length,
+    so lower orders trade accuracy for speed.
+
+    Since reflection density grows with time, most of the cost lies in the late part of the response.
+    If `transition_time` is given, reflections arriving before it are rendered with `kernel`,
+    and the rest with the (usually cheaper) `tail_kernel`. The early part of the response
+    is then unchanged, up to the tails of the late reflection filters.
+
+    Without `fractional`, reflections are rendered at the closest sample,
+    and reflections falling on the same sample overwrite each other.
     """
 
     _validate_echogram(echogram)
     _validate_float('endtime', endtime, positive=True)
     _validate_int('fs', fs, positive=True)
     _validate_boolean('fractional', fractional)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
 
     nChannels = 1 if np.ndim(echogram.value) <= 1 else np.shape(echogram.value)[1]
     L_ir = int(np.ceil(endtime * fs))
@@ -350,27 +792,8 @@ def render_rirs(echogram, endtime, fs, fractional=True):
     idx_trans = echogram.time[echogram.time < endtime].size
 
     if fractional:
-        # Get lagrange interpolating filter of order 100 (filter length 101)
-        order = 100
-        h_offset = 50
-        h_idx = np.arange(-(order/2), (order/2)+1).astype(int)  # only valid for even orders
-
-        # Make a filter table for quick access for quantized fractional samples
-        fractions = np.linspace(0, 1, 101)
-        H_frac = lagrange(order, 50 + fractions)
-
-        # Initialise array
-        tmp_ir = np.zeros((int(L_ir + (2*h_offset)), nChannels))
-
-        for i in range(idx_trans):
-            refl_idx = int(np.floor(echogram.time[i] * fs) + 1)
-            refl_frac = np.remainder(echogram.time[i] * fs, 1)
-            filter_idx = np.argmin(np.abs(refl_frac - fractions))
-            h_frac = H_frac[:, filter_idx]
-
-            tmp_ir[h_offset+refl_idx+h_idx-1, :] += h_frac[:, np.newaxis] * echogram.value[i]
-
-        ir = tmp_ir[h_offset:-h_offset, :]
+        ir = _render_fractional(echogram.time[:idx_trans], echogram.value[:idx_trans], L_ir, fs, kernel, kernel_order,
+                                transition_time, tail_kernel, tail_kernel_order)
 
     else:
         refl_idx = (np.round(echogram.time[:idx_trans] * fs)).astype(int)
@@ -381,13 +804,252 @@ def render_rirs(echogram, endtime, fs, fractional=True):
     return ir
 
 
-def render_quantised(qechogram, endtime, fs, fractional):
+def render_rirs_bands(echograms, endtime, fs, fractional=True, kernel='lagrange', kernel_order=100,
+                      transition_time=None, tail_kernel='nearest', tail_kernel_order=8):
+    """
+    Render the band echograms of a source/receiver pair into impulse responses, in a single pass.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target band echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    endtime : float
+        Maximum time of rendered reflections, in seconds.
+    fs : int
+        Target sampling rate
+    fractional : bool, optional
+        Use fractional or integer (round) delay. Default to True.
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
+
+    Returns
+    -------
+    ir : ndarray
+        Rendered echograms. Dimension = (ceil(endtime * fs), nChannels, nBands)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The result is equivalent to calling `render_rirs` for each band.
+    Band echograms given by `apply_absorption` share their reflections, and only differ in gains and length.
+    In that case the reflection list is walked only once: sample indices and fractional delay filters
+    are computed once for all bands, and each reflection is masked out of the bands it does not belong to.
+    Otherwise, or without `fractional`, each band is rendered separately.
+    The bands of an echogram set always share their reflections, and are rendered
+    directly from the reflection arrays of the set.
+    """
+
+    if isinstance(echograms, EchogramSet):
+        _validate_echogram_set(echograms)
+        if echograms.shape[:2] != (1, 1):
+            raise ValueError('echograms must hold a single source/receiver pair')
+    else:
+        for nb in range(echograms.shape[0]):
+            _validate_echogram(echograms[nb])
+    _validate_float('endtime', endtime, positive=True)
+    _validate_int('fs', fs, positive=True)
+    _validate_boolean('fractional', fractional)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
+
+    nBands = _pair_shape(echograms)[0]
+    reflections = _band_reflections(echograms) if fractional else None
+    if reflections is None:
+        echograms = _band_echograms(echograms)
+        return np.stack([render_rirs(echograms[nb], endtime, fs, fractional, kernel, kernel_order,
+                                     transition_time, tail_kernel, tail_kernel_order) for nb in range(nBands)], axis=2)
+
+    time, value = reflections
+    nChannels = value.shape[1]
+    L_ir = int(np.ceil(endtime * fs))
+    # Number of reflections inside the time limit
+    idx_trans = time[time < endtime].size
+    ir = _render_fractional(time[:idx_trans], value[:idx_trans].reshape((idx_trans, nChannels * nBands)), L_ir, fs,
+                            kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
+    return ir.reshape((L_ir, nChannels, nBands))
+
+
+def _render_fractional(time, value, L_ir, fs, kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order,
+                       refl_dir=None, nDirs=1):
+    """
+    Render a list of reflections with fractional delay filters.
+
+    Parameters
+    ----------
+    time : ndarray
+        Reflection times, in seconds, smaller than L_ir/fs. Dimension = (nRefl)
+    value : ndarray
+        Reflection values. Dimension = (nRefl, nChannels)
+    L_ir : int
+        Length of the impulse response, in samples.
+    fs : int
+        Target sampling rate
+    kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order
+        Fractional delay options, see `render_rirs`.
+    refl_dir : ndarray, optional
+        Output direction of each reflection, in [0, nDirs). Dimension = (nRefl)
+    nDirs : int, optional
+        Number of output directions. Default to 1.
+
+    Returns
+    -------
+    ir : ndarray
+        Rendered reflections. Dimension = (L_ir, nDirs * nChannels)
+    """
+
+    nChannels = value.shape[1]
+
+    # Reflections rendered with the main and the tail kernels
+    if transition_time is None:
+        parts = [(slice(None), kernel, kernel_order)]
+        kernels = [(kernel, kernel_order)]
+    else:
+        early = time < transition_time
+        parts = [(early, kernel, kernel_order), (~early, tail_kernel, tail_kernel_order)]
+        kernels = [(kernel, kernel_order), (tail_kernel, tail_kernel_order)]
+
+    # Initialise array, with room for the filter tails and for rounding up the last sample
+    orders = [0 if k == 'nearest' else o for k, o in kernels]
+    h_pre = max(o // 2 for o in orders)
+    h_post = max(o - o // 2 for o in orders) + 1
+    tmp_ir = np.zeros((L_ir + h_pre + h_post, nDirs * nChannels))
+
+    refl_time = time * fs
+    for refl, part_kernel, part_order in parts:
+        _scatter_kernel(tmp_ir, h_pre, refl_time[refl], value[refl], part_kernel, part_order,
+                        None if refl_dir is None else refl_dir[refl])
+
+    return tmp_ir[h_pre:h_pre+L_ir, :]
+
+
+def _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order):
+    """
+    Validate the fractional delay kernel arguments of the rendering methods.
+    """
+
+    _validate_string('kernel', kernel, choices=['lagrange', 'sinc', 'nearest'])
+    _validate_int('kernel_order', kernel_order, positive=True)
+    if transition_time is not None:
+        _validate_number('transition_time', transition_time, positive=True)
+    _validate_string('tail_kernel', tail_kernel, choices=['lagrange', 'sinc', 'nearest'])
+    _validate_int('tail_kernel_order', tail_kernel_order, positive=True)
+
+
+def _scatter_kernel(tmp_ir, h_pre, refl_time, value, kernel, kernel_order, refl_dir=None):
+    """
+    Accumulate the fractional delay filters of a set of reflections into an impulse response.
+
+    Parameters
+    ----------
+    tmp_ir : ndarray
+        Impulse response, modified in place. Dimension = (L, nChannels)
+    h_pre : int
+        Offset of the sample 0 in `tmp_ir`, at least kernel_order // 2.
+    refl_time : ndarray
+        Reflection times, in samples. Dimension = (nRefl)
+    value : ndarray
+        Reflection values. Dimension = (nRefl, nChannels)
+    kernel : str
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'.
+    kernel_order : int
+        Order of the fractional delay kernel.
+    refl_dir : ndarray, optional
+        Output direction of each reflection. If given, `tmp_ir` holds the channels of all directions,
+        and is seen as (L, nDirs, nChannels). Dimension = (nRefl)
+    """
+
+    nRefl = refl_time.size
+    if nRefl == 0:
+        return
+    L_tmp = tmp_ir.shape[0]
+    nDirs = tmp_ir.shape[1] // value.shape[1]
+    # Rows of the taps in the (L * nDirs, nChannels) view of the impulse response
+    out = tmp_ir.reshape((L_tmp * nDirs, value.shape[1]))
+    if refl_dir is None:
+        refl_dir = np.zeros(nRefl, dtype=int)
+
+    # Quantise all fractional delays to the filter table
+    if kernel == 'nearest':
+        h_idx = np.zeros(1, dtype=int)
+        H_frac = np.ones((1, 1))
+        refl_idx = np.floor(refl_time + 0.5).astype(int)
+        filter_idx = np.zeros(nRefl, dtype=int)
+    else:
+        h_idx = np.arange(kernel_order + 1) - kernel_order // 2
+        fractions, H_frac = _kernel_table(kernel, kernel_order)
+        refl_idx = np.floor(refl_time).astype(int)
+        filter_idx = _nearest_fraction(np.remainder(refl_time, 1), fractions)
+
+    # Accumulate the filters of all reflections, by chunks of reflections
+    chunk_size = max(1, _SCATTER_SIZE // h_idx.size)
+    for i0 in range(0, nRefl, chunk_size):
+        i1 = min(i0 + chunk_size, nRefl)
+        tap_idx = ((h_pre + refl_idx[i0:i1, np.newaxis] + h_idx) * nDirs + refl_dir[i0:i1, np.newaxis]).ravel()
+        h_frac = H_frac[:, filter_idx[i0:i1]].T.ravel()
+        # One column of taps per reflection: the product sums the taps of all channels in a single pass
+        taps = scipy.sparse.csc_matrix((h_frac, tap_idx, np.arange(i1 - i0 + 1) * h_idx.size),
+                                       shape=(L_tmp * nDirs, i1 - i0))
+        out += taps @ value[i0:i1]
+
+
+def _kernel_table(kernel, order):
+    """
+    Fractional delay filter table of the given kernel and order, with 1/100 sample resolution.
+    """
+
+    if kernel == 'lagrange':
+        return lagrange_table(order, 100)
+    elif kernel == 'sinc':
+        return sinc_table(order, 100)
+
+
+def _nearest_fraction(refl_frac, fractions):
+    """
+    Index of the closest table fraction for each fractional delay.
+
+    Parameters
+    ----------
+    refl_frac : ndarray
+        Fractional delays, in the range [0, 1). Dimension = (nRefl)
+    fractions : ndarray
+        Uniformly spaced table fractions, from 0 to 1. Dimension = (nFrac)
+
+    Returns
+    -------
+    filter_idx : ndarray, dtype = int
+        Table indices. Dimension = (nRefl)
+
+    Notes
+    -----
+    Only the table entries around `floor(refl_frac * (nFrac-1))` are compared,
+    with the same tie-breaking (lowest index) as `np.argmin` over the whole table.
+    """
+
+    n = fractions.size - 1
+    centre = np.clip(np.floor(refl_frac * n).astype(int), 1, n - 1)
+    candidates = centre[:, np.newaxis] + np.arange(-1, 2)
+    distance = np.abs(refl_frac[:, np.newaxis] - fractions[candidates])
+    return candidates[np.arange(refl_frac.size), np.argmin(distance, axis=1)]
+
+
+def render_quantised(qechogram, endtime, fs, fractional, kernel='lagrange', kernel_order=100,
+                     transition_time=None, tail_kernel='nearest', tail_kernel_order=8):
     """
     Render a quantised echogram array into a quantised impulse response matrix.
 
     Parameters
     ----------
-    qechograms : ndarray, dtype = QuantisedEchogram
+    qechograms : ndarray, dtype = QuantisedEchogram, or QuantisedEchogramSet
         Target quantised echograms. Dimension = (nDirs).
     endtime : float
         Maximum time of rendered reflections, in seconds.
@@ -395,6 +1057,16 @@ def render_quantised(qechogram, endtime, fs, fractional):
         Target sampling rate
     fractional : bool, optional
         Use fractional or integer (round) delay. Default to True.
+    kernel : str, optional
+        Fractional delay kernel: 'lagrange', 'sinc' or 'nearest'. Default to 'lagrange'.
+    kernel_order : int, optional
+        Order of the fractional delay kernel (length = order+1). Default to 100.
+    transition_time : float, optional
+        Time from which reflections are rendered with the tail kernel, in seconds. Default to None (no tail).
+    tail_kernel : str, optional
+        Fractional delay kernel of the reflections after `transition_time`. Default to 'nearest'.
+    tail_kernel_order : int, optional
+        Order of the tail fractional delay kernel. Default to 8.
 
     Returns
     -------
@@ -407,40 +1079,56 @@ def render_quantised(qechogram, endtime, fs, fractional):
     -----
     TypeError, ValueError: if method arguments mismatch in type, dimension or value.
 
+    Notes
+    -----
+    The reflections of all directions are rendered at once, each one into the column of its direction.
+    The result is the same as rendering each active direction with `render_rirs`.
+
     TODO: expose fractional as parameter?
     """
 
-    _validate_quantised_echogram_array(qechogram)
+    if isinstance(qechogram, QuantisedEchogramSet):
+        _validate_quantised_echogram_set(qechogram)
+        q_set = qechogram
+        isActive = q_set.isActive
+    else:
+        _validate_quantised_echogram_array(qechogram)
+        # Gather the quantised echograms into contiguous arrays
+        sizes = np.asarray([q.time.size for q in qechogram], dtype=int)
+        q_set = QuantisedEchogramSet(value=np.concatenate([q.value for q in qechogram]),
+                                     time=np.concatenate([q.time for q in qechogram]),
+                                     offsets=np.concatenate(([0], np.cumsum(sizes))))
+        isActive = np.asarray([q.isActive for q in qechogram], dtype=bool)
     _validate_float('edntime', endtime, positive=True)
     _validate_int('fs', fs, positive=True)
     _validate_boolean('fractional', fractional)
+    _validate_kernel(kernel, kernel_order, transition_time, tail_kernel, tail_kernel_order)
 
     # Number of grid directions of the quantization
-    nDirs = qechogram.size
+    nDirs = q_set.offsets.size - 1
+    # Omit directions with no echoes
+    idx_nonzero = np.flatnonzero(isActive)
+    isActive_refl = np.repeat(isActive, np.diff(q_set.offsets))
 
-    # Render echograms
+    # Reflections inside the time limit, with their grid direction
     L_rir = int(np.ceil(endtime * fs))
-    qIR = np.zeros((L_rir, nDirs))
-    idx_nonzero = []
-    for nq in range(nDirs):
-        tempgram = Echogram(
-            time=qechogram[nq].time,
-            value=qechogram[nq].value,
-            order=np.zeros((qechogram[nq].time.size, 3), dtype=int),  # whatever to pass the size validation
-            coords=np.zeros((qechogram[nq].time.size, 3)))            # whatever to pass the size validation
-        # Omit if there are no echoes in the specific one
-        if qechogram[nq].isActive:
-            idx_nonzero.append(nq)
-            # Number of reflections inside the time limit')
-            idx_limit = tempgram.time[tempgram.time < endtime].size
-            tempgram.time = tempgram.time[:idx_limit+1]
-            tempgram.value = tempgram.value[:idx_limit+1]
-            tempgram.order = tempgram.order[:idx_limit+1]    # whatever to pass the size validation
-            tempgram.coords = tempgram.coords[:idx_limit+1]  # whatever to pass the size validation
-
-            qIR[:, nq] = render_rirs(tempgram, endtime, fs, fractional).squeeze()
-
-    return qIR, np.asarray(idx_nonzero)
+    refl = np.flatnonzero(isActive_refl & (q_set.time < endtime))
+    refl_dir = np.repeat(np.arange(nDirs), np.diff(q_set.offsets))[refl]
+    time = q_set.time[refl]
+    value = q_set.value[refl, :1]
+
+    # Render echograms
+    if fractional:
+        qIR = _render_fractional(time, value, L_rir, fs, kernel, kernel_order, transition_time, tail_kernel,
+                                 tail_kernel_order, refl_dir, nDirs)
+    else:
+        qIR = np.zeros((L_rir, nDirs))
+        refl_idx = (np.round(time * fs)).astype(int)
+        # Filter out exceeding indices
+        inside = refl_idx < L_rir
+        qIR[refl_idx[inside], refl_dir[inside]] = value[inside, 0]
+
+    return qIR, idx_nonzero
 
 
 def filter_rirs(rir, f_center, fs):
@@ -482,31 +1170,179 @@ def filter_rirs(rir, f_center, fs):
     _validate_int('fs', fs, positive=True)
     _validate_ndarray_1D('f_center', f_center, positive=True, size=nBands, limit=[30,fs/2])
 
+    return filter_rirs_batch(rir[:, np.newaxis, :], f_center, fs)
+
+
+def filter_rirs_batch(rir, f_center, fs):
+    """
+    Apply a filterbank to a given set of multichannel impulse responses, and combine the bands.
+
+    Parameters
+    ----------
+    rir : ndarray
+        Impulse responses to be filtered.  Dimension = (L, nChannels, nBands)
+    f_center : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+
+    Returns
+    -------
+    ir : ndarray
+        Filtered impulse responses. Dimension = (L+M, nChannels)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The filterbank is computed once for each (f_center, fs) combination, see `filter_rirs`.
+    All channels are filtered with a single FFT of the filters, and the bands
+    are combined in the frequency domain, so that only one inverse FFT per channel is needed.
+
+    If `nBands` is 1, the impulse responses are returned without filtering (M = 0).
+    """
+
+    nBands = rir.shape[2]
+    _validate_ndarray_3D('rir', rir)
+    _validate_int('fs', fs, positive=True)
+    _validate_ndarray_1D('f_center', f_center, positive=True, size=nBands, limit=[30,fs/2])
+
     if nBands == 1:
-        rir_full = rir
-    else:
-        order = 1000
-        filters = np.zeros((order + 1, nBands))
-        for i in range(nBands):
-            if i == 0:
-                fl = 30. 
-                fh = np.sqrt(f_center[i] * f_center[i + 1])
-                wl = fl / (fs / 2.)
-                wh = fh / (fs / 2.)
-                filters[:, i] = scipy.signal.firwin(order+1, [wl, wh], pass_zero='bandpass')
-            elif i == nBands-1:
-                fl = np.sqrt(f_center[i] * f_center[i - 1])
-                w = fl / (fs / 2.)
-                filters[:, i] = scipy.signal.firwin(order+1, w, pass_zero='highpass')
-            else:
-                fl = np.sqrt(f_center[i] * f_center[i - 1])
-                fh = np.sqrt(f_center[i] * f_center[i + 1])
-                wl = fl / (fs / 2.)
-                wh = fh / (fs / 2.)
-                filters[:, i] = scipy.signal.firwin(order + 1, [wl, wh], pass_zero='bandpass')
-        
-        temp_rir = np.append(rir, np.zeros((order, nBands)), axis=0)
-        rir_filt = scipy.signal.fftconvolve(filters, temp_rir, axes=0)[:temp_rir.shape[0],:]
-        rir_full = np.sum(rir_filt, axis=1)[:,np.newaxis]
-    
+        return rir[:, :, 0]
+
+    order = 1000
+    filters = get_filterbank(f_center, fs, order)
+    return _filter_and_sum(rir, filters)
+
+
+def _filter_and_sum(rir, filters):
+    """
+    Filter each band of a set of multichannel impulse responses, and sum the bands.
+
+    Parameters
+    ----------
+    rir : ndarray
+        Impulse responses to be filtered.  Dimension = (L, nChannels, nBands)
+    filters : ndarray
+        Filter of each band. Dimension = (M+1, nBands)
+
+    Returns
+    -------
+    ir : ndarray
+        Filtered impulse responses. Dimension = (L+M, nChannels)
+    """
+
+    L, nChannels, nBands = rir.shape
+    L_full = L + filters.shape[0] - 1
+    nfft = scipy.fft.next_fast_len(L_full, real=True)
+    filters_f = scipy.fft.rfft(filters, nfft, axis=0)[:, np.newaxis, :]
+
+    # Filter by chunks of channels, to bound memory usage
+    rir_full = np.empty((L_full, nChannels))
+    chunk_size = max(1, _FFT_SIZE // (nfft * nBands))
+    for c0 in range(0, nChannels, chunk_size):
+        c1 = min(c0 + chunk_size, nChannels)
+        rir_f = scipy.fft.rfft(rir[:, c0:c1, :], nfft, axis=0)
+        rir_full[:, c0:c1] = scipy.fft.irfft(np.sum(filters_f * rir_f, axis=2), nfft, axis=0)[:L_full]
+
     return rir_full
+
+
+def get_filterbank(f_center, fs, order=1000, f_min=30.):
+    """
+    Design the FIR filterbank used to combine the rendered bands.
+
+    Parameters
+    ----------
+    f_center : ndarray
+        Center frequencies of the filterbank. Dimension = (nBands)
+    fs : int
+        Target sampling rate
+    order : int, optional
+        Order of the filters (length = order+1). Default to 1000.
+    f_min : float, optional
+        Lower cutoff frequency of the first band. Default to 30.
+
+    Returns
+    -------
+    filters : ndarray
+        Filterbank. Dimension = (order+1, nBands)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Filters are designed with `scipy.signal.firwin`: a bandpass for the first band, starting at `f_min`,
+    bandpasses for the intermediate bands and a highpass for the last band,
+    with crossover frequencies at the geometric mean of adjacent center frequencies.
+
+    Filterbanks are cached by (f_center, fs, order, f_min), so they are designed once per process.
+    The returned array is therefore read-only.
+    """
+
+    _validate_ndarray_1D('f_center', f_center, positive=True, limit=[f_min,fs/2])
+    _validate_int('fs', fs, positive=True)
+    _validate_int('order', order, positive=True)
+    _validate_number('f_min', f_min, positive=True)
+
+    return _get_filterbank(tuple(float(f) for f in f_center), fs, order, float(f_min))
+
+
+@functools.lru_cache(maxsize=8)
+def _get_array_irs_f(irs_bytes, shape, nfft):
+    """
+    Spectra of the IR of each element of a receiver, at `nfft` points. Dimension = (nfft//2+1, nDoa, nMic)
+    The IRs are given as the bytes of their float (L1, nMic, nDoa) array, so that they can be cached.
+    The returned array is therefore read-only.
+    """
+    irs = np.frombuffer(irs_bytes, dtype=float).reshape(shape)
+    irs_f = np.ascontiguousarray(scipy.fft.rfft(irs, nfft, axis=0).transpose((0, 2, 1)))
+    irs_f.flags.writeable = False
+    return irs_f
+
+
+@functools.lru_cache(maxsize=16)
+def _get_filterbank(f_center, fs, order, f_min):
+    """
+    Cached filterbank design, see `get_filterbank`. `f_center` must be a tuple.
+    """
+
+    nBands = len(f_center)
+    filters = np.zeros((order + 1, nBands))
+    for i in range(nBands):
+        filters[:, i] = _get_band_filter(f_center, i, fs, order, f_min)
+
+    filters.flags.writeable = False
+    return filters
+
+
+@functools.lru_cache(maxsize=64)
+def _get_band_filter(f_center, i, fs, order, f_min):
+    """
+    Cached design of the filter of band `i` of the filterbank, see `get_filterbank`. `f_center` must be a tuple.
+    """
+
+    nBands = len(f_center)
+    if i == 0:
+        fl = f_min
+        fh = np.sqrt(f_center[i] * f_center[i + 1])
+        wl = fl / (fs / 2.)
+        wh = fh / (fs / 2.)
+        h = scipy.signal.firwin(order+1, [wl, wh], pass_zero='bandpass')
+    elif i == nBands-1:
+        fl = np.sqrt(f_center[i] * f_center[i - 1])
+        w = fl / (fs / 2.)
+        h = scipy.signal.firwin(order+1, w, pass_zero='highpass')
+    else:
+        fl = np.sqrt(f_center[i] * f_center[i - 1])
+        fh = np.sqrt(f_center[i] * f_center[i + 1])
+        wl = fl / (fs / 2.)
+        wh = fh / (fs / 2.)
+        h = scipy.signal.firwin(order + 1, [wl, wh], pass_zero='bandpass')
+
+    h.flags.writeable = False
+    return h
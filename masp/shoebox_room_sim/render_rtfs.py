@@ -0,0 +1,255 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Copyright (c) 2019, Eurecat / UPF
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#   @file   render_rtfs.py
+#   @author Andrés Pérez-López
+#   @date   30/07/2019
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import numpy as np
+
+from masp.shoebox_room_sim.echogram import EchogramSet
+from masp.shoebox_room_sim.render_rirs import _band_reflections, _band_echograms, _pair_echograms, _validate_echograms
+from masp.shoebox_room_sim.parallel import parallel_map
+from masp.validate_data_types import _validate_ndarray_1D, _validate_n_jobs
+
+# Maximum number of complex exponentials evaluated at once
+_RTF_SIZE = 2**22
+
+
+def render_rtfs_mic(echograms, band_centerfreqs, freqs, n_jobs=None):
+    """
+    Render a mic echogram array into a room transfer function matrix.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nSrc, nRec, nBands)
+    band_centerfreqs : ndarray
+        Center frequencies of the echogram bands. Dimension = (nBands)
+    freqs : ndarray
+        Frequencies at which the transfer functions are evaluated, in Hz. Dimension = (nFreqs)
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
+
+    Returns
+    -------
+    rtf : ndarray, dtype = complex
+        Rendered transfer functions. Dimension = (nFreqs, nRec, nSrc)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Each reflection with time `t` contributes `a(f) * exp(-j*2*pi*f*t)` to the transfer function,
+    where `a(f)` is the reflection value, linearly interpolated across bands in logarithmic frequency
+    (and constant below the first and above the last center frequencies).
+    Delays are therefore exact, with no fractional delay filters and no filterbank.
+    The result corresponds to the spectrum of the output of `render_rirs_mic`,
+    without the delay introduced by its filterbank.
+    An EchogramSet is rendered pair by pair from its reflection arrays, without converting it into echograms.
+
+    Center frequencies must increase monotonically.
+    """
+
+    nSrc = echograms.shape[0]
+    nRec = echograms.shape[1]
+    nBands = echograms.shape[2]
+    _validate_echograms(echograms)
+    _validate_ndarray_1D('f_center', band_centerfreqs, positive=True, size=nBands)
+    _validate_ndarray_1D('freqs', freqs, positive=True)
+    _validate_n_jobs('n_jobs', n_jobs)
+
+    weights = _band_weights(band_centerfreqs, freqs)
+    pairs = [(ns, nr) for ns in range(nSrc) for nr in range(nRec)]
+    results = parallel_map(_render_rtf_pair, [(_pair_echograms(echograms, ns, nr), freqs, weights) for ns, nr in pairs],
+                           n_jobs)
+
+    rtfs = np.empty((freqs.size, nRec, nSrc), dtype=complex)
+    for (ns, nr), result in zip(pairs, results):
+        rtfs[:, nr, ns] = result[:, 0]
+
+    return rtfs
+
+
+def render_rtfs_sh(echograms, band_centerfreqs, freqs, n_jobs=None):
+    """
+    Render a spherical harmonic echogram array into a room transfer function matrix.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nSrc, nRec, nBands)
+    band_centerfreqs : ndarray
+        Center frequencies of the echogram bands. Dimension = (nBands)
+    freqs : ndarray
+        Frequencies at which the transfer functions are evaluated, in Hz. Dimension = (nFreqs)
+    n_jobs : int or Executor, optional
+        Number of worker processes (-1 for all cores), or executor to use. Default to None (serial).
+
+    Returns
+    -------
+    rtf : ndarray, dtype = complex
+        Rendered transfer functions. Dimension = (nFreqs, maxSH, nRec, nSrc)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    `maxSH` is the highest spherical harmonic number found in all echograms.
+    For any echogram with nSH<maxSH, the channels (nSH...maxSH) will contain only zeros.
+
+    See `render_rtfs_mic` for the transfer function computation.
+
+    Center frequencies must increase monotonically.
+    """
+
+    nSrc = echograms.shape[0]
+    nRec = echograms.shape[1]
+    nBands = echograms.shape[2]
+    _validate_echograms(echograms)
+    _validate_ndarray_1D('f_center', band_centerfreqs, positive=True, size=nBands)
+    _validate_ndarray_1D('freqs', freqs, positive=True)
+    _validate_n_jobs('n_jobs', n_jobs)
+
+    # Find maximum number of SH channels in all echograms
+    maxSH = 0
+    for nr in range(nRec):
+        tempSH = echograms.channels[nr] if isinstance(echograms, EchogramSet) else np.shape(echograms[0, nr, 0].value)[1]
+        if tempSH > maxSH:
+            maxSH = tempSH
+
+    weights = _band_weights(band_centerfreqs, freqs)
+    pairs = [(ns, nr) for ns in range(nSrc) for nr in range(nRec)]
+    results = parallel_map(_render_rtf_pair, [(_pair_echograms(echograms, ns, nr), freqs, weights) for ns, nr in pairs],
+                           n_jobs)
+
+    rtfs = np.zeros((freqs.size, maxSH, nRec, nSrc), dtype=complex)
+    for (ns, nr), result in zip(pairs, results):
+        rtfs[:, :result.shape[1], nr, ns] = result
+
+    return rtfs
+
+
+def _band_weights(band_centerfreqs, freqs):
+    """
+    Interpolation weights of the bands at the given frequencies, linear in logarithmic frequency.
+
+    Parameters
+    ----------
+    band_centerfreqs : ndarray
+        Center frequencies of the bands. Dimension = (nBands)
+    freqs : ndarray
+        Target frequencies, in Hz. Dimension = (nFreqs)
+
+    Returns
+    -------
+    weights : ndarray
+        Band weights. Dimension = (nFreqs, nBands)
+    """
+
+    nBands = band_centerfreqs.size
+    # Frequencies below the first band (including DC) take the first band gains
+    log_freqs = np.log(np.maximum(freqs, band_centerfreqs[0]))
+    log_centerfreqs = np.log(band_centerfreqs)
+    weights = np.empty((freqs.size, nBands))
+    for nb in range(nBands):
+        weights[:, nb] = np.interp(log_freqs, log_centerfreqs, np.eye(nBands)[nb])
+    return weights
+
+
+def _render_rtf_pair(echograms, freqs, weights):
+    """
+    Render the band echograms of a single source/receiver pair into transfer functions.
+
+    Parameters
+    ----------
+    echograms : ndarray, dtype = Echogram, or EchogramSet
+        Target echograms. Dimension = (nBands), or (1, 1, nBands) for an echogram set.
+    freqs : ndarray
+        Target frequencies, in Hz. Dimension = (nFreqs)
+    weights : ndarray
+        Band weights at each frequency. Dimension = (nFreqs, nBands)
+
+    Returns
+    -------
+    rtf : ndarray, dtype = complex
+        Transfer functions. Dimension = (nFreqs, nChannels)
+    """
+
+    reflections = _band_reflections(echograms)
+    if reflections is None:
+        # Bands without a common reflection list are evaluated one by one
+        echograms = _band_echograms(echograms)
+        return sum(_sum_reflections(echograms[nb].time, echograms[nb].value[:, :, np.newaxis], freqs, weights[:, nb:nb+1])
+                   for nb in range(echograms.shape[0]))
+
+    time, value = reflections
+    return _sum_reflections(time, value, freqs, weights)
+
+
+def _sum_reflections(time, value, freqs, weights):
+    """
+    Sum of the band-weighted reflections at the given frequencies.
+
+    Parameters
+    ----------
+    time : ndarray
+        Reflection times, in seconds. Dimension = (nRefl)
+    value : ndarray
+        Reflection values per band. Dimension = (nRefl, nChannels, nBands)
+    freqs : ndarray
+        Target frequencies, in Hz. Dimension = (nFreqs)
+    weights : ndarray
+        Band weights at each frequency. Dimension = (nFreqs, nBands)
+
+    Returns
+    -------
+    rtf : ndarray, dtype = complex
+        Transfer functions. Dimension = (nFreqs, nChannels)
+    """
+
+    nRefl, nChannels, nBands = value.shape
+    rtf_bands = np.zeros((freqs.size, nChannels * nBands), dtype=complex)
+
+    # Evaluate the reflections by chunks, to bound memory usage
+    chunk_size = max(1, _RTF_SIZE // max(1, freqs.size))
+    for i0 in range(0, nRefl, chunk_size):
+        i1 = min(i0 + chunk_size, nRefl)
+        phasors = np.exp(-2j * np.pi * np.outer(freqs, time[i0:i1]))
+        rtf_bands += phasors @ value[i0:i1].reshape((i1 - i0, nChannels * nBands))
+
+    # Interpolate the band gains across frequency
+    rtf_bands = rtf_bands.reshape((freqs.size, nChannels, nBands))
+    return np.einsum('fcb,fb->fc', rtf_bands, weights)
@@ -38,6 +38,7 @@ from masp.tests.convenience_test_methods import *
 from masp.utils import C
 from masp.validate_data_types import _validate_echogram
 import random
+import pytest
 
 
 def test_apply_absorption():
@@ -60,3 +61,75 @@ def test_apply_absorption():
                        *p,
                        write_file=True,
                        namespace='srs')
+
+
+def test_apply_absorption_set():
+    num_tests = 10
+    for t in range(num_tests):
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 4)
+        nBands = np.random.randint(1, 10)
+        echograms = generate_random_echogram_array(nSrc, nRec)
+        alpha = np.random.random((nBands, 2*C))
+        limits = random.choice([None, np.random.random(nBands) + 0.1])
+
+        echogram_set = masp.srs.EchogramSet.from_echograms(echograms)
+        abs_echogram_set = masp.srs.apply_absorption_set(echogram_set, alpha, limits)
+        assert abs_echogram_set.shape == (nSrc, nRec, nBands)
+        # Views and converted echograms must match the per-echogram absorption
+        abs_echograms = abs_echogram_set.to_echograms()
+        for ns in range(nSrc):
+            for nr in range(nRec):
+                ref = masp.srs.apply_absorption(echograms[ns, nr], alpha, limits)
+                for nb in range(nBands):
+                    for echogram in [abs_echograms[ns, nr, nb], abs_echogram_set[ns, nr, nb]]:
+                        _validate_echogram(echogram)
+                        assert np.allclose(ref[0, nb].time, echogram.time)
+                        assert np.allclose(ref[0, nb].value, echogram.value)
+                        assert np.allclose(ref[0, nb].order, echogram.order)
+                        assert np.allclose(ref[0, nb].coords, echogram.coords)
+
+        # Views only hold a reference to the set and their indices, and are read-only
+        view = abs_echogram_set[0, 0, 0]
+        assert not hasattr(view, '__dict__')
+        with pytest.raises(AttributeError):
+            view.value = np.zeros(1)
+
+
+def test_get_wall_hits():
+    # Orders along a single dimension: [x0, x1] hits
+    order = np.zeros((7, C), dtype=int)
+    order[:, 0] = [-3, -2, -1, 0, 1, 2, 3]
+    hits = masp.srs.get_wall_hits(order)
+    assert np.array_equal(hits[:, :2], [[1, 2], [1, 1], [0, 1], [0, 0], [1, 0], [1, 1], [2, 1]])
+    assert np.all(hits[:, 2:] == 0)
+
+    # Total number of hits per dimension is the absolute order
+    echogram = generate_random_echogram()
+    hits = masp.srs.get_wall_hits(echogram.order)
+    assert np.array_equal(hits[:, 0::2] + hits[:, 1::2], np.abs(echogram.order))
+
+
+def test_apply_absorption_sweep():
+    num_tests = 5
+    for t in range(num_tests):
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 4)
+        nBands = np.random.randint(1, 6)
+        K = np.random.randint(1, 5)
+        echograms = generate_random_echogram_array(nSrc, nRec)
+        alphas = np.random.random((K, nBands, 2*C))
+        limits = random.choice([None, np.random.random(nBands) + 0.1, np.random.random((K, nBands)) + 0.1])
+
+        abs_echogram_sets = masp.srs.apply_absorption_sweep(echograms, alphas, limits)
+        assert len(abs_echogram_sets) == K
+        # Each absorption set must match the per-echogram absorption
+        for k in range(K):
+            limits_k = None if limits is None else (limits if limits.ndim == 1 else limits[k])
+            abs_echograms = abs_echogram_sets[k].to_echograms()
+            for ns in range(nSrc):
+                for nr in range(nRec):
+                    ref = masp.srs.apply_absorption(echograms[ns, nr], alphas[k], limits_k)
+                    for nb in range(nBands):
+                        assert np.allclose(ref[0, nb].time, abs_echograms[ns, nr, nb].time)
+                        assert np.allclose(ref[0, nb].value, abs_echograms[ns, nr, nb].value)
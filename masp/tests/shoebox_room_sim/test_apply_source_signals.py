@@ -34,6 +34,7 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 from masp.tests.convenience_test_methods import *
+import pytest
 
 def test_apply_source_signals_array():
     num_tests = 10
@@ -101,3 +102,99 @@ def test_apply_source_signals_sh():
                        *p,
                        nargout=1,
                        namespace='srs')
+
+def test_apply_source_signals_mixing():
+    num_tests = 5
+    for t in range(num_tests):
+        L_sig = np.random.randint(1, 5000)
+        L_rir = np.random.randint(1, 1000)
+        nSrc = np.random.randint(1, 5)
+        nRec = np.random.randint(1, 5)
+        nSH = np.random.randint(1, 10)
+        src_sigs = np.random.rand(L_sig, nSrc) * 2 - 1
+        mic_rirs = np.random.rand(L_rir, nRec, nSrc) * 2 - 1
+        sh_rirs = np.random.rand(L_rir, nSH, nRec, nSrc) * 2 - 1
+        # Unused channels of lower order receivers
+        sh_rirs[:, np.random.randint(nSH):, 0, :] = 0
+        array_rirs = [np.random.rand(L_rir + np.random.randint(100), np.random.randint(1, 5), nSrc) * 2 - 1
+                      for nr in range(nRec)]
+
+        # Reference: time domain convolution of each source/receiver pair
+        def mix(rirs):
+            return np.stack([sum(np.convolve(rirs[:, nc, ns], src_sigs[:, ns]) for ns in range(nSrc))
+                             for nc in range(rirs.shape[1])], axis=1)
+
+        mic_sigs = masp.srs.apply_source_signals_mic(mic_rirs, src_sigs)
+        assert np.allclose(mic_sigs, mix(mic_rirs))
+        sh_sigs = masp.srs.apply_source_signals_sh(sh_rirs, src_sigs)
+        assert sh_sigs.shape == (L_sig + L_rir - 1, nSH, nRec)
+        for nr in range(nRec):
+            assert np.allclose(sh_sigs[:, :, nr], mix(sh_rirs[:, :, nr, :]))
+        array_sigs = masp.srs.apply_source_signals_array(array_rirs, src_sigs)
+        for nr in range(nRec):
+            assert np.allclose(array_sigs[nr], mix(array_rirs[nr]))
+
+def test_apply_source_signals_stems():
+    num_tests = 5
+    for t in range(num_tests):
+        L_sig = np.random.randint(1, 5000)
+        L_rir = np.random.randint(1, 1000)
+        nSrc = np.random.randint(1, 5)
+        nRec = np.random.randint(1, 5)
+        nSH = np.random.randint(1, 10)
+        src_sigs = np.random.rand(L_sig, nSrc) * 2 - 1
+        sh_rirs = np.random.rand(L_rir, nSH, nRec, nSrc) * 2 - 1
+        array_rirs = [np.random.rand(L_rir + np.random.randint(100), np.random.randint(1, 5), nSrc) * 2 - 1
+                      for nr in range(nRec)]
+
+        # Stems are the signals of each source alone, and sum up to the mixture
+        sh_sigs = masp.srs.apply_source_signals_sh(sh_rirs, src_sigs)
+        sh_sigs_2, src_sh_sigs = masp.srs.apply_source_signals_sh(sh_rirs, src_sigs, return_stems=True)
+        assert src_sh_sigs.shape == (L_sig + L_rir - 1, nSH, nRec, nSrc)
+        assert np.allclose(sh_sigs, sh_sigs_2)
+        assert np.allclose(np.sum(src_sh_sigs, axis=3), sh_sigs)
+        ns = np.random.randint(nSrc)
+        assert np.allclose(src_sh_sigs[:, :, :, ns],
+                           masp.srs.apply_source_signals_sh(sh_rirs[:, :, :, ns:ns+1], src_sigs[:, ns:ns+1]))
+
+        array_sigs = masp.srs.apply_source_signals_array(array_rirs, src_sigs)
+        array_sigs_2, src_array_sigs = masp.srs.apply_source_signals_array(array_rirs, src_sigs, return_stems=True)
+        for nr in range(nRec):
+            assert src_array_sigs[nr].shape == (L_sig + array_rirs[nr].shape[0] - 1, array_rirs[nr].shape[1], nSrc)
+            assert np.allclose(array_sigs[nr], array_sigs_2[nr])
+            assert np.allclose(np.sum(src_array_sigs[nr], axis=2), array_sigs[nr])
+
+def test_apply_source_signals_moving():
+    num_tests = 5
+    for t in range(num_tests):
+        block_size = 2 ** np.random.randint(2, 8)
+        L_rir = np.random.randint(1, 500)
+        nPos = np.random.randint(1, 10)
+        nRec = np.random.randint(1, 4)
+        L_sig = np.random.randint(1, block_size * nPos)
+        src_sig = np.random.rand(L_sig) * 2 - 1
+        mic_rirs = np.random.rand(L_rir, nRec, nPos) * 2 - 1
+        mic_sigs = masp.srs.apply_source_signals_moving(mic_rirs, src_sig, block_size)
+
+        # Reference: crossfade between the static renderings of consecutive positions
+        static_sigs = [masp.srs.apply_source_signals_mic(mic_rirs[:, :, k:k+1], src_sig[:, np.newaxis])
+                       for k in range(nPos)]
+        mic_sigs_ref = np.zeros(static_sigs[0].shape)
+        for n in range(mic_sigs_ref.shape[0]):
+            k = n // block_size
+            fade = (n % block_size) / block_size
+            y0 = static_sigs[min(k, nPos-1)][n]
+            y1 = static_sigs[min(k+1, nPos-1)][n]
+            mic_sigs_ref[n] = y0 + fade * (y1 - y0)
+        assert np.allclose(mic_sigs, mic_sigs_ref)
+
+        # Static source
+        sh_rirs = np.repeat(np.random.rand(L_rir, 4, nRec, 1), nPos, axis=3)
+        sh_sigs = masp.srs.apply_source_signals_moving(sh_rirs, src_sig, block_size)
+        assert np.allclose(sh_sigs, masp.srs.apply_source_signals_sh(sh_rirs[..., :1], src_sig[:, np.newaxis]))
+
+        # Invalid dimensions
+        with pytest.raises(ValueError):
+            masp.srs.apply_source_signals_moving(mic_rirs[:, :, 0], src_sig, block_size)
+        with pytest.raises(ValueError):
+            masp.srs.apply_source_signals_moving([mic_rirs, np.concatenate((mic_rirs, mic_rirs), axis=2)], src_sig, block_size)
@@ -36,6 +36,7 @@
 from masp.tests.convenience_test_methods import *
 from masp.utils import C
 import random
+import pytest
 
 def test_compute_echograms_array():
     num_tests = 3
@@ -117,3 +118,55 @@ def test_compute_echograms_sh():
                        *p,
                        write_file=True,
                        namespace='srs')
+
+
+def test_compute_echograms_parallel():
+    num_tests = 3
+    for t in range(num_tests):
+        nBands = np.random.randint(1, 4)
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 6)
+        room = np.random.random(C) * 5 + 5
+        src = np.random.random((nSrc, C)) * 5
+        rec = np.random.random((nRec, C)) * 5
+        abs_wall = np.random.random((nBands, 2*C))
+        limits = np.random.random(nBands) * 0.1 + 0.1
+
+        # Parallel computation must match the serial path bitwise
+        echograms = masp.srs.compute_echograms_sh(room, src, rec, abs_wall, limits, 2)
+        echograms_parallel = masp.srs.compute_echograms_sh(room, src, rec, abs_wall, limits, 2, n_jobs=2)
+        assert echograms_parallel.shape == (nSrc, nRec, nBands)
+        for idx in np.ndindex(echograms.shape):
+            assert np.array_equal(echograms[idx].time, echograms_parallel[idx].time)
+            # The SH gains from get_sh may differ in their last bit, even between two serial runs
+            assert np.allclose(echograms[idx].value, echograms_parallel[idx].value)
+            assert np.array_equal(echograms[idx].order, echograms_parallel[idx].order)
+            assert np.array_equal(echograms[idx].coords, echograms_parallel[idx].coords)
+
+
+def test_compute_echograms_trajectory():
+    num_tests = 3
+    for t in range(num_tests):
+        nBands = np.random.randint(1, 4)
+        nPos = np.random.randint(1, 6)
+        room = np.random.random(C) * 5 + 5
+        src = np.linspace(np.random.random(C) * 5, np.random.random(C) * 5, nPos)
+        rec = np.random.random((1, C)) * 5
+        abs_wall = np.random.random((nBands, 2*C))
+        limits = np.random.random(nBands) * 0.1 + 0.1
+        mic_specs = np.array([[1, 0, 0, np.random.rand()]])
+
+        # Trajectory computation must match the per-position path
+        echograms = masp.srs.compute_echograms_mic(room, src, rec, abs_wall, limits, mic_specs)
+        echograms_trajectory = masp.srs.compute_echograms_trajectory(room, src, rec, abs_wall, limits, mic_specs)
+        assert echograms_trajectory.shape == (nPos, 1, nBands)
+        for idx in np.ndindex(echograms.shape):
+            assert np.array_equal(echograms[idx].time, echograms_trajectory[idx].time)
+            assert np.allclose(echograms[idx].value, echograms_trajectory[idx].value)
+            assert np.array_equal(echograms[idx].order, echograms_trajectory[idx].order)
+            assert np.array_equal(echograms[idx].coords, echograms_trajectory[idx].coords)
+
+    # A single source and receiver position cannot be combined with a longer trajectory
+    with pytest.raises(ValueError):
+        masp.srs.compute_echograms_trajectory(room, np.random.random((3, C)) * 5, np.random.random((2, C)) * 5,
+                                              abs_wall, limits)
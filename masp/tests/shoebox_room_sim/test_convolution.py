@@ -0,0 +1,109 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Copyright (c) 2019, Eurecat / UPF
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#   @file   test_convolution.py
+#   @author Andrés Pérez-López
+#   @date   30/07/2019
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+import pytest
+from masp.tests.convenience_test_methods import *
+
+
+def test_streaming_convolver():
+    num_tests = 5
+    for t in range(num_tests):
+        L_sig = np.random.randint(1, 5000)
+        L_rir = np.random.randint(1, 1000)
+        block_size = 2 ** np.random.randint(2, 10)
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 4)
+        nSH = np.random.randint(1, 10)
+        src_sigs = np.random.rand(L_sig, nSrc) * 2 - 1
+        mic_rirs = np.random.rand(L_rir, nRec, nSrc) * 2 - 1
+        sh_rirs = np.random.rand(L_rir, nSH, nRec, nSrc) * 2 - 1
+        array_rirs = [np.random.rand(L_rir, np.random.randint(1, 5), nSrc) * 2 - 1 for nr in range(nRec)]
+
+        # Streamed output matches the offline convolution
+        convolver = masp.srs.StreamingConvolver(mic_rirs, block_size)
+        assert convolver.latency == block_size
+        mic_sigs = np.concatenate(list(convolver.stream(src_sigs)))
+        assert np.allclose(mic_sigs, masp.srs.apply_source_signals_mic(mic_rirs, src_sigs))
+
+        # Chunks of any length
+        convolver = masp.srs.StreamingConvolver(sh_rirs, block_size)
+        chunks = np.split(src_sigs, np.sort(np.random.randint(0, L_sig, 3)))
+        sh_sigs = np.concatenate(list(convolver.stream(iter(chunks))))
+        assert np.allclose(sh_sigs, masp.srs.apply_source_signals_sh(sh_rirs, src_sigs))
+
+        convolver = masp.srs.StreamingConvolver(array_rirs, block_size)
+        blocks = list(convolver.stream(src_sigs))
+        array_sigs = masp.srs.apply_source_signals_array(array_rirs, src_sigs)
+        for nr in range(nRec):
+            assert np.allclose(np.concatenate([b[nr] for b in blocks]), array_sigs[nr])
+
+        # Non-uniform partitions give the same output
+        tail_block_size = block_size * np.random.randint(1, 5)
+        convolver = masp.srs.StreamingConvolver(mic_rirs, block_size, tail_block_size)
+        assert convolver.latency == block_size
+        assert np.allclose(np.concatenate(list(convolver.stream(src_sigs))), mic_sigs)
+
+
+def test_streaming_convolver_process():
+    block_size = 64
+    nBlocks = 10
+    src_sigs = np.random.rand(block_size * nBlocks, 2)
+    mic_rirs = np.random.rand(300, 3, 2)
+    convolver = masp.srs.StreamingConvolver(mic_rirs, block_size)
+    mic_sigs = masp.srs.apply_source_signals_mic(mic_rirs, src_sigs)
+    for nb in range(nBlocks):
+        block = src_sigs[nb*block_size:(nb+1)*block_size]
+        assert np.allclose(convolver.process(block), mic_sigs[nb*block_size:(nb+1)*block_size])
+
+    # Reset clears the input history
+    convolver.reset()
+    assert np.allclose(convolver.process(src_sigs[:block_size]), mic_sigs[:block_size])
+
+    with pytest.raises(ValueError, match='must have dimension 0'):
+        convolver.process(src_sigs[:block_size-1])
+
+    # Updated RIRs must keep their dimensions
+    with pytest.raises(ValueError, match='same dimensions'):
+        convolver.update(mic_rirs[:200])
+
+    # Non-uniform partitions: updates with the same RIRs leave the output unchanged
+    convolver = masp.srs.StreamingConvolver(mic_rirs, block_size, 2 * block_size)
+    for nb in range(nBlocks):
+        convolver.update(mic_rirs)
+        block = src_sigs[nb*block_size:(nb+1)*block_size]
+        assert np.allclose(convolver.process(block), mic_sigs[nb*block_size:(nb+1)*block_size])
+
+    with pytest.raises(ValueError, match='multiple of block_size'):
+        masp.srs.StreamingConvolver(mic_rirs, block_size, block_size + 1)
@@ -36,7 +36,9 @@
 
 from masp.tests.convenience_test_methods import *
 import random
-from masp.utils import C
+import pytest
+from masp.utils import C, c
+from masp.shoebox_room_sim.image_source_method import _ims_lattice_N, _ims_lattice_T, _ims_lattice_T_chunks
 
 def test_ims_coreMtx():
     num_tests = 10
@@ -108,3 +110,147 @@ def test_ims_coreN():
                        *p,
                        nargout=1,
                        namespace='srs')
+
+
+def test_ims_coreMtx_batch():
+    num_tests = 10
+    for t in range(num_tests):
+        room = np.random.random(C) * 5 + 5
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 6)
+        sources = np.random.random((nSrc, C)) * 5
+        receivers = np.random.random((nRec, C)) * 5
+        type = random.choice(['maxOrder', 'maxTime'])
+        typeValue = np.random.randint(20) if type == 'maxOrder' else np.random.rand() * 0.1 + 0.1
+
+        echograms = masp.srs.ims_coreMtx_batch(room, sources, receivers, type, typeValue)
+        assert echograms.shape == (nSrc, nRec)
+        # Batched computation must match the per-pair path
+        for ns in range(nSrc):
+            for nr in range(nRec):
+                echogram = masp.srs.ims_coreMtx(room, sources[ns], receivers[nr], type, typeValue)
+                assert np.array_equal(echogram.time, echograms[ns, nr].time)
+                assert np.array_equal(echogram.value, echograms[ns, nr].value)
+                assert np.array_equal(echogram.order, echograms[ns, nr].order)
+                assert np.array_equal(echogram.coords, echograms[ns, nr].coords)
+
+
+def test_ims_cloud_echograms():
+    num_tests = 10
+    for t in range(num_tests):
+        room = np.random.random(C) * 5 + 5
+        source = np.random.random(C) * 5
+        nRec = np.random.randint(1, 6)
+        receivers = np.random.random((nRec, C)) * 5
+        type = random.choice(['maxOrder', 'maxTime'])
+        typeValue = np.random.randint(20) if type == 'maxOrder' else np.random.rand() * 0.1 + 0.1
+
+        cloud = masp.srs.ims_cloud(room, source, type, typeValue)
+        echograms = masp.srs.ims_cloud_echograms(cloud, receivers)
+        assert echograms.shape == (nRec,)
+        # Evaluating the shared cloud must match the per-pair path
+        for nr in range(nRec):
+            echogram = masp.srs.ims_coreMtx(room, source, receivers[nr], type, typeValue)
+            assert np.array_equal(echogram.time, echograms[nr].time)
+            assert np.array_equal(echogram.value, echograms[nr].value)
+            assert np.array_equal(echogram.order, echograms[nr].order)
+            assert np.array_equal(echogram.coords, echograms[nr].coords)
+
+
+def test_ims_trajectory():
+    num_tests = 10
+    for t in range(num_tests):
+        room = np.random.random(C) * 5 + 5
+        nPos = np.random.randint(1, 6)
+        # Straight source trajectory, with a static or moving receiver
+        sources = np.linspace(np.random.random(C) * 5, np.random.random(C) * 5, nPos)
+        receivers = np.random.random((random.choice([1, nPos]), C)) * 5
+        type = random.choice(['maxOrder', 'maxTime'])
+        typeValue = np.random.randint(20) if type == 'maxOrder' else np.random.rand() * 0.1 + 0.1
+
+        echograms = masp.srs.ims_trajectory(room, sources, receivers, type, typeValue)
+        assert echograms.shape == (nPos,)
+        # Incremental updates must match the per-position path
+        for n in range(nPos):
+            echogram = masp.srs.ims_coreMtx(room, sources[n], receivers[min(n, receivers.shape[0]-1)],
+                                            type, typeValue)
+            assert np.array_equal(echogram.time, echograms[n].time)
+            assert np.array_equal(echogram.value, echograms[n].value)
+            assert np.array_equal(echogram.order, echograms[n].order)
+            assert np.array_equal(echogram.coords, echograms[n].coords)
+
+    # Equal propagation times keep the lattice order
+    room = np.array([6., 4., 3.])
+    sources = np.array([[3., 2., 1.5], [3., 2.5, 1.5]])
+    receivers = np.array([[1., 1., 1.5]])
+    echograms = masp.srs.ims_trajectory(room, sources, receivers, 'maxOrder', 4)
+    for n in range(sources.shape[0]):
+        echogram = masp.srs.ims_coreMtx(room, sources[n], receivers[0], 'maxOrder', 4)
+        assert np.array_equal(echogram.order, echograms[n].order)
+
+
+def _cube_lattice(Nx, Ny, Nz):
+    """
+    Reference i, j, k indices of the full (2Nx+1)(2Ny+1)(2Nz+1) lattice, with x fastest and z slowest.
+    """
+    k, j, i = np.meshgrid(np.arange(-Nz, Nz+1), np.arange(-Ny, Ny+1), np.arange(-Nx, Nx+1), indexing='ij')
+    return i.flatten(), j.flatten(), k.flatten()
+
+
+def _distances(room, src, rec, i, j, k):
+    s_x = i*room[0] + np.power(-1.,i)*src[0] - rec[0]
+    s_y = j*room[1] + np.power(-1.,j)*src[1] - rec[1]
+    s_z = k*room[2] + np.power(-1.,k)*src[2] - rec[2]
+    return np.sqrt(np.power(s_x,2) + np.power(s_y,2) + np.power(s_z,2))
+
+
+def test_ims_lattice_T():
+    num_tests = 10
+    for t in range(num_tests):
+        room = np.random.random(C) * 5 + 2
+        d_max = (np.random.rand() * 0.1 + 0.02) * c
+        N = np.ceil(d_max / room)
+        i_cube, j_cube, k_cube = _cube_lattice(*N)
+        i, j, k = _ims_lattice_T(room, d_max)
+
+        # The lattice is a subset of the cube, in the same order
+        cube_idx = ((k + N[2]) * (2*N[1]+1) + (j + N[1])) * (2*N[0]+1) + (i + N[0])
+        assert np.all(np.diff(cube_idx) > 0)
+        for n, ref in zip((i, j, k), (i_cube, j_cube, k_cube)):
+            assert np.array_equal(n, ref[cube_idx.astype(int)])
+
+        # Any source and receiver inside the room keep the same image sources as the cube
+        for n in range(5):
+            src = (np.random.random(C) - 0.5) * room
+            rec = (np.random.random(C) - 0.5) * room
+            d_cube = _distances(room, src, rec, i_cube, j_cube, k_cube)
+            d = _distances(room, src, rec, i, j, k)
+            valid_cube = d_cube < d_max
+            assert np.array_equal(i[d < d_max], i_cube[valid_cube])
+            assert np.array_equal(j[d < d_max], j_cube[valid_cube])
+            assert np.array_equal(k[d < d_max], k_cube[valid_cube])
+
+        # Chunks hold at most chunk_size indices, or a single row, and concatenate into the lattice
+        chunk_size = np.random.randint(1, 100)
+        chunks = list(_ims_lattice_T_chunks(room, d_max, chunk_size))
+        for i_c, j_c, k_c in chunks:
+            assert i_c.size <= chunk_size or (np.all(j_c == j_c[0]) and np.all(k_c == k_c[0]))
+        for n, ref in enumerate((i, j, k)):
+            assert np.array_equal(np.concatenate([chunk[n] for chunk in chunks]), ref)
+
+
+def test_ims_lattice_N():
+    for N in [0, 1, 2, 5, 12]:
+        # Reference: full cube, masked by the total reflection order
+        i_cube, j_cube, k_cube = _cube_lattice(N, N, N)
+        valid = np.abs(i_cube) + np.abs(j_cube) + np.abs(k_cube) <= N
+        lattice = _ims_lattice_N(N)
+        for n, ref in enumerate((i_cube, j_cube, k_cube)):
+            assert np.array_equal(lattice[n], ref[valid])
+
+        # Cached and read-only
+        assert _ims_lattice_N(N) is lattice
+        for n in lattice:
+            assert not n.flags.writeable
+            with pytest.raises(ValueError):
+                n[0] = 0
@@ -54,6 +54,22 @@ def test_get_echo2gridMap():
                        nargout=1,
                        namespace='srs')
 
+def test_get_echo2gridMap_nearest():
+    num_tests = 10
+    for t in range(num_tests):
+        echogram = generate_random_echogram()
+        grid_dirs_rad = np.random.random((np.random.randint(10, 100), C-1))*[2*np.pi, np.pi] - [0, np.pi/2]
+        echo2gridMap = masp.srs.get_echo2gridMap(echogram, grid_dirs_rad)
+        # Reference: closest grid point to each reflection, one by one
+        grid_xyz = masp.utils.sph2cart(np.column_stack((grid_dirs_rad, np.ones(grid_dirs_rad.shape[0]))))
+        refl_xyz = echogram.coords / np.linalg.norm(echogram.coords, axis=1)[:, np.newaxis]
+        dist = np.sum(np.power(refl_xyz[:, np.newaxis, :] - grid_xyz, 2), axis=2)
+        assert echo2gridMap.shape == (echogram.time.size,)
+        assert np.allclose(dist[np.arange(echo2gridMap.size), echo2gridMap], np.min(dist, axis=1))
+        # Cached grid gives the same mapping
+        assert np.array_equal(masp.srs.get_echo2gridMap(echogram, grid_dirs_rad.copy()), echo2gridMap)
+
+
 def test_quantise_echogram():
     num_tests = 10
     echograms = [generate_random_echogram() for i in range(num_tests)]
@@ -72,3 +88,26 @@ def test_quantise_echogram():
                        *p,
                        write_file=True,
                        namespace='srs')
+
+
+def test_quantise_echogram_set():
+    num_tests = 10
+    for t in range(num_tests):
+        echogram = generate_random_echogram()
+        nGrid = np.random.randint(1, 10)
+        echo2gridMap = np.random.randint(0, 12, echogram.time.size + np.random.randint(-5, 5))
+        q_echogram_set = masp.srs.quantise_echogram_set(echogram, nGrid, echo2gridMap)
+        assert q_echogram_set.offsets.size == nGrid + 1
+        # Reference: reflections of each grid point, one by one
+        nRefl = min(echo2gridMap.size, echogram.time.size)
+        for n in range(nGrid):
+            refl = slice(q_echogram_set.offsets[n], q_echogram_set.offsets[n+1])
+            assert np.array_equal(q_echogram_set.time[refl], echogram.time[:nRefl][echo2gridMap[:nRefl] == n])
+            assert np.array_equal(q_echogram_set.value[refl], echogram.value[:nRefl][echo2gridMap[:nRefl] == n])
+            assert q_echogram_set.isActive[n] == np.any(echo2gridMap[:nRefl] == n)
+        # Same content as the QuantisedEchogram ndarray
+        q_echograms = masp.srs.quantise_echogram(echogram, nGrid, echo2gridMap)
+        for n, q_echogram in enumerate(q_echogram_set.to_quantised_echograms()):
+            assert np.array_equal(q_echogram.time, q_echograms[n].time)
+            assert np.array_equal(q_echogram.value, q_echograms[n].value)
+            assert q_echogram.isActive == q_echograms[n].isActive
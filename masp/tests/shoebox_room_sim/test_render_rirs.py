@@ -33,8 +33,11 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 from masp.shoebox_room_sim import quantise_echogram
+from masp.shoebox_room_sim.render_rirs import _get_array_irs_f
 from masp.tests.convenience_test_methods import *
 import random
+import pytest
+import scipy.signal
 
 def test_render_rirs_array():
     num_tests = 5
@@ -78,6 +81,38 @@ def test_render_rirs_array():
                        namespace='srs')
 
 
+
+def test_render_rirs_array_mixing():
+    num_tests = 3
+    for t in range(num_tests):
+        echograms = generate_random_echogram_array(1, 1, 1)
+        fs = np.random.randint(8000, 16000)
+        nGrid = np.random.randint(1, 20)
+        nMics = np.random.randint(1, 5)
+        L_resp = np.random.randint(1, 300)
+        grid = np.random.rand(nGrid, C-1) * [2*np.pi, np.pi] - [0, np.pi/2]
+        array_ir = np.random.rand(L_resp, nMics, nGrid)
+        rir = masp.srs.render_rirs_array(echograms, np.asarray([1000.]), fs, [grid], [array_ir])[0][:, :, 0]
+
+        # Reference: time domain convolution of each rendered grid direction
+        endtime = echograms[0, 0, 0].time[-1]
+        echo2gridMap = masp.srs.get_echo2gridMap(echograms[0, 0, 0], grid)
+        q_echogram_set = masp.srs.quantise_echogram_set(echograms[0, 0, 0], nGrid, echo2gridMap)
+        qIR, _ = masp.srs.render_quantised(q_echogram_set, endtime, fs, True)
+        rir_ref = np.zeros((qIR.shape[0] + L_resp - 1, nMics))
+        for nm in range(nMics):
+            for ng in range(nGrid):
+                if np.sum(np.power(qIR[:, ng], 2)) > 10e-12:
+                    rir_ref[:, nm] += np.convolve(qIR[:, ng], array_ir[:, nm, ng])
+        assert rir.shape == rir_ref.shape
+        assert np.allclose(rir, rir_ref, rtol=0, atol=1e-12 * np.max(np.abs(rir_ref)))
+
+        # Array IR spectra are cached across calls
+        hits = _get_array_irs_f.cache_info().hits
+        rir_2 = masp.srs.render_rirs_array(echograms, np.asarray([1000.]), fs, [grid], [array_ir])[0][:, :, 0]
+        assert _get_array_irs_f.cache_info().hits == hits + 1
+        assert np.array_equal(rir, rir_2)
+
 def test_render_rirs_mic():
     num_tests = 5
     nSrc = [np.random.randint(1, 5) for i in range(num_tests)]
@@ -104,6 +139,21 @@ def test_render_rirs_mic():
                        namespace='srs')
 
 
+def test_render_rirs_mic_parallel():
+    num_tests = 3
+    for t in range(num_tests):
+        nSrc = np.random.randint(1, 4)
+        nRec = np.random.randint(1, 4)
+        nBands = np.random.randint(1, 4)
+        band_centerfreqs = np.random.randint(30, 100) * 2.**np.arange(nBands)
+        fs = int(band_centerfreqs[-1] * 2.1)
+        echograms = generate_random_echogram_array(nSrc, nRec, nBands)
+
+        # Parallel rendering must match the serial path
+        rirs = masp.srs.render_rirs_mic(echograms, band_centerfreqs, fs)
+        rirs_parallel = masp.srs.render_rirs_mic(echograms, band_centerfreqs, fs, n_jobs=2)
+        assert np.array_equal(rirs, rirs_parallel)
+
 def test_render_rirs_sh():
     num_tests = 5
     nSrc = [np.random.randint(1, 5) for i in range(num_tests)]
@@ -130,6 +180,60 @@ def test_render_rirs_sh():
                        namespace='srs')
 
 
+def test_render_rirs_sh_multirate():
+    num_tests = 3
+    for t in range(num_tests):
+        nBands = np.random.randint(2, 6)
+        band_centerfreqs = 125. * 2**np.arange(nBands)
+        fs = 16000
+        room = np.random.random(C) * 5 + 5
+        src = np.random.random((1, C)) * 5
+        rec = np.random.random((1, C)) * 5
+        abs_wall = np.random.random((nBands, 2*C)) * 0.5 + 0.2
+        limits = np.random.random(nBands) * 0.1 + 0.1
+        echograms = masp.srs.compute_echograms_sh(room, src, rec, abs_wall, limits, 1)
+
+        # Multirate rendering must approximate the full rate rendering
+        rirs = masp.srs.render_rirs_sh(echograms, band_centerfreqs, fs)
+        rirs_multirate = masp.srs.render_rirs_sh(echograms, band_centerfreqs, fs, multirate=True)
+        assert rirs_multirate.shape == rirs.shape
+        assert np.linalg.norm(rirs_multirate - rirs) < 1e-2 * np.linalg.norm(rirs)
+
+
+
+def test_render_rirs_set():
+    num_tests = 3
+    for t in range(num_tests):
+        nBands = np.random.randint(1, 5)
+        band_centerfreqs = 125. * 2**np.arange(nBands)
+        fs = 16000
+        nSrc = np.random.randint(1, 3)
+        nRec = np.random.randint(1, 3)
+        room = np.random.random(C) * 5 + 5
+        src = np.random.random((nSrc, C)) * 5
+        rec = np.random.random((nRec, C)) * 5
+        abs_wall = np.random.random((nBands, 2*C)) * 0.5 + 0.2
+        limits = np.random.random(nBands) * 0.1 + 0.1
+        echogram_set = masp.srs.compute_echograms_sh(room, src, rec, abs_wall, limits, 1, as_set=True)
+        echograms = echogram_set.to_echograms()
+
+        # Rendering from the set arrays must match the rendering of the converted echograms
+        for render in [masp.srs.render_rirs_mic, masp.srs.render_rirs_sh]:
+            assert np.array_equal(render(echogram_set, band_centerfreqs, fs), render(echograms, band_centerfreqs, fs))
+        rirs_set = masp.srs.render_rirs_sh(echogram_set, band_centerfreqs, fs, multirate=True)
+        assert np.array_equal(rirs_set, masp.srs.render_rirs_sh(echograms, band_centerfreqs, fs, multirate=True))
+        freqs = np.linspace(10., 4000., 20)
+        assert np.array_equal(masp.srs.render_rtfs_sh(echogram_set, band_centerfreqs, freqs),
+                              masp.srs.render_rtfs_sh(echograms, band_centerfreqs, freqs))
+
+        # Pair sets share the arrays of the scene set
+        pair_set = echogram_set.pair(nSrc-1, nRec-1)
+        assert pair_set.shape == (1, 1, nBands)
+        assert np.shares_memory(pair_set.time, echogram_set.time)
+        for fractional in [True, False]:
+            assert np.array_equal(masp.srs.render_rirs_bands(pair_set, 0.2, fs, fractional),
+                                  masp.srs.render_rirs_bands(echograms[nSrc-1, nRec-1], 0.2, fs, fractional))
+
 def test_render_rirs():
     num_tests = 5
     params = {
@@ -150,6 +254,85 @@ def test_render_rirs():
                        nargout=1,
                        namespace='srs')
 
+def test_render_rirs_fractional():
+    num_tests = 5
+    fractions = np.linspace(0, 1, 101)
+    H_frac = masp.utils.lagrange(100, 50 + fractions)
+    for t in range(num_tests):
+        echogram = generate_random_echogram()
+        endtime = np.random.rand() * 0.2 + 0.01
+        fs = np.random.randint(48000) + 100
+        ir = masp.srs.render_rirs(echogram, endtime, fs, True)
+
+        # Reference: accumulate the filter of each reflection one by one
+        L_ir = int(np.ceil(endtime * fs))
+        ir_ref = np.zeros((L_ir + 100, echogram.value.shape[1]))
+        for i in range(echogram.time[echogram.time < endtime].size):
+            refl_idx = int(np.floor(echogram.time[i] * fs) + 1)
+            filter_idx = np.argmin(np.abs(np.remainder(echogram.time[i] * fs, 1) - fractions))
+            ir_ref[refl_idx-1:refl_idx+100, :] += H_frac[:, filter_idx, np.newaxis] * echogram.value[i]
+        assert np.allclose(ir, ir_ref[50:-50], rtol=1e-12, atol=1e-15)
+
+
+def test_render_rirs_kernels():
+    num_tests = 5
+    for t in range(num_tests):
+        fs = np.random.randint(8000, 48000)
+        time = np.random.rand(1) * 0.05 + 0.01
+        value = np.random.rand(1, 1) + 0.5
+        echogram = masp.srs.Echogram(value=value, time=time, order=np.zeros((1, C), dtype=int), coords=np.zeros((1, C)))
+        for kernel in ['lagrange', 'sinc', 'nearest']:
+            kernel_order = np.random.randint(1, 64)
+            ir = masp.srs.render_rirs(echogram, 0.1, fs, True, kernel, kernel_order)
+            assert ir.shape == (int(np.ceil(0.1 * fs)), 1)
+            # Reflection energy is concentrated around its (fractional) sample position
+            assert abs(np.argmax(np.abs(ir)) - time[0] * fs) <= 1
+            assert np.isclose(np.sum(ir), value[0, 0])
+
+    with pytest.raises(ValueError, match='kernel must be one of the following'):
+        masp.srs.render_rirs(echogram, 0.1, fs, True, 'linear')
+
+
+def test_render_rirs_transition():
+    num_tests = 5
+    for t in range(num_tests):
+        echogram = generate_random_echogram()
+        endtime = echogram.time[-1] + 0.01
+        fs = np.random.randint(8000, 48000)
+        transition_time = np.random.rand() * echogram.time[-1]
+        ir = masp.srs.render_rirs(echogram, endtime, fs)
+        ir_tiered = masp.srs.render_rirs(echogram, endtime, fs, transition_time=transition_time)
+        assert ir_tiered.shape == ir.shape
+        # Early part is unchanged, up to the half-length of the main kernel
+        L_early = max(0, int(np.floor(transition_time * fs)) - 50)
+        assert np.allclose(ir[:L_early], ir_tiered[:L_early], rtol=1e-12, atol=1e-15)
+        # Late reflections keep their amplitude
+        assert np.isclose(np.sum(ir), np.sum(ir_tiered))
+
+
+
+def test_render_rirs_bands():
+    num_tests = 5
+    for t in range(num_tests):
+        echogram = generate_random_echogram_sh(np.random.randint(1, 5))
+        nBands = np.random.randint(1, 6)
+        # Band echograms share their first reflections, with different gains and lengths
+        lengths = np.sort(np.random.randint(1, echogram.time.size + 1, nBands))
+        echograms = np.empty(nBands, dtype=masp.srs.Echogram)
+        for nb in range(nBands):
+            echograms[nb] = masp.srs.Echogram(value=echogram.value[:lengths[nb]] * np.random.rand(),
+                                              time=echogram.time[:lengths[nb]],
+                                              order=echogram.order[:lengths[nb]],
+                                              coords=echogram.coords[:lengths[nb]])
+        endtime = np.random.rand() * 0.2 + 0.01
+        fs = np.random.randint(8000, 48000)
+        transition_time = random.choice([None, np.random.rand() * endtime])
+        ir = masp.srs.render_rirs_bands(echograms, endtime, fs, transition_time=transition_time)
+        assert ir.shape == (int(np.ceil(endtime * fs)), echogram.value.shape[1], nBands)
+        for nb in range(nBands):
+            ir_ref = masp.srs.render_rirs(echograms[nb], endtime, fs, transition_time=transition_time)
+            assert np.allclose(ir[:, :, nb], ir_ref, rtol=1e-12, atol=1e-15)
+
 def test_render_quantised():
     num_tests = 10
     echograms = [generate_random_echogram() for i in range(num_tests)]
@@ -175,6 +358,35 @@ def test_render_quantised():
                        namespace='srs')
 
 
+
+def test_render_quantised_set():
+    num_tests = 10
+    for t in range(num_tests):
+        echogram = generate_random_echogram()
+        nGrid = np.random.randint(1, 10)
+        echo2gridMap = np.random.randint(0, 12, echogram.time.size)
+        endtime = np.random.rand() * 0.2 + 0.01
+        fs = np.random.randint(8000, 48000)
+        fractional = random.choice([True, False])
+        transition_time = random.choice([None, np.random.rand() * endtime])
+        q_echogram_set = masp.srs.quantise_echogram_set(echogram, nGrid, echo2gridMap)
+        qIR, idx_nonzero = masp.srs.render_quantised(q_echogram_set, endtime, fs, fractional,
+                                                     transition_time=transition_time)
+        assert qIR.shape == (int(np.ceil(endtime * fs)), nGrid)
+        assert np.array_equal(idx_nonzero, np.flatnonzero(q_echogram_set.isActive))
+        # Reference: render each direction separately
+        for n in range(nGrid):
+            refl = echo2gridMap == n
+            tempgram = masp.srs.Echogram(value=echogram.value[refl], time=echogram.time[refl],
+                                         order=echogram.order[refl], coords=echogram.coords[refl])
+            ir_ref = masp.srs.render_rirs(tempgram, endtime, fs, fractional, transition_time=transition_time)
+            assert np.allclose(qIR[:, n], ir_ref[:, 0], rtol=1e-12, atol=1e-15)
+        # QuantisedEchogram ndarray gives the same result
+        qIR2, idx_nonzero2 = masp.srs.render_quantised(q_echogram_set.to_quantised_echograms(), endtime, fs, fractional,
+                                                       transition_time=transition_time)
+        assert np.array_equal(qIR, qIR2)
+        assert np.array_equal(idx_nonzero, idx_nonzero2)
+
 def test_filter_rirs():
     num_tests = 5
     nBands = [np.random.randint(1, 10) for i in range(num_tests)]
@@ -197,3 +409,49 @@ def test_filter_rirs():
                        *p,
                        nargout=1,
                        namespace='srs')
+
+
+def _reference_filter_rirs(rir, f_center, fs, order=1000):
+    """
+    Reference filterbank: one `firwin` filter per band, convolved with `fftconvolve` and summed.
+    """
+    nBands = rir.shape[1]
+    if nBands == 1:
+        return rir[:, 0]
+    nyq = fs / 2.
+    rir_full = np.zeros(rir.shape[0] + order)
+    for nb in range(nBands):
+        fl = 30. if nb == 0 else np.sqrt(f_center[nb] * f_center[nb - 1])
+        if nb == nBands - 1:
+            h = scipy.signal.firwin(order + 1, fl / nyq, pass_zero='highpass')
+        else:
+            fh = np.sqrt(f_center[nb] * f_center[nb + 1])
+            h = scipy.signal.firwin(order + 1, [fl / nyq, fh / nyq], pass_zero='bandpass')
+        rir_full += scipy.signal.fftconvolve(h, rir[:, nb])[:rir_full.size]
+    return rir_full
+
+
+def test_filter_rirs_batch():
+    num_tests = 5
+    for t in range(num_tests):
+        nBands = np.random.randint(1, 6)
+        nChannels = np.random.randint(1, 10)
+        band_centerfreqs = np.random.randint(30, 100) * 2.**np.arange(nBands)
+        fs = int(band_centerfreqs[-1] * 2.1)
+        L = np.random.randint(1, 2000)
+        rir = np.random.random((L, nChannels, nBands))
+
+        rir_full = masp.srs.filter_rirs_batch(rir, band_centerfreqs, fs)
+        L_fbank = 1000 if nBands > 1 else 0
+        assert rir_full.shape == (L + L_fbank, nChannels)
+        # Batched filtering must match the per-channel and per-band filtering
+        for nc in range(nChannels):
+            assert np.allclose(rir_full[:, nc], _reference_filter_rirs(rir[:, nc, :], band_centerfreqs, fs))
+
+        if nBands > 1:
+            # Filterbank is cached and read-only
+            filters = masp.srs.get_filterbank(band_centerfreqs, fs)
+            assert filters.shape == (1001, nBands)
+            assert masp.srs.get_filterbank(band_centerfreqs, fs) is filters
+            with pytest.raises(ValueError):
+                filters[0, 0] = 0
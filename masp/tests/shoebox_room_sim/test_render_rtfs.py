@@ -0,0 +1,76 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+# Copyright (c) 2019, Eurecat / UPF
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * Neither the name of the <organization> nor the
+#       names of its contributors may be used to endorse or promote products
+#       derived from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL <COPYRIGHT HOLDER> BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE OF THIS
+# SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#   @file   test_render_rtfs.py
+#   @author Andrés Pérez-López
+#   @date   30/07/2019
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+
+from masp.tests.convenience_test_methods import *
+
+
+def test_render_rtfs_mic():
+    num_tests = 3
+    for t in range(num_tests):
+        nSrc = np.random.randint(1, 3)
+        nRec = np.random.randint(1, 3)
+        fs = 16000
+        echograms = generate_random_echogram_array(nSrc, nRec, 1)
+        rirs = masp.srs.render_rirs_mic(echograms, np.asarray([1000.]), fs)
+        freqs = np.fft.rfftfreq(rirs.shape[0], 1. / fs)
+
+        rtfs = masp.srs.render_rtfs_mic(echograms, np.asarray([1000.]), freqs)
+        assert rtfs.shape == (freqs.size, nRec, nSrc)
+        # Transfer functions must match the spectrum of the rendered IRs, below the fractional delay filter rolloff
+        rtfs_rirs = np.fft.rfft(rirs, axis=0)
+        band = freqs < 0.7 * fs / 2
+        assert np.max(np.abs(rtfs[band] - rtfs_rirs[band])) < 1e-2 * np.max(np.abs(rtfs_rirs[band]))
+
+
+def test_render_rtfs_sh():
+    num_tests = 3
+    for t in range(num_tests):
+        nBands = np.random.randint(1, 5)
+        band_centerfreqs = 125. * 2**np.arange(nBands)
+        room = np.random.random(C) * 5 + 5
+        src = np.random.random((1, C)) * 5
+        rec = np.random.random((2, C)) * 5
+        abs_wall = np.random.random((nBands, 2*C)) * 0.5 + 0.2
+        limits = np.random.random(nBands) * 0.1 + 0.1
+        echograms = masp.srs.compute_echograms_sh(room, src, rec, abs_wall, limits, np.asarray([1, 2]))
+
+        rtfs = masp.srs.render_rtfs_sh(echograms, band_centerfreqs, band_centerfreqs)
+        assert rtfs.shape == (nBands, 9, 2, 1)
+        assert np.all(rtfs[:, 4:, 0, 0] == 0)
+        # At the center frequencies, each band is rendered on its own
+        for nb in range(nBands):
+            rtfs_band = masp.srs.render_rtfs_sh(echograms[:, :, nb:nb+1], band_centerfreqs[nb:nb+1],
+                                                band_centerfreqs[nb:nb+1])
+            assert np.allclose(rtfs[nb], rtfs_band[0])
@@ -244,6 +244,46 @@ def test_lagrange():
                        nargout=1)
 
 
+def test_lagrange_polynomial():
+    # Order-N interpolation is exact for polynomials up to degree N
+    num_tests = 10
+    for t in range(num_tests):
+        N = np.random.randint(1, 11)
+        delays = N // 2 + np.random.rand(np.random.randint(1, 11))
+        h = masp.lagrange(N, delays)
+        assert h.shape == (N+1, delays.size)
+        coefs = np.random.rand(N+1) * 2 - 1
+        assert np.allclose(np.polyval(coefs, np.arange(N+1)) @ h, np.polyval(coefs, delays))
+
+
+def test_lagrange_table():
+    num_tests = 5
+    for t in range(num_tests):
+        N = 2 * np.random.randint(1, 51)
+        resolution = np.random.randint(1, 201)
+        fractions, h = masp.lagrange_table(N, resolution)
+        assert np.array_equal(fractions, np.linspace(0, 1, resolution+1))
+        assert np.array_equal(h, masp.lagrange(N, N//2 + fractions))
+        # Cached and read-only
+        assert masp.lagrange_table(N, resolution)[1] is h
+        with pytest.raises(ValueError):
+            h[0, 0] = 0
+
+
+def test_sinc_table():
+    num_tests = 5
+    for t in range(num_tests):
+        N = np.random.randint(1, 101)
+        resolution = np.random.randint(1, 201)
+        fractions, h = masp.sinc_table(N, resolution)
+        assert h.shape == (N+1, resolution+1)
+        assert np.allclose(np.sum(h, axis=0), 1)
+        # Cached and read-only
+        assert masp.sinc_table(N, resolution)[1] is h
+        with pytest.raises(ValueError):
+            h[0, 0] = 0
+
+
 def test_isLambda():
 
     wrong_values = [1, '1', True, 2.3, 1e4, 3j, [1], None, np.nan, np.inf, np.asarray([0.5])]
@@ -36,7 +36,7 @@
 import pytest
 import numpy as np
 
-from masp import Echogram, QuantisedEchogram, C
+from masp import Echogram, QuantisedEchogram, QuantisedEchogramSet, ImageSourceCloud, EchogramSet, C
 from masp.validate_data_types import _validate_boolean
 from masp.validate_data_types import _validate_int
 from masp.validate_data_types import _validate_float
@@ -52,6 +52,10 @@ from masp.validate_data_types import _validate_echogram
 from masp.validate_data_types import _validate_quantised_echogram
 from masp.validate_data_types import _validate_echogram_array
 from masp.validate_data_types import _validate_quantised_echogram_array
+from masp.validate_data_types import _validate_quantised_echogram_set
+from masp.validate_data_types import _validate_image_source_cloud
+from masp.validate_data_types import _validate_echogram_set
+from masp.validate_data_types import _validate_n_jobs
 
 
 def test_validate_boolean():
@@ -412,6 +416,25 @@ def test_validate_string():
             _validate_string('vw', wv, choices=choices)
 
 
+def test_validate_n_jobs():
+
+    # TypeError: not an int
+    wrong_values = ['1', 3.14, True, 3j, np.asarray([2]), np.nan, np.inf]
+    for wv in wrong_values:
+        with pytest.raises(TypeError, match='must be an instance of int'):
+            _validate_n_jobs('vw', wv)
+
+    # ValueError: not a valid number of jobs
+    wrong_values = [0, -2, -10]
+    for wv in wrong_values:
+        with pytest.raises(ValueError, match='must be None, -1 or a positive integer'):
+            _validate_n_jobs('vw', wv)
+
+    # Valid values
+    for v in [None, -1, 1, 4]:
+        _validate_n_jobs('vw', v)
+
+
 def test_validate_echogram():
 
     # TypeError: not an Echogram
@@ -449,6 +472,28 @@ def test_validate_quantised_echogram():
         _validate_quantised_echogram(wv)
 
 
+
+def test_validate_quantised_echogram_set():
+
+    # TypeError: not a QuantisedEchogramSet
+    wrong_values = ['1', 1, 3.14, True, 3j, np.asarray([2.3]), None, np.nan, np.inf, QuantisedEchogram(None, None, None)]
+    for wv in wrong_values:
+        with pytest.raises(TypeError, match='qechogram_set must be an instance of QuantisedEchogramSet'):
+            _validate_quantised_echogram_set(wv)
+
+    # ValueError: shape mismatch
+    l = 100
+    value = np.ones((l, 1))
+    time = np.ones((l))
+    wrong_offsets = [np.asarray([0, l+1]), np.asarray([0, l, 10, l])]
+    for wo in wrong_offsets:
+        with pytest.raises(ValueError, match='quantised echogram set shape mismatch'):
+            _validate_quantised_echogram_set(QuantisedEchogramSet(value, time, wo))
+
+    # ValueError: wrong size
+    with pytest.raises(ValueError, match='must have size'):
+        _validate_quantised_echogram_set(QuantisedEchogramSet(value, time, np.asarray([0, 50, l])), size=3)
+
 def test_validate_echogram_array():
 
     # TypeError: not a ndarray
@@ -535,3 +580,44 @@ def test_validate_quantised_echogram_array():
         e = QuantisedEchogram(value, time, isActive)
         wv = np.asarray([e, e])
         _validate_quantised_echogram_array(wv)
+
+
+def test_validate_image_source_cloud():
+
+    # TypeError: not an ImageSourceCloud
+    wrong_values = ['1', 1, 3.14, True, 3j, np.asarray([2.3]), None, np.nan, np.inf, Echogram(None, None, None, None)]
+    for wv in wrong_values:
+        with pytest.raises(TypeError, match='cloud must be an instance of ImageSourceCloud'):
+            _validate_image_source_cloud(wv)
+
+    # ValueError: shape mismatch
+    with pytest.raises(ValueError, match='image source cloud shape mismatch'):
+        l = 100
+        room = np.ones(C)
+        order = np.ones((l, C), dtype='int')
+        coords = np.ones((l+1, C))
+        wv = ImageSourceCloud(room, order, coords, None)
+        _validate_image_source_cloud(wv)
+
+
+def test_validate_echogram_set():
+
+    # TypeError: not an EchogramSet
+    wrong_values = ['1', 1, 3.14, True, 3j, np.asarray([2.3]), None, np.nan, np.inf, Echogram(None, None, None, None)]
+    for wv in wrong_values:
+        with pytest.raises(TypeError, match='echogram_set must be an instance of EchogramSet'):
+            _validate_echogram_set(wv)
+
+    # ValueError: shape mismatch
+    with pytest.raises(ValueError, match='echogram set shape mismatch'):
+        l = 100
+        value = np.ones((l, 1))
+        time = np.ones((l))
+        order = np.ones((l, C), dtype='int')
+        coords = np.ones((l, C))
+        offsets = np.asarray([0, l+1])
+        channels = np.asarray([1])
+        gains = np.ones((l, 1))
+        lengths = np.asarray([[[l]]])
+        wv = EchogramSet(value, time, order, coords, offsets, channels, gains, lengths)
+        _validate_echogram_set(wv)
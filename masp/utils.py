@@ -33,6 +33,7 @@
 #
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 import csv
+import functools
 import numpy as np
 from scipy.special import sph_harm
 from masp.validate_data_types import _validate_int, _validate_ndarray_2D, _validate_string, _validate_ndarray_1D, \
@@ -270,13 +271,95 @@ def lagrange(N, delays):
 
     n = np.arange(N+1)
     h = np.ones((N+1, delays.size))
-    for l in range(delays.size):
-        for k in range(N+1):
-            idx = n[n != k]
-            h[idx, l] = h[idx, l] * (delays[l]-k) / (n[idx]-k)
+    # Product formula, accumulated over k for all taps and delays at once
+    for k in range(N+1):
+        idx = n[n != k]
+        h[idx, :] = h[idx, :] * (delays-k) / (n[idx, np.newaxis]-k)
     return h
 
 
+@functools.lru_cache(maxsize=16)
+def lagrange_table(N, resolution):
+    """
+    Table of fractional delay order-N lagrange filters, at uniformly spaced fractions of a sample.
+
+    Parameters
+    ----------
+    N : int
+        Filter order.
+    resolution : int
+        Number of fractional steps per sample.
+
+    Returns
+    -------
+    fractions : ndarray
+        Fractional delays, from 0 to 1. Dimension = (resolution+1)
+    h : ndarray
+        Filters, centered at N/2 samples. Dimension = (N+1, resolution+1)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    Tables are cached by (N, resolution), so they are computed once per process.
+    The returned arrays are therefore read-only.
+    """
+
+    _validate_int('N', N, positive=True)
+    _validate_int('resolution', resolution, positive=True)
+
+    fractions = np.linspace(0, 1, resolution+1)
+    h = lagrange(N, N//2 + fractions)
+    fractions.flags.writeable = False
+    h.flags.writeable = False
+    return fractions, h
+
+
+@functools.lru_cache(maxsize=16)
+def sinc_table(N, resolution):
+    """
+    Table of fractional delay order-N windowed sinc filters, at uniformly spaced fractions of a sample.
+
+    Parameters
+    ----------
+    N : int
+        Filter order.
+    resolution : int
+        Number of fractional steps per sample.
+
+    Returns
+    -------
+    fractions : ndarray
+        Fractional delays, from 0 to 1. Dimension = (resolution+1)
+    h : ndarray
+        Filters, centered at N/2 samples. Dimension = (N+1, resolution+1)
+
+    Raises
+    -----
+    TypeError, ValueError: if method arguments mismatch in type, dimension or value.
+
+    Notes
+    -----
+    The sinc is tapered by a Hann window centered at the fractional delay,
+    and each filter is normalised to unit DC gain.
+    Tables are cached by (N, resolution), so they are computed once per process.
+    The returned arrays are therefore read-only.
+    """
+
+    _validate_int('N', N, positive=True)
+    _validate_int('resolution', resolution, positive=True)
+
+    fractions = np.linspace(0, 1, resolution+1)
+    x = (np.arange(N+1) - N//2)[:, np.newaxis] - fractions
+    h = np.sinc(x) * 0.5 * (1 + np.cos(2 * np.pi * x / (N+2)))
+    h = h / np.sum(h, axis=0)
+    fractions.flags.writeable = False
+    h.flags.writeable = False
+    return fractions, h
+
+
 def isLambda(v):
     """
     Determine if a given argument is a lambda expression.
@@ -34,7 +34,8 @@
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
 import numpy as np
-from masp.shoebox_room_sim.echogram import Echogram, QuantisedEchogram
+from concurrent.futures import Executor
+from masp.shoebox_room_sim.echogram import Echogram, QuantisedEchogram, QuantisedEchogramSet, ImageSourceCloud, EchogramSet
 
 def _validate_boolean(name, boolean):
 
@@ -235,6 +236,14 @@ def _validate_string(name, string, choices=None):
     if choices is not None and string not in choices:
         raise ValueError(name + ' must be one of the following: ' + str(choices))
 
+def _validate_n_jobs(name, n_jobs):
+
+    if n_jobs is None or isinstance(n_jobs, Executor):
+        return
+    _validate_int(name, n_jobs)
+    if n_jobs == 0 or n_jobs < -1:
+        raise ValueError(name + ' must be None, -1 or a positive integer')
+
 
 def _validate_echogram(echogram):
     from masp.utils import C
@@ -265,6 +274,59 @@ def _validate_quantised_echogram(qechogram):
     if qechogram.value.shape[0] != qechogram.time.shape[0]:
         raise ValueError('quantised echogram shape mismatch')
 
+def _validate_quantised_echogram_set(qechogram_set, size=None):
+
+    if not isinstance(qechogram_set, QuantisedEchogramSet):
+        raise TypeError('qechogram_set must be an instance of QuantisedEchogramSet')
+
+    _validate_ndarray_2D('qechogram_set.value', qechogram_set.value)
+    _validate_ndarray_1D('qechogram_set.time', qechogram_set.time, positive=True)
+    _validate_ndarray_1D('qechogram_set.offsets', qechogram_set.offsets, size=None if size is None else size+1,
+                         positive=True, dtype=int)
+
+    shapes = [qechogram_set.value.shape[0], qechogram_set.time.shape[0], qechogram_set.offsets[-1]]
+    if not all(s == shapes[0] for s in shapes) or np.any(np.diff(qechogram_set.offsets) < 0):
+        raise ValueError('quantised echogram set shape mismatch')
+
+def _validate_image_source_cloud(cloud):
+    from masp.utils import C
+
+    if not isinstance(cloud, ImageSourceCloud):
+        raise TypeError('cloud must be an instance of ImageSourceCloud')
+
+    _validate_ndarray_1D('cloud.room', cloud.room, size=C, positive=True)
+    _validate_ndarray_2D('cloud.order', cloud.order, shape1=C, dtype=int)
+    _validate_ndarray_2D('cloud.coords', cloud.coords, shape1=C)
+    if cloud.d_max is not None:
+        _validate_number('cloud.d_max', cloud.d_max, positive=True)
+
+    if cloud.order.shape[0] != cloud.coords.shape[0]:
+        raise ValueError('image source cloud shape mismatch')
+
+def _validate_echogram_set(echogram_set):
+    from masp.utils import C
+
+    if not isinstance(echogram_set, EchogramSet):
+        raise TypeError('echogram_set must be an instance of EchogramSet')
+
+    _validate_ndarray_2D('echogram_set.value', echogram_set.value)
+    _validate_ndarray_1D('echogram_set.time', echogram_set.time, positive=True)
+    _validate_ndarray_2D('echogram_set.order', echogram_set.order, shape1=C, dtype=int)
+    _validate_ndarray_2D('echogram_set.coords', echogram_set.coords, shape1=C)
+    _validate_ndarray_2D('echogram_set.gains', echogram_set.gains)
+    _validate_ndarray_3D('echogram_set.lengths', echogram_set.lengths, shape2=echogram_set.gains.shape[1], positive=True)
+    nSrc, nRec, nBands = echogram_set.lengths.shape
+    _validate_ndarray_1D('echogram_set.offsets', echogram_set.offsets, size=nSrc*nRec+1, positive=True)
+    _validate_ndarray_1D('echogram_set.channels', echogram_set.channels, size=nRec, positive=True,
+                         limit=[1, echogram_set.value.shape[1]])
+
+    shapes = [echogram_set.value.shape[0], echogram_set.time.shape[0], echogram_set.order.shape[0],
+              echogram_set.coords.shape[0], echogram_set.gains.shape[0], echogram_set.offsets[-1]]
+    if not all(s == shapes[0] for s in shapes):
+        raise ValueError('echogram set shape mismatch')
+    if np.any(echogram_set.lengths > np.diff(echogram_set.offsets).reshape((nSrc, nRec, 1))):
+        raise ValueError('echogram set shape mismatch')
+
 def _validate_echogram_array(ndarray, shape0=None, shape1=None, shape2=None):
     """
     specific case of 2D/3D ndarray with dtype=Echogram